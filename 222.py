@@ -8,21 +8,94 @@ Coin Wallet - XODE 轻量级钱包客户端
   3. 内置 Web 界面，浏览器即可完成转账、查询
   4. 自动同步主节点手续费
 """
+import gzip
 import hashlib
+import io
 import json
 import requests
 import argparse
+import atexit
+import codecs
+import csv
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+import queue
 import threading
 import time
 import os
+import random
+import re
+import socket
+import socketserver
+import stat
+import sys
+import uuid
+import zlib
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
 from time import time as now
-from flask import Flask, request, jsonify, render_template_string
-from ecdsa import SigningKey, SECP256k1
+from urllib.parse import urlsplit
+from flask import Flask, Response, request, jsonify, render_template_string
+from ecdsa import BadSignatureError, SigningKey, VerifyingKey, SECP256k1
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # ---------------- 配置 ----------------
 MAIN_NODE = "62.234.183.74:9753"  # 主节点地址
 HEARTBEAT_INTERVAL = 75           # 心跳间隔（秒）
+HEARTBEAT_JITTER = 0.1            # 每次心跳间隔的随机浮动比例（±）
+HEARTBEAT_BACKOFF_MAX = 600       # 连续失败后心跳重试间隔上限（秒）
+HEARTBEAT_BATCH_SIZE = 1000       # 每个批量心跳请求包含的地址数
+HEARTBEAT_BATCH_REPROBE = 3600    # 主节点不支持批量接口后，隔多久再重试（秒）
+HEARTBEAT_MAX_SKEW = 300          # 替身节点：批量心跳时间戳允许的最大偏差（秒）
+FEE_REFRESH_INTERVAL = 300        # 网络手续费刷新间隔（秒）
 KEY_FILE = "wallet_key.json"      # 本地密钥文件
+CRYPTO_BACKEND = "auto"           # ECDSA 后端: auto (已安装则用原生库), ecdsa, coincurve
+RPC_SOCKET = "wallet.sock"        # 本地 JSON-RPC Unix 套接字
+PENDING_POLL_MIN = 5              # 出块期间待确认交易轮询间隔（秒）
+PENDING_POLL_MAX = 120            # 链无新块时待确认交易轮询间隔上限（秒）
+PENDING_EXPIRE = 3600             # 已发送交易提交后超过此时长仍未出现在历史中则标记为过期（秒）
+PENDING_CLOCK_SKEW = 300          # 向前翻页历史时允许的主节点/本地时钟偏差（秒）
+OUTBOX_FILE = "wallet_outbox.jsonl"  # 已签名未提交交易的持久化队列
+OUTBOX_RETRY_MAX = 60             # 主节点不可用时重试间隔上限（秒）
+OUTBOX_KEEP_DONE = 500            # 重启后保留的已完成发件箱记录数
+GZIP_MIN_SIZE = 1024              # 不小于该大小的 API 响应对支持的客户端启用 gzip
+PROFILE_DIR = "profiles"          # 采样性能分析结果输出目录
+PROFILE_SAMPLE_INTERVAL = 0.005   # 性能分析时两次栈采样的间隔（秒）
+PROFILE_MAX_SECONDS = 300         # 管理接口允许的最长分析时长（秒）
+LOG_RATE_WINDOW = 60              # 相同的警告/错误在每个时间窗口内最多记录一次（秒）
+READ_CONCURRENCY = 16             # 允许同时访问主节点的 /api 读请求数
+READ_QUEUE_LIMIT = 64             # 拒绝前允许排队等待的读请求数
+SEND_CONCURRENCY = 2              # 同时处理的 /api/send 请求数
+SEND_QUEUE_LIMIT = 8              # 拒绝前允许排队等待的转账请求数
+EXPORT_CONCURRENCY = 2            # /api/history/export 的并发导出流数
+EXPORT_QUEUE_LIMIT = 2            # 拒绝前允许排队等待的导出请求数
+WALK_CONCURRENCY = 2              # 可遍历完整历史的并发请求数（汇总、审计）
+WALK_QUEUE_LIMIT = 2              # 拒绝前允许排队等待的完整历史请求数
+ADMISSION_WAIT = 5                # 排队请求等待空位的最长时间（秒）
+ADMISSION_RETRY_AFTER = 2         # 拒绝时随 503 返回的 Retry-After（秒）
+WATCH_FILE = "wallet_watch.json"  # 仅观察地址（不含私钥）
+PORTFOLIO_CONCURRENCY = 16        # 刷新资产组合时的余额查询并发数
+PORTFOLIO_CACHE_TTL = 30          # 资产组合结果的缓存时长（秒）
+SNAPSHOT_FILE = "wallet_snapshot.json"  # 最近一次的余额/历史/链状态，启动时直接提供
+SNAPSHOT_INTERVAL = 60            # 快照保存间隔（秒）
+PUBLIC_IP_REFRESH = 600           # 公网 IP 重新探测间隔（秒）
+NODE_CACHE_SIZE = 64              # 为 ETag 重新验证保留的主节点响应数，超出时先淘汰最久未用的
+HISTORY_PAGE_SIZE = 200           # 为汇总同步完整历史时的分页大小
+HISTORY_RECENT_ROWS = 1000        # 重新同步时状态仍可能变化的最新历史行数
+HISTORY_SYNC_TTL = 30             # 历史汇总与主节点重新同步的最短间隔（秒）
+AUDIT_CACHE_FILE = "wallet_audit.jsonl"  # 已在本地验证过签名的交易 ID
+AUDIT_WORKERS = os.cpu_count() or 1  # 审计时并行验签的进程数
+AUDIT_CHUNK = 256                 # 每个发给审计进程的任务包含的签名数
+EXPORT_PREFETCH = 4               # 导出时在当前写入页之前预取的历史页数
+JSON_STREAM_MIN_BYTES = 65536     # 不小于此大小（或长度未知）的主节点响应体采用增量解析
 
 # ---------------- HTML 模板（Coin Wallet 界面）----------------
 HTML_TEMPLATE = """
@@ -85,7 +158,10 @@ HTML_TEMPLATE = """
         }
         .btn-submit:hover { opacity: 0.95; transform: translateY(-2px); box-shadow: 0 10px 25px rgba(178,31,31,0.3); }
         .btn-submit:disabled { background: #ccc; cursor: not-allowed; opacity: 0.6; transform: none; }
-        .tx-list { max-height: 500px; overflow-y: auto; }
+        .tx-list { max-height: 500px; overflow-y: auto; position: relative; }
+        .tx-spacer { position: relative; }
+        .tx-row { position: absolute; top: 0; left: 0; right: 0; }
+        .tx-row .tx-item { height: calc(100% - 4px); }
         .tx-item { 
             padding: 14px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between; 
             align-items: center; transition: all 0.2s; border-radius: 8px; margin-bottom: 4px;
@@ -225,24 +301,96 @@ HTML_TEMPLATE = """
                     document.getElementById('blockHeight').textContent = chainRes.stats.latest_block_height;
                 }
                 if (historyRes.code === 200) {
-                    renderTxList(historyRes.transactions || []);
+                    renderTxList(historyRes.transactions || [], historyRes.total_transactions || 0);
                     document.getElementById('txCount').textContent = historyRes.total_transactions || 0;
                 }
                 updateStatus(true);
+                // 数据来自启动快照：稍后再次轮询以获取实时数据
+                if (balanceRes.stale || historyRes.stale || chainRes.stale) setTimeout(refreshData, 3000);
             } catch (e) { console.error('刷新失败:', e); updateStatus(false); }
         }
-        function renderTxList(transactions) {
+        // 交易列表：按 txid 索引行，只有滚动窗口内的行保留在 DOM 中，
+        // 仅在状态/金额变化时重绘该行；滚动到底部时按需加载更早的分页。
+        const ROW_HEIGHT = 96, OVERSCAN = 6, PAGE_SIZE = 50;
+        const txById = new Map(), rowById = new Map();
+        const dateFormat = new Intl.DateTimeFormat(undefined, { dateStyle: 'short', timeStyle: 'medium' });
+        let txOrder = [], txTotal = 0, loadingMore = false, renderQueued = false;
+        function txKey(tx) { return tx.txid || `${tx.timestamp}:${tx.counterparty}:${tx.amount}`; }
+        function txVersion(tx) { return `${tx.status}|${tx.type}|${tx.amount}`; }
+        function mergeTransactions(transactions) {
+            let added = false, changed = false;
+            for (const tx of transactions) {
+                const key = txKey(tx), prev = txById.get(key);
+                if (!prev) added = true;
+                else if (txVersion(prev) === txVersion(tx)) continue;
+                txById.set(key, tx);
+                changed = true;
+            }
+            if (added) txOrder = [...txById.keys()].sort((a, b) => txById.get(b).timestamp - txById.get(a).timestamp);
+            return changed;
+        }
+        function renderTxList(transactions, total) {
+            mergeTransactions(transactions || []);
+            txTotal = Math.max(total || 0, txOrder.length);
             const list = document.getElementById('txList');
-            if (!transactions || transactions.length === 0) { list.innerHTML = '<div style="text-align: center; padding: 40px; color: #999;"><p>暂无交易记录</p><p style="font-size: 0.9em; margin-top: 10px;">转账后将在此显示</p></div>'; return; }
-            list.innerHTML = transactions.map(tx => {
-                const isOut = tx.type === 'outgoing', isPending = tx.status === 'pending';
-                const typeClass = isPending ? 'tx-pending' : (isOut ? 'tx-out' : 'tx-in');
-                const typeText = isPending ? '确认中' : (isOut ? '转出' : '转入');
-                const amountClass = isOut ? 'out' : 'in';
-                const sign = isOut ? '-' : '+';
-                const counterparty = isOut ? '→ ' + tx.counterparty.substring(0, 14) + '...' : '← ' + tx.counterparty.substring(0, 14) + '...';
-                return `<div class="tx-item"><div><span class="tx-type ${typeClass}">${typeText}</span><div style="margin-top: 6px; font-size: 0.9em; color: #555; font-weight: 500;">${counterparty}</div><div style="font-size: 0.8em; color: #999; margin-top: 4px;">${new Date(tx.timestamp * 1000).toLocaleString()}</div></div><div class="tx-amount ${amountClass}">${sign}${parseFloat(tx.amount).toFixed(2)}</div></div>`;
-            }).join('');
+            if (txOrder.length === 0) { list.innerHTML = '<div style="text-align: center; padding: 40px; color: #999;"><p>暂无交易记录</p><p style="font-size: 0.9em; margin-top: 10px;">转账后将在此显示</p></div>'; return; }
+            if (!document.getElementById('txSpacer')) {
+                list.innerHTML = '<div id="txSpacer" class="tx-spacer"></div>';
+                rowById.clear();
+                list.onscroll = scheduleRender;
+            }
+            scheduleRender();
+        }
+        function scheduleRender() {
+            if (!renderQueued) { renderQueued = true; requestAnimationFrame(renderWindow); }
+        }
+        function renderWindow() {
+            renderQueued = false;
+            const list = document.getElementById('txList'), spacer = document.getElementById('txSpacer');
+            if (!spacer) return;
+            spacer.style.height = (txOrder.length * ROW_HEIGHT) + 'px';
+            const first = Math.max(0, Math.floor(list.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const last = Math.min(txOrder.length, Math.ceil((list.scrollTop + list.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+            const visible = new Set(txOrder.slice(first, last));
+            for (const [key, row] of rowById) {
+                if (!visible.has(key)) { row.el.remove(); rowById.delete(key); }
+            }
+            for (let i = first; i < last; i++) {
+                const key = txOrder[i], tx = txById.get(key), version = txVersion(tx);
+                let row = rowById.get(key);
+                if (!row) {
+                    row = { el: document.createElement('div'), version: null };
+                    row.el.className = 'tx-row';
+                    row.el.style.height = ROW_HEIGHT + 'px';
+                    spacer.appendChild(row.el);
+                    rowById.set(key, row);
+                }
+                if (row.version !== version) { row.el.innerHTML = txRowHtml(tx); row.version = version; }
+                row.el.style.transform = `translateY(${i * ROW_HEIGHT}px)`;
+            }
+            if (last >= txOrder.length - OVERSCAN && txOrder.length < txTotal) loadMoreTransactions();
+        }
+        async function loadMoreTransactions() {
+            if (loadingMore) return;
+            loadingMore = true;
+            try {
+                const page = Math.floor(txOrder.length / PAGE_SIZE) + 1;
+                const res = await fetch(`/api/history?page=${page}&size=${PAGE_SIZE}`).then(r => r.json());
+                // 某页没有带来新记录，说明主节点已无更多历史
+                if (res.code === 200 && mergeTransactions(res.transactions || [])) txTotal = Math.max(res.total_transactions || 0, txOrder.length);
+                else txTotal = txOrder.length;
+                scheduleRender();
+            } catch (e) { console.error('加载更多失败:', e); }
+            finally { loadingMore = false; }
+        }
+        function txRowHtml(tx) {
+            const isOut = tx.type === 'outgoing', isPending = tx.status === 'pending';
+            const typeClass = isPending ? 'tx-pending' : (isOut ? 'tx-out' : 'tx-in');
+            const typeText = isPending ? '确认中' : (isOut ? '转出' : '转入');
+            const amountClass = isOut ? 'out' : 'in';
+            const sign = isOut ? '-' : '+';
+            const counterparty = isOut ? '→ ' + tx.counterparty.substring(0, 14) + '...' : '← ' + tx.counterparty.substring(0, 14) + '...';
+            return `<div class="tx-item"><div><span class="tx-type ${typeClass}">${typeText}</span><div style="margin-top: 6px; font-size: 0.9em; color: #555; font-weight: 500;">${counterparty}</div><div style="font-size: 0.8em; color: #999; margin-top: 4px;">${dateFormat.format(new Date(tx.timestamp * 1000))}</div></div><div class="tx-amount ${amountClass}">${sign}${parseFloat(tx.amount).toFixed(2)}</div></div>`;
         }
         async function sendTransaction(e) {
             e.preventDefault();
@@ -254,7 +402,7 @@ HTML_TEMPLATE = """
             btn.disabled = true; btn.innerHTML = '<div class="loading" style="width: 18px; height: 18px; border-width: 2px; margin-right: 8px;"></div> 处理中...';
             try {
                 const res = await fetch('/api/send', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({recipient, amount, fee}) }).then(r => r.json());
-                if (res.code === 201) { showToast('转账成功！', `交易ID: ${res.txid.substring(0, 16)}...`, 'success'); document.getElementById('sendForm').reset(); setTimeout(refreshData, 1500); }
+                if (res.code === 201 || res.code === 202) { showToast(res.queued ? '已加入发送队列' : '转账成功！', `交易ID: ${(res.txid || res.outbox_id).substring(0, 16)}...`, 'success'); document.getElementById('sendForm').reset(); setTimeout(refreshData, 1500); }
                 else { showToast('转账失败', res.error || '请检查余额或网络', 'error'); }
             } catch (e) { showToast('网络错误', '无法连接到钱包服务', 'error'); }
             finally { btn.disabled = false; btn.innerHTML = originalText; }
@@ -271,16 +419,134 @@ HTML_TEMPLATE = """
 """
 
 # ---------------- 加密/工具函数 ----------------
-def gen_keypair():
-    sk = SigningKey.generate(curve=SECP256k1)
-    pk_bytes = sk.get_verifying_key().to_string()
+# 所有后端共用的线上格式 (即主节点所用的 `ecdsa` 包默认值):
+# 32 字节私钥, 64 字节 x||y 公钥, SHA-1 消息摘要, 64 字节 r||s 签名。
+class EcdsaBackend:
+    name = 'ecdsa'
+    
+    @functools.lru_cache(maxsize=64)
+    def signing_key(self, sk_bytes):
+        # 解析私钥需推导公钥点, 开销与一次签名相当
+        return SigningKey.from_string(sk_bytes, curve=SECP256k1)
+    
+    def generate(self):
+        sk = SigningKey.generate(curve=SECP256k1)
+        return sk.to_string(), sk.get_verifying_key().to_string()
+    
+    def public_key(self, sk_bytes):
+        return self.signing_key(sk_bytes).get_verifying_key().to_string()
+    
+    def sign(self, sk_bytes, payload):
+        return self.signing_key(sk_bytes).sign(payload)
+    
+    def verify(self, pk_bytes, signature, payload):
+        try:
+            return VerifyingKey.from_string(pk_bytes, curve=SECP256k1).verify(signature, payload)
+        except (BadSignatureError, ValueError, AssertionError):
+            return False
+
+class CoincurveBackend:
+    # 通过可选的 `coincurve` 包调用 libsecp256k1
+    name = 'coincurve'
+    
+    def __init__(self):
+        import coincurve
+        self.lib = coincurve
+    
+    @staticmethod
+    def digest(payload):
+        # ecdsa 用 SHA-1 哈希并把 20 字节摘要当作整数; 左侧补零
+        # 到 libsecp256k1 要求的 32 字节后该整数 (以及签名) 保持不变
+        return hashlib.sha1(payload).digest().rjust(32, b'\0')
+    
+    def generate(self):
+        sk = self.lib.PrivateKey()
+        return sk.secret, sk.public_key.format(compressed=False)[1:]
+    
+    def public_key(self, sk_bytes):
+        return self.lib.PrivateKey(sk_bytes).public_key.format(compressed=False)[1:]
+    
+    def sign(self, sk_bytes, payload):
+        return self.lib.PrivateKey(sk_bytes).sign_recoverable(payload, hasher=self.digest)[:64]
+    
+    def verify(self, pk_bytes, signature, payload):
+        if len(signature) != 64 or len(pk_bytes) != 64:
+            return False
+        r = int.from_bytes(signature[:32], 'big')
+        s = int.from_bytes(signature[32:], 'big')
+        # libsecp256k1 只接受 low-S; (r, n - s) 是同一签名的镜像
+        n = SECP256k1.order
+        if s > n // 2:
+            s = n - s
+        try:
+            pk = self.lib.PublicKey(b'\x04' + pk_bytes)
+            return pk.verify(der_signature(r, s), payload, hasher=self.digest)
+        except ValueError:
+            return False
+
+def der_signature(r, s):
+    def der_int(x):
+        b = x.to_bytes((x.bit_length() + 8) // 8 or 1, 'big')
+        return b'\x02' + bytes([len(b)]) + b
+    body = der_int(r) + der_int(s)
+    return b'\x30' + bytes([len(body)]) + body
+
+def load_crypto_backend(name=CRYPTO_BACKEND):
+    if name in ('auto', 'coincurve'):
+        try:
+            return CoincurveBackend()
+        except ImportError:
+            if name == 'coincurve':
+                raise
+    return EcdsaBackend()
+
+crypto = load_crypto_backend()
+
+def address_of(pk_bytes: bytes) -> str:
     pk_hash = hashlib.sha256(pk_bytes).hexdigest()[:16]
-    addr = f'coin{pk_hash}'
-    return sk.to_string().hex(), addr, pk_bytes
+    return f'coin{pk_hash}'
+
+def gen_keypair():
+    sk_bytes, pk_bytes = crypto.generate()
+    return sk_bytes.hex(), address_of(pk_bytes), pk_bytes
 
 def sign(sk_hex: str, payload: bytes) -> str:
-    sk = SigningKey.from_string(bytes.fromhex(sk_hex), curve=SECP256k1)
-    return sk.sign(payload).hex()
+    return crypto.sign(bytes.fromhex(sk_hex), payload).hex()
+
+def verify(pk_bytes: bytes, sig_hex: str, payload: bytes) -> bool:
+    try:
+        return crypto.verify(pk_bytes, bytes.fromhex(sig_hex), payload)
+    except ValueError:
+        return False
+
+def bench_crypto(rounds=200):
+    # 对每个后端计时生成密钥/签名/验签, 并交叉检查互通性
+    backends = [EcdsaBackend()]
+    try:
+        backends.append(CoincurveBackend())
+    except ImportError:
+        print("未安装 coincurve: 仅测试 ecdsa 后端 (pip install coincurve)")
+    payload = tx_payload('coin0000000000000000', 'coin1111111111111111', 1.5, 7, 2.0)
+    print(f"{'backend':<10} {'keygen/s':>10} {'sign/s':>10} {'verify/s':>10}")
+    for b in backends:
+        start = time.perf_counter()
+        keys = [b.generate() for _ in range(rounds)]
+        keygen = rounds / (time.perf_counter() - start)
+        start = time.perf_counter()
+        sigs = [b.sign(sk, payload) for sk, _ in keys]
+        signing = rounds / (time.perf_counter() - start)
+        start = time.perf_counter()
+        ok = all(b.verify(pk, sig, payload) for (_, pk), sig in zip(keys, sigs))
+        verifying = rounds / (time.perf_counter() - start)
+        print(f"{b.name:<10} {keygen:>10.0f} {signing:>10.0f} {verifying:>10.0f}{'' if ok else '  VERIFY FAILED'}")
+    for a in backends:
+        for b in backends:
+            if a is b:
+                continue
+            sk, pk = a.generate()
+            same_key = b.public_key(sk) == pk
+            cross = b.verify(pk, a.sign(sk, payload), payload)
+            print(f"{a.name} -> {b.name}: public key {'match' if same_key else 'MISMATCH'}, signature {'accepted' if cross else 'REJECTED'}")
 
 def tx_payload(sender: str, recipient: str, amount: float, nonce: int, fee: float) -> bytes:
     core_data = dict(sender=sender, recipient=recipient, amount=amount, nonce=nonce, fee=fee)
@@ -289,6 +555,894 @@ def tx_payload(sender: str, recipient: str, amount: float, nonce: int, fee: floa
     sign_data = dict(core_txid=core_txid, **core_data)
     return json.dumps(sign_data, sort_keys=True, separators=(',', ':')).encode()
 
+def heartbeat_payload(real_address: str, coin_addr: str, timestamp: int) -> bytes:
+    data = dict(real_address=real_address, coin_addr=coin_addr, timestamp=timestamp)
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+
+def read_json(resp, array_key):
+    # 小响应体用一次 resp.json() 解码约快一倍；增量解析器
+    # 只有在响应体大到内存占用值得关注时才划算
+    length = resp.headers.get('Content-Length')
+    if length is not None and length.isdigit() and int(length) < JSON_STREAM_MIN_BYTES:
+        return resp.json()
+    return parse_json_stream(resp, array_key)
+
+def parse_json_stream(resp, array_key):
+    # 直接从套接字解析 JSON 响应体（请求须以 stream=True 发出）。
+    # 第一个 `array_key` 数组中的元素随字节到达逐个解码，
+    # 因此不会完整持有响应体；resp.json() 会同时持有字节、文本和对象。
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    scanner = json.JSONDecoder()
+    key = re.compile(r'"%s"\s*:\s*\[' % re.escape(array_key))
+    head, tail, items, keys = [], [], [], {}
+    buf, state = '', 'head'
+    for chunk in resp.iter_content(chunk_size=65536):
+        buf += decoder.decode(chunk)
+        if state == 'head':
+            m = key.search(buf)
+            if not m:
+                # 保留足够长的尾部，以捕获跨块拆开的键
+                keep = len(array_key) + 64
+                head.append(buf[:-keep])
+                buf = buf[-keep:]
+                continue
+            head.append(buf[:m.end() - 1])
+            buf, state = buf[m.end():], 'items'
+        if state == 'items':
+            pos = 0
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buf) and buf[pos] == ']':
+                    buf, state = buf[pos + 1:], 'tail'
+                    break
+                try:
+                    item, end = scanner.raw_decode(buf, pos)
+                except ValueError:
+                    break  # 元素尚未接收完整
+                if end == len(buf) or buf[end] not in ' \t\r\n,]':
+                    break  # 数字可能在下一块中继续
+                if isinstance(item, dict):
+                    # 分开解码不像一次 json.loads 那样共享键字符串
+                    item = {keys.setdefault(k, k): v for k, v in item.items()}
+                items.append(item)
+                pos = end
+            if state == 'items':
+                buf = buf[pos:]
+        if state == 'tail':
+            tail.append(buf)
+            buf = ''
+    buf += decoder.decode(b'', final=True)
+    if state == 'head':
+        return json.loads(''.join(head) + buf)
+    if state != 'tail':
+        raise ValueError(f"JSON 被截断：{array_key} 数组未结束")
+    # 用一次性字符串标记流式数组的确切位置，无论信封中
+    # 还有多少个其他 `array_key` 键
+    placeholder = uuid.uuid4().hex
+    envelope = json.loads(''.join(head) + json.dumps(placeholder) + ''.join(tail) + buf)
+    fill_placeholder(envelope, placeholder, items)
+    return envelope
+
+def fill_placeholder(obj, placeholder, value):
+    if isinstance(obj, dict):
+        entries = obj.items()
+    elif isinstance(obj, list):
+        entries = enumerate(obj)
+    else:
+        return False
+    for k, v in entries:
+        if isinstance(v, str) and v == placeholder:
+            obj[k] = value
+            return True
+        if fill_placeholder(v, placeholder, value):
+            return True
+    return False
+
+def parse_retry_after(value):
+    # Retry-After 可以是秒数，也可以是 HTTP 日期
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - now(), 0)
+    except (TypeError, ValueError):
+        return None
+
+# ---------------- 日志 ----------------
+# 通过 QueueHandler 输出 JSON 行：调用方只负责序列化和入队，I/O 由监听线程完成。
+log = logging.getLogger('coinwallet')
+_log_context = threading.local()
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = getattr(_log_context, 'request_id', None)
+        return True
+
+class RateLimitFilter(logging.Filter):
+    # 以消息模板为键，同一类失败即使细节不同也会合并；
+    # 下一条放行的记录会带上期间被丢弃的条数。
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.seen = {}
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        with self.lock:
+            last, suppressed = self.seen.get(key, (0, 0))
+            if record.created - last < self.window:
+                self.seen[key] = (last, suppressed + 1)
+                return False
+            self.seen[key] = (record.created, 0)
+        record.suppressed = suppressed
+        return True
+
+def setup_logging(level='INFO', stream=None):
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(ContextFilter())
+    handler.addFilter(RateLimitFilter(LOG_RATE_WINDOW))
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(records, output)
+    for logger in (log, logging.getLogger('werkzeug')):
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+# ---------------- 性能分析 ----------------
+_timing = threading.local()
+server_timing = False
+
+@contextmanager
+def timed(phase):
+    # 将代码块耗时计入当前 API 请求的 Server-Timing 头；请求之外不做任何事
+    phases = getattr(_timing, 'phases', None)
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0) + (time.perf_counter() - start) * 1000
+
+class SamplingProfiler:
+    # 通过 sys._current_frames() 采样所有线程的调用栈，输出折叠栈格式
+    # （每行 "outer;inner;leaf count"），可直接用于 flamegraph.pl 和 speedscope。
+    lock = threading.Lock()
+    
+    def __init__(self, seconds, interval=PROFILE_SAMPLE_INTERVAL):
+        self.seconds = seconds
+        self.interval = interval
+        self.path = os.path.join(PROFILE_DIR, time.strftime('profile-%Y%m%d-%H%M%S.folded'))
+    
+    def start(self):
+        if not SamplingProfiler.lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self.run, daemon=True).start()
+        return True
+    
+    def run(self):
+        try:
+            me = threading.get_ident()
+            stacks = Counter()
+            deadline = now() + self.seconds
+            while now() < deadline:
+                for tid, frame in sys._current_frames().items():
+                    if tid == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stacks[';'.join(reversed(stack))] += 1
+                time.sleep(self.interval)
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            log.info("性能分析已写入: %s（%d 个样本）", self.path, sum(stacks.values()))
+        except Exception:
+            log.exception("性能分析异常")
+        finally:
+            SamplingProfiler.lock.release()
+
+# ---------------- 待确认交易跟踪 ----------------
+class PendingTracker:
+    # 只有出新块时确认状态才会变化，因此轮询以 latest_block_height 为准，
+    # 并将所有到期 txid 与向前翻至其提交时间的历史页逐一比对。
+    def __init__(self, wallet, webhook=None):
+        self.wallet = wallet
+        self.webhook = webhook
+        self.pending = {}
+        self.confirmed = deque(maxlen=100)
+        self.expired = deque(maxlen=100)
+        self.callbacks = []
+        self.last_height = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+    
+    def add(self, result, recipient):
+        if not result.get('txid'):
+            return
+        with self.lock:
+            self.pending[result['txid']] = {
+                "txid": result['txid'],
+                "recipient": recipient,
+                "amount": result.get('amount'),
+                "fee": result.get('fee'),
+                "nonce": result.get('nonce'),
+                "pending_block": result.get('pending_block'),
+                "submitted_at": now(),
+                "status": "pending"
+            }
+        self.wake.set()
+    
+    def on_confirm(self, callback):
+        self.callbacks.append(callback)
+    
+    def status(self):
+        with self.lock:
+            return {"pending": list(self.pending.values()), "confirmed": list(self.confirmed), "expired": list(self.expired), "block_height": self.last_height}
+    
+    def poll(self):
+        stats = self.wallet.get_chain_stats()
+        if not stats or stats.get('latest_block_height') is None:
+            return False
+        height = stats['latest_block_height']
+        if height == self.last_height:
+            return False
+        with self.lock:
+            due = [tx for tx in self.pending.values()
+                   if not isinstance(tx['pending_block'], int) or tx['pending_block'] <= height]
+        if not due:
+            self.last_height = height
+            return True
+        statuses = self.wallet.get_tx_statuses({tx['txid'] for tx in due}, min(tx['submitted_at'] for tx in due))
+        if statuses is None:
+            return False  # 下次轮询即重试，而不必等到下一个区块
+        self.last_height = height
+        for tx in due:
+            status = statuses.get(tx['txid'])
+            if status is None and now() - tx['submitted_at'] >= PENDING_EXPIRE:
+                # 从未出现在历史中：主节点已丢弃该交易
+                with self.lock:
+                    self.pending.pop(tx['txid'], None)
+                    tx['status'] = 'expired'
+                    self.expired.appendleft(tx)
+                log.warning("交易 %s 提交 %d 秒后仍不在历史中，已标记为过期", tx['txid'], PENDING_EXPIRE)
+            elif status and status != 'pending':
+                with self.lock:
+                    self.pending.pop(tx['txid'], None)
+                    tx['status'] = status
+                    tx['confirmed_at'] = now()
+                    tx['confirmed_height'] = height
+                    self.confirmed.appendleft(tx)
+                self.notify(tx)
+        return True
+    
+    def notify(self, tx):
+        log.info("交易已确认: %s (区块 %s)", tx['txid'], tx['confirmed_height'])
+        for callback in self.callbacks:
+            try:
+                callback(tx)
+            except Exception:
+                log.exception("确认回调异常")
+        if self.webhook:
+            threading.Thread(target=self.post_webhook, args=(tx,), daemon=True).start()
+    
+    def post_webhook(self, tx):
+        try:
+            requests.post(self.webhook, json={"event": "tx_confirmed", "transaction": tx}, timeout=10)
+        except Exception as e:
+            log.warning("Webhook 推送失败: %s", e)
+    
+    def loop(self):
+        delay = PENDING_POLL_MIN
+        while self.wallet.running:
+            self.wake.wait(delay)
+            self.wake.clear()
+            if not self.pending:
+                delay = PENDING_POLL_MAX
+                continue
+            try:
+                advanced = self.poll()
+            except Exception:
+                log.exception("待确认跟踪异常")
+                advanced = False
+            # 区块高度不变时逐步退避，高度变化后立即恢复
+            delay = PENDING_POLL_MIN if advanced else min(delay * 2, PENDING_POLL_MAX)
+
+# ---------------- 离线发件箱 ----------------
+class NodeUnavailable(Exception):
+    pass
+
+class Outbox:
+    # 追加式日志：每笔已签名交易一行 "queue" 记录，之后追加 "status" 记录。
+    # 每次写入都先 fsync 再向调用方确认。
+    def __init__(self, wallet, path=OUTBOX_FILE):
+        self.wallet = wallet
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.load()
+    
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # 写入中途崩溃留下的残缺末行
+                    if rec.get('op') == 'queue':
+                        self.entries[rec['entry']['id']] = rec['entry']
+                    elif rec.get('op') == 'status' and rec.get('id') in self.entries:
+                        self.entries[rec['id']].update(rec['fields'])
+        self.compact()
+    
+    def compact(self):
+        done = [e for e in self.entries.values() if e['status'] != 'queued']
+        done.sort(key=lambda e: e.get('updated_at', 0))
+        for e in done[:-OUTBOX_KEEP_DONE]:
+            del self.entries[e['id']]
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for e in sorted(self.entries.values(), key=lambda e: e['nonce']):
+                f.write(json.dumps({"op": "queue", "entry": e}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+    
+    def append(self, rec):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(rec, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def enqueue(self, tx_data, fee):
+        entry = {
+            "id": hashlib.sha256(tx_data['signature'].encode()).hexdigest()[:16],
+            "nonce": tx_data['nonce'],
+            "fee": fee,
+            "tx": tx_data,
+            "status": "queued",
+            "queued_at": now(),
+            "updated_at": now()
+        }
+        with self.lock:
+            self.append({"op": "queue", "entry": entry})
+            self.entries[entry['id']] = entry
+        self.wake.set()
+        return entry
+    
+    def mark(self, entry_id, **fields):
+        fields['updated_at'] = now()
+        with self.lock:
+            self.append({"op": "status", "id": entry_id, "fields": fields})
+            self.entries[entry_id].update(fields)
+    
+    def get(self, entry_id):
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            return dict(entry) if entry else None
+    
+    def status(self):
+        with self.lock:
+            entries = sorted((dict(e) for e in self.entries.values()), key=lambda e: e['nonce'])
+        counts = {}
+        for e in entries:
+            counts[e['status']] = counts.get(e['status'], 0) + 1
+        return {"counts": counts, "entries": entries}
+    
+    def accepted(self, entry, result):
+        self.mark(entry['id'], status="submitted", txid=result.get('txid'), pending_block=result.get('pending_block'))
+        self.wallet.tracker.add({**result, "nonce": entry['nonce'], "fee": entry['fee'], "amount": entry['tx']['amount']}, entry['tx']['recipient'])
+    
+    def submit(self, entry):
+        # 主节点已收下交易时返回 True，最终被拒时返回 False；NodeUnavailable 则保留在队列中
+        try:
+            status, result = self.wallet.post_transaction(entry['tx'])
+        except (requests.RequestException, ValueError) as e:
+            raise NodeUnavailable(str(e))
+        if status == 201:
+            self.accepted(entry, result)
+            return True
+        error = result.get('error', f'HTTP {status}')
+        if status == 429 or status >= 500:
+            raise NodeUnavailable(error)
+        if status in (400, 409) and 'nonce' in error.lower():
+            with self.lock:
+                lower = any(e['status'] == 'queued' and e['nonce'] < entry['nonce'] for e in self.entries.values())
+            if lower:
+                raise NodeUnavailable(f"nonce {entry['nonce']} 需等待队列中更小的 nonce: {error}")
+        # 超时的提交可能已经成功；此时重新提交会被当作重复交易拒绝
+        row = self.wallet.find_sent_nonce(entry['nonce'], entry['queued_at'])
+        if row is not None:
+            tx = entry['tx']
+            if row.get('signature') == tx['signature'] or (not row.get('signature') and row.get('recipient', row.get('counterparty')) == tx['recipient']):
+                self.accepted(entry, {"txid": row.get('txid')})
+                return True
+        self.mark(entry['id'], status="failed", error=error)
+        if row is None:
+            self.close_gap(entry['nonce'])
+        return False
+    
+    def close_gap(self, nonce):
+        # 主节点从未使用该 nonce，之后的 nonce 都会因超前而被拒：
+        # 将其后排队的条目各减一重新签名，并归还最大的 nonce
+        wallet = self.wallet
+        with wallet.send_lock:
+            with self.lock:
+                later = sorted((e for e in self.entries.values() if e['status'] == 'queued' and e['nonce'] > nonce), key=lambda e: e['nonce'])
+            for e in later:
+                tx = wallet.sign_tx(e['tx']['recipient'], e['tx']['amount'], e['nonce'] - 1, e['fee'])
+                self.mark(e['id'], nonce=e['nonce'] - 1, tx=tx)
+            if wallet.last_nonce >= nonce:
+                wallet.last_nonce -= 1
+                wallet.save_key()
+    
+    def flush(self):
+        with self.lock:
+            queued = sorted((e for e in self.entries.values() if e['status'] == 'queued'), key=lambda e: e['nonce'])
+        # 按 nonce 顺序逐笔提交：主节点尚未接受的交易不能被后面的交易超越
+        for entry in queued:
+            if not self.submit(entry):
+                self.wake.set()  # 后续条目可能已重新编号；从最小的 nonce 重新开始
+                return
+    
+    def loop(self):
+        delay = 1
+        while self.wallet.running:
+            self.wake.wait(delay)
+            self.wake.clear()
+            try:
+                self.flush()
+                delay = OUTBOX_RETRY_MAX
+            except NodeUnavailable as e:
+                delay = min(max(delay, 1) * 2, OUTBOX_RETRY_MAX)
+                log.warning("主节点不可用，发件箱 %s 秒后重试: %s", delay, e)
+            except Exception:
+                delay = OUTBOX_RETRY_MAX
+                log.exception("发件箱提交异常")
+
+# ---------------- 列式历史 ----------------
+class HistoryColumns:
+    # 完整地址历史按字段各存一个定长数组（每行约 30 字节，而不是一个 dict）；
+    # 对方地址驻留为小整数，分组只需整数运算。
+    STATE = ('ts', 'amount', 'fee', 'outgoing', 'pending', 'cp', 'cp_ids', 'cp_names', 'recent', 'recent_order')
+    
+    def __init__(self, wallet):
+        self.wallet = wallet
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.synced_at = 0
+        self.complete = False
+        self.clear()
+    
+    def clear(self):
+        self.ts = array('q')
+        self.amount = array('d')
+        self.fee = array('d')
+        self.outgoing = array('b')
+        self.pending = array('b')
+        self.cp = array('I')
+        self.cp_ids = {}
+        self.cp_names = []
+        self.recent = {}  # row_key -> 行号，仅保存最新的 HISTORY_RECENT_ROWS 行
+        self.recent_order = deque()  # 最旧的在左侧
+    
+    def __len__(self):
+        return len(self.ts)
+    
+    @staticmethod
+    def row_key(tx):
+        # 主节点返回的无 txid 记录改用内容区分
+        return tx.get('txid') or (tx.get('timestamp'), tx.get('counterparty'), tx.get('amount'), tx.get('type'))
+    
+    def ingest(self, tx, newest=True):
+        # `newest` 行比已有的都新；回填行比已有的都旧
+        key = self.row_key(tx)
+        pending = 1 if tx.get('status') == 'pending' else 0
+        row = self.recent.get(key)
+        if row is not None:
+            self.pending[row] = pending
+            return
+        counterparty = tx.get('counterparty') or ''
+        cp_id = self.cp_ids.get(counterparty)
+        if cp_id is None:
+            cp_id = self.cp_ids[counterparty] = len(self.cp_names)
+            self.cp_names.append(counterparty)
+        outgoing = tx.get('type') == 'outgoing'
+        self.ts.append(int(tx.get('timestamp') or 0))
+        self.amount.append(float(tx.get('amount') or 0))
+        self.fee.append(float(tx.get('fee') or 0) if outgoing else 0.0)
+        self.outgoing.append(1 if outgoing else 0)
+        self.pending.append(pending)
+        self.cp.append(cp_id)
+        if newest:
+            self.recent[key] = len(self.ts) - 1
+            self.recent_order.append(key)
+            if len(self.recent_order) > HISTORY_RECENT_ROWS:
+                del self.recent[self.recent_order.popleft()]
+        elif len(self.recent_order) < HISTORY_RECENT_ROWS:
+            self.recent[key] = len(self.ts) - 1
+            self.recent_order.appendleft(key)
+    
+    def sync(self, max_age=HISTORY_SYNC_TTL):
+        with self.sync_lock:
+            if now() - self.synced_at < max_age:
+                return
+            if self.complete:
+                self.sync_head()
+            else:
+                self.backfill()
+            self.synced_at = now()
+    
+    def sync_head(self):
+        # 分页按最新在前返回：读到包含已有行的一页为止，再从最旧的开始写入
+        txs = []
+        page = 1
+        while True:
+            batch = self.wallet.fetch_history_page(page)
+            txs.extend(batch)
+            if len(batch) < HISTORY_PAGE_SIZE or any(self.row_key(tx) in self.recent for tx in batch):
+                break
+            if len(txs) >= HISTORY_RECENT_ROWS:
+                # 新增行超出去重窗口；宁可重建也不冒重复的风险
+                return self.backfill()
+            page += 1
+        # 从第一条已持有的记录往下都是旧记录：只有待确认标记可能变化
+        cut = next((i for i, tx in enumerate(txs) if self.row_key(tx) in self.recent), len(txs))
+        with self.lock:
+            for tx in reversed(txs[cut:]):
+                if self.row_key(tx) in self.recent:
+                    self.ingest(tx)
+            for tx in reversed(txs[:cut]):
+                self.ingest(tx)
+    
+    def backfill(self):
+        # 另行构建后整体替换，中途失败时仍提供之前的汇总
+        fresh = HistoryColumns(self.wallet)
+        page = 1
+        after = None
+        while True:
+            txs = self.wallet.fetch_history_page(page)
+            last = len(txs) < HISTORY_PAGE_SIZE
+            # 遍历途中到达的新交易会把记录挤到下一页；丢弃直到上次最后一条为止的记录
+            if after is not None:
+                keys = [self.row_key(tx) for tx in txs]
+                if after in keys:
+                    txs = txs[keys.index(after) + 1:]
+            for tx in txs:
+                fresh.ingest(tx, newest=False)
+            if txs:
+                after = self.row_key(txs[-1])
+            if last:
+                break
+            page += 1
+        with self.lock:
+            for name in self.STATE:
+                setattr(self, name, getattr(fresh, name))
+        self.complete = True
+        log.info("历史已同步: %s 笔交易，%s 个对方地址", len(self), len(self.cp_names))
+    
+    def summary(self, by='counterparty', since=None, until=None, include_pending=False, limit=100):
+        with self.lock:
+            if np is not None:
+                groups = self.aggregate_numpy(by, since, until, include_pending)
+            else:
+                groups = self.aggregate_python(by, since, until, include_pending)
+            rows = len(self)
+        totals = {k: sum(g[k] for g in groups) for k in ('inflow', 'outflow', 'fees', 'count')}
+        totals['net'] = totals['inflow'] - totals['outflow'] - totals['fees']
+        if by == 'counterparty':
+            groups.sort(key=lambda g: g['inflow'] + g['outflow'], reverse=True)
+            groups = groups[:limit]
+        else:
+            groups.sort(key=lambda g: g['key'])
+        return {"by": by, "groups": groups, "totals": totals, "rows": rows, "synced_at": self.synced_at}
+    
+    def group_key(self, by, key):
+        if by == 'counterparty':
+            return self.cp_names[key]
+        return time.strftime('%Y-%m-%d', time.gmtime(key * 86400))
+    
+    def group_row(self, by, key, inflow, outflow, fees, count):
+        return {"key": self.group_key(by, key), "inflow": inflow, "outflow": outflow, "fees": fees,
+                "net": inflow - outflow - fees, "count": count}
+    
+    def aggregate_numpy(self, by, since, until, include_pending):
+        # 数组上的零拷贝视图；数组再次增长前这些视图必须已释放，
+        # 因此这里作为单独的调用在锁内执行。
+        ts = np.frombuffer(self.ts, dtype=np.int64)
+        if not len(ts):
+            return []
+        keep = np.ones(len(ts), dtype=bool)
+        if since is not None:
+            keep &= ts >= since
+        if until is not None:
+            keep &= ts < until
+        if not include_pending:
+            keep &= np.frombuffer(self.pending, dtype=np.int8) == 0
+        # 分组 id 是紧凑的小整数（驻留的对方地址或天数偏移），由 bincount 完成分组；
+        # 被过滤的行权重为零，而不是被复制出来
+        if by == 'counterparty':
+            index = np.frombuffer(self.cp, dtype=np.uint32).astype(np.intp)
+            base = 0
+        else:
+            days = ts // 86400
+            base = int(days.min())
+            index = days - base
+        outgoing = np.frombuffer(self.outgoing, dtype=np.int8).view(bool)
+        amount = np.frombuffer(self.amount, dtype=np.float64)
+        fee = np.frombuffer(self.fee, dtype=np.float64)
+        inflow = np.bincount(index, weights=np.where(keep & ~outgoing, amount, 0.0))
+        outflow = np.bincount(index, weights=np.where(keep & outgoing, amount, 0.0))
+        fees = np.bincount(index, weights=np.where(keep, fee, 0.0))
+        counts = np.bincount(index, weights=keep)
+        return [self.group_row(by, base + int(k), float(inflow[k]), float(outflow[k]), float(fees[k]), int(counts[k]))
+                for k in np.flatnonzero(counts)]
+    
+    def aggregate_python(self, by, since, until, include_pending):
+        lo = since if since is not None else -2**63
+        hi = until if until is not None else 2**63
+        keys = self.cp if by == 'counterparty' else (ts // 86400 for ts in self.ts)
+        acc = {}
+        for key, ts, amount, fee, outgoing, pending in zip(keys, self.ts, self.amount, self.fee, self.outgoing, self.pending):
+            if lo <= ts < hi and not (pending and not include_pending):
+                g = acc.get(key)
+                if g is None:
+                    g = acc[key] = [0.0, 0.0, 0.0, 0]
+                g[outgoing] += amount
+                g[2] += fee
+                g[3] += 1
+        return [self.group_row(by, k, *g) for k, g in acc.items()]
+
+# ---------------- 历史审计 ----------------
+def audit_init(backend):
+    # 审计进程以 spawn 方式全新启动，因此需显式沿用父进程的加密后端
+    global crypto
+    crypto = load_crypto_backend(backend)
+
+def audit_verify_chunk(items):
+    return [(txid, any(verify(bytes.fromhex(pk_hex), sig_hex, payload) for payload in payloads))
+            for txid, pk_hex, sig_hex, payloads in items]
+
+class HistoryAudit:
+    # 在本地按 tx_payload 重新验证历史签名。已验证的交易 ID 连同所验证内容的指纹
+    # 记录在只追加文件中，因此每条记录只验证一次，
+    # 只有主节点对它返回的内容发生变化时才会重新验证。
+    def __init__(self, wallet, path=AUDIT_CACHE_FILE):
+        self.wallet = wallet
+        self.path = path
+        self.verified = {}
+        self.running = threading.Lock()
+        self.load()
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    self.verified[rec['txid']] = rec['fp']
+                except (ValueError, KeyError):
+                    continue  # 写入中途崩溃留下的残缺末行
+    
+    def save(self, recs):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for txid, fp in recs:
+                f.write(json.dumps({"txid": txid, "fp": fp}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def prepare(self, tx):
+        # 返回 (任务, None)、(None, 不一致原因)，无法验证时返回 (None, None)
+        sender, sig_hex = tx.get('sender'), tx.get('signature')
+        pk_hex = tx.get('pubkey_hex') or tx.get('public_key')
+        if not pk_hex and sender == self.wallet.coin_addr:
+            pk_hex = self.wallet.pk_bytes.hex()
+        if not (tx.get('txid') and sender and sig_hex and pk_hex):
+            return None, None
+        # 签名载荷需要全部字段；主节点返回的记录缺少任一字段时无法校验
+        if any(tx.get(f) is None for f in ('recipient', 'amount', 'nonce', 'fee')):
+            return None, None
+        try:
+            if address_of(bytes.fromhex(pk_hex)) != sender:
+                return None, "公钥与发送方不匹配"
+        except ValueError:
+            return None, "公钥无效"
+        args = (sender, tx.get('recipient'), tx.get('amount'), tx.get('nonce'), tx.get('fee'))
+        payloads = [tx_payload(*args)]
+        try:
+            # 钱包签名时金额/手续费为浮点数；主节点返回时可能变成整数
+            floats = tx_payload(*args[:2], float(args[2]), args[3], float(args[4]))
+        except (TypeError, ValueError):
+            floats = payloads[0]
+        if floats != payloads[0]:
+            payloads.append(floats)
+        return (tx['txid'], pk_hex, sig_hex, payloads), None
+    
+    @staticmethod
+    def fingerprint(item):
+        txid, pk_hex, sig_hex, payloads = item
+        return hashlib.sha256(pk_hex.encode() + sig_hex.encode() + payloads[0]).hexdigest()[:16]
+    
+    def verify_all(self, items):
+        if len(items) < AUDIT_CHUNK or AUDIT_WORKERS < 2:
+            return audit_verify_chunk(items)
+        chunks = [items[i:i + AUDIT_CHUNK] for i in range(0, len(items), AUDIT_CHUNK)]
+        # 用 spawn 而不是 fork：在其他线程正处理请求的进程里 fork 并不安全
+        with ProcessPoolExecutor(max_workers=min(AUDIT_WORKERS, len(chunks)), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=audit_init, initargs=(crypto.name,)) as pool:
+            return [r for chunk in pool.map(audit_verify_chunk, chunks) for r in chunk]
+    
+    def run(self, full=False):
+        # 默认增量审计：遇到第一页没有新内容需要验证时即停止
+        if not self.running.acquire(blocking=False):
+            return None
+        try:
+            start = time.perf_counter()
+            report = {"pages": 0, "verified": 0, "cached": 0, "unverifiable": 0, "mismatches": []}
+            items = []
+            page = 1
+            while True:
+                txs = self.wallet.fetch_history_page(page)
+                report['pages'] = page
+                fresh = 0
+                for tx in txs:
+                    item, reason = self.prepare(tx)
+                    if reason:
+                        report['mismatches'].append({"txid": tx.get('txid'), "reason": reason})
+                        fresh += 1
+                    elif item is None:
+                        report['unverifiable'] += 1
+                    elif self.verified.get(item[0]) == self.fingerprint(item):
+                        report['cached'] += 1
+                    else:
+                        items.append(item)
+                        fresh += 1
+                if len(txs) < HISTORY_PAGE_SIZE or not (fresh or full):
+                    break
+                page += 1
+            fps = {item[0]: self.fingerprint(item) for item in items}
+            good = []
+            for txid, ok in self.verify_all(items):
+                if ok:
+                    good.append((txid, fps[txid]))
+                else:
+                    report['mismatches'].append({"txid": txid, "reason": "签名无效"})
+            if good:
+                self.save(good)
+                self.verified.update(good)
+            report['verified'] = len(good)
+            report['seconds'] = round(time.perf_counter() - start, 3)
+            for m in report['mismatches']:
+                log.warning("审计发现不一致: %s（%s）", m['txid'], m['reason'])
+            log.info("审计完成：%d 条已验证，%d 条命中缓存，%d 条无法验证，%d 条不一致，耗时 %.2fs",
+                     report['verified'], report['cached'], report['unverifiable'], len(report['mismatches']), report['seconds'])
+            return report
+        finally:
+            self.running.release()
+
+# ---------------- 历史导出 ----------------
+EXPORT_FIELDS = ('txid', 'timestamp', 'type', 'status', 'counterparty', 'sender', 'recipient', 'amount', 'fee', 'nonce')
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def iter_history_pages(wallet, page=1, after=None, prefetch=EXPORT_PREFETCH):
+    # 逐页产出 (page, transactions)，同时保持 `prefetch` 个页请求领先于消费方，
+    # 因此无论历史多大，内存都只占几页。遍历过程中到达的新交易
+    # 会把行挤到下一页；直到上次产出的最后一行（`after`）为止的行会被丢弃。
+    pool = ThreadPoolExecutor(max_workers=prefetch)
+    ahead = deque()
+    next_page = page
+    try:
+        while True:
+            while len(ahead) < prefetch:
+                ahead.append((next_page, pool.submit(wallet.fetch_history_page, next_page)))
+                next_page += 1
+            page, future = ahead.popleft()
+            txs = future.result()
+            last = len(txs) < HISTORY_PAGE_SIZE
+            if after is not None:
+                ids = [tx.get('txid') for tx in txs]
+                if after in ids:
+                    txs = txs[ids.index(after) + 1:]
+            if txs:
+                after = txs[-1].get('txid')
+            yield page, txs
+            if last:
+                return
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def export_header(fmt):
+    if fmt != 'csv':
+        return ''
+    buf = io.StringIO()
+    csv.writer(buf).writerow(EXPORT_FIELDS)
+    return buf.getvalue()
+
+def export_rows(txs, fmt):
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(tx, ensure_ascii=False, separators=(',', ':')) + '\n' for tx in txs)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for tx in txs:
+        writer.writerow([tx.get(f, '') for f in EXPORT_FIELDS])
+    return buf.getvalue()
+
+def gzip_stream(chunks):
+    z = zlib.compressobj(5, zlib.DEFLATED, 31)  # wbits 31 = gzip 格式
+    for chunk in chunks:
+        data = z.compress(chunk.encode())
+        if data:
+            yield data
+    yield z.flush()
+
+def export_history(wallet, path, fmt):
+    # 每写完一页就 fsync 文件并记录其长度作为检查点，因此中断的导出
+    # 以相同参数重新运行时会截掉不完整的页，并从下一页继续
+    ckpt_path = path + '.ckpt'
+    ckpt = {"format": fmt, "page": 0, "bytes": 0, "after": None}
+    if os.path.exists(ckpt_path) and os.path.exists(path):
+        with open(ckpt_path, 'r', encoding='utf-8') as f:
+            ckpt = json.load(f)
+        if ckpt.get('format') != fmt:
+            raise ValueError(f"{path} 是未完成的 {ckpt.get('format')} 导出；删除 {ckpt_path} 可重新开始")
+        log.info("继续导出到 %s，从第 %d 页之后开始", path, ckpt['page'])
+    rows = 0
+    with open(path, 'r+b' if ckpt['page'] else 'wb') as f:
+        f.truncate(ckpt['bytes'])
+        f.seek(ckpt['bytes'])
+        if not ckpt['page']:
+            f.write(export_header(fmt).encode())
+        for page, txs in iter_history_pages(wallet, ckpt['page'] + 1, ckpt['after']):
+            f.write(export_rows(txs, fmt).encode())
+            f.flush()
+            os.fsync(f.fileno())
+            rows += len(txs)
+            ckpt.update(page=page, bytes=f.tell(), after=txs[-1].get('txid') if txs else ckpt['after'])
+            with open(ckpt_path + '.tmp', 'w', encoding='utf-8') as c:
+                json.dump(ckpt, c)
+            os.replace(ckpt_path + '.tmp', ckpt_path)
+    os.remove(ckpt_path)
+    log.info("已导出 %d 笔交易到 %s", rows, path)
+    return rows
+
 # ---------------- Coin Wallet 核心类 ----------------
 class CoinWallet:
     def __init__(self):
@@ -297,7 +1451,33 @@ class CoinWallet:
         self.pk_bytes = None
         self.last_nonce = -1
         self.tx_fee = 2.0
+        self.send_lock = threading.Lock()
+        self.tracker = PendingTracker(self)
+        self.outbox = None
+        self.http = requests.Session()
+        self.http.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(PORTFOLIO_CONCURRENCY, READ_CONCURRENCY)))
+        self.node_cache = OrderedDict()
+        self.node_cache_lock = threading.Lock()
+        self.chain_stats_body = None
+        self.hb_retry_after = None
+        self.hb_batch = True
+        self.hb_batch_checked = 0
+        self.announce_keys = []
+        self.watch_addrs = []
+        self.portfolio = None
+        self.portfolio_lock = threading.Lock()
+        self.portfolio_pool = ThreadPoolExecutor(max_workers=PORTFOLIO_CONCURRENCY)
+        self.history_columns = HistoryColumns(self)
+        self.audit = HistoryAudit(self)
+        self.public_ip = None
+        self.public_ip_at = 0
+        self.snapshot = {}
+        self.stale = set()
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_dirty = False
         self.load_or_create_key()
+        self.load_watch_list()
+        self.load_snapshot()
         self.running = True
         
     def load_or_create_key(self):
@@ -308,11 +1488,11 @@ class CoinWallet:
             self.coin_addr = dat['coin_addr']
             self.pk_bytes = bytes.fromhex(dat['pubkey_hex'])
             self.last_nonce = dat.get('last_nonce', -1)
-            print(f"✅ Coin Wallet 已加载 | 地址: {self.coin_addr}")
+            log.info("Coin Wallet 已加载 | 地址: %s", self.coin_addr)
         else:
             self.sk_hex, self.coin_addr, self.pk_bytes = gen_keypair()
             self.save_key()
-            print(f"🆕 Coin Wallet 新创建 | 地址: {self.coin_addr}")
+            log.info("Coin Wallet 新创建 | 地址: %s", self.coin_addr)
     
     def save_key(self):
         with open(KEY_FILE, 'w', encoding='utf-8') as f:
@@ -323,36 +1503,167 @@ class CoinWallet:
                 'last_nonce': self.last_nonce
             }, f, indent=2)
     
-    def get_network_fee(self):
+    def load_snapshot(self):
+        if not os.path.exists(SNAPSHOT_FILE):
+            return
         try:
-            resp = requests.get(f"http://{MAIN_NODE}/chain/stats", timeout=10)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get('code') == 200:
-                    return data.get('stats', {}).get('tx_fee', 2.0)
-        except:
-            pass
+            with open(SNAPSHOT_FILE, 'r', encoding='utf-8') as f:
+                dat = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("忽略无法读取的快照: %s", e)
+            return
+        if dat.get('coin_addr') != self.coin_addr:
+            return
+        self.snapshot = dat.get('values', {})
+        # 从磁盘读取的数据在被实时请求替换前均视为过期
+        self.stale = set(self.snapshot)
+        self.tx_fee = self.snapshot.get('tx_fee', self.tx_fee)
+        self.public_ip = self.snapshot.get('public_ip')
+        # 视为在保存时探测所得，在 PUBLIC_IP_REFRESH 到期前直接复用
+        self.public_ip_at = dat.get('saved_at', 0) if self.public_ip else 0
+        log.info("从快照热启动，快照保存于 %s", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(dat.get('saved_at', 0))))
+    
+    def remember(self, key, value):
+        with self.snapshot_lock:
+            self.snapshot[key] = value
+            self.stale.discard(key)
+            self.snapshot_dirty = True
+    
+    def warm_value(self, key):
+        # 启动后尚未刷新时返回 `key` 的快照值，否则返回 None
+        with self.snapshot_lock:
+            return self.snapshot.get(key) if key in self.stale else None
+    
+    def save_snapshot(self):
+        with self.snapshot_lock:
+            if not self.snapshot_dirty:
+                return
+            dat = {'coin_addr': self.coin_addr, 'saved_at': now(), 'values': dict(self.snapshot)}
+            self.snapshot_dirty = False
+        tmp = SNAPSHOT_FILE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dat, f, ensure_ascii=False)
+        os.replace(tmp, SNAPSHOT_FILE)
+    
+    def snapshot_loop(self):
+        # 在后台刷新过期数据，之后定期持久化
+        while self.running:
+            try:
+                if 'balance' in self.stale:
+                    self.get_balance()
+                if 'history' in self.stale:
+                    self.get_history()
+                if 'chain_stats' in self.stale:
+                    self.get_chain_stats()
+                self.save_snapshot()
+            except Exception:
+                log.exception("快照刷新异常")
+            self.pause(5 if self.stale - {'tx_fee', 'public_ip'} else SNAPSHOT_INTERVAL)
+    
+    def node_get(self, path, timeout=10, array_key=None):
+        # `array_key` 指定响应体中需从套接字增量解析的大数组
+        status, entry = self.node_fetch(path, timeout, array_key=array_key)
+        if entry['data'] is None:
+            entry['data'] = json.loads(entry['raw'])
+        return status, entry['data']
+    
+    def node_get_raw(self, path, timeout=10):
+        # 主节点发来的原始字节，直接转发，无需解码再编码
+        status, entry = self.node_fetch(path, timeout, raw=True)
+        if entry['raw'] is None:
+            entry['raw'] = json.dumps(entry['data'], separators=(',', ':')).encode()
+        return status, entry['raw']
+    
+    def node_fetch(self, path, timeout=10, array_key=None, raw=False):
+        # 基于该路径上次响应做条件请求，304 时复用缓存内容。
+        # 缓存项保存原始字节、解析后的数据，或在两者都被请求过后同时保存。
+        with self.node_cache_lock:
+            cached = self.node_cache.get(path)
+            if cached:
+                self.node_cache.move_to_end(path)
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        with timed('node'):
+            with self.http.get(f"http://{MAIN_NODE}{path}", headers=headers, timeout=timeout, stream=True) as resp:
+                if resp.status_code == 304 and cached:
+                    return 200, cached
+                etag, last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+                entry = {'etag': etag, 'last_modified': last_modified, 'raw': None, 'data': None}
+                if raw:
+                    entry['raw'] = resp.content
+                elif array_key:
+                    entry['data'] = read_json(resp, array_key)
+                else:
+                    entry['data'] = resp.json()
+        if resp.status_code == 200 and (etag or last_modified):
+            # 需设上限：界面滚动到的每个历史页都有各自的路径
+            with self.node_cache_lock:
+                self.node_cache[path] = entry
+                self.node_cache.move_to_end(path)
+                if len(self.node_cache) > NODE_CACHE_SIZE:
+                    self.node_cache.popitem(last=False)
+        return resp.status_code, entry
+    
+    def get_chain_stats(self):
+        try:
+            status, data = self.node_get("/chain/stats")
+            if status == 200 and data.get('code') == 200:
+                self.remember('chain_stats', data)
+                return data.get('stats', {})
+            log.warning("链状态查询失败: HTTP %s", status)
+        except Exception as e:
+            log.warning("链状态查询失败: %s", e)
+        return None
+    
+    def get_network_fee(self):
+        stats = self.get_chain_stats()
+        if stats:
+            return stats.get('tx_fee', 2.0)
         return 2.0
     
     def heartbeat_loop(self):
         self.tx_fee = self.get_network_fee()
-        print(f"💰 当前网络手续费: {self.tx_fee} XODE")
+        self.remember('tx_fee', self.tx_fee)
+        log.info("当前网络手续费: %s XODE", self.tx_fee)
+        last_fee_check = now()
+        failures = 0
         
+        # 随机相位，避免同时启动（或重启）的钱包同步发送心跳
+        self.pause(random.uniform(0, HEARTBEAT_INTERVAL))
         while self.running:
+            ok = False
             try:
-                self.register()
-                if int(now()) % 300 == 0:
+                ok = self.register()
+                if now() - last_fee_check >= FEE_REFRESH_INTERVAL:
+                    last_fee_check = now()
                     new_fee = self.get_network_fee()
                     if new_fee != self.tx_fee:
-                        print(f"💰 手续费更新: {self.tx_fee} → {new_fee}")
+                        log.info("手续费更新: %s → %s", self.tx_fee, new_fee)
                         self.tx_fee = new_fee
-                for _ in range(HEARTBEAT_INTERVAL):
-                    if not self.running:
-                        break
-                    time.sleep(1)
-            except Exception as e:
-                print(f"⚠️ 心跳异常: {e}")
-                time.sleep(10)
+                        self.remember('tx_fee', new_fee)
+            except Exception:
+                log.exception("心跳异常")
+            failures = 0 if ok else failures + 1
+            self.pause(self.next_heartbeat_delay(failures))
+    
+    def next_heartbeat_delay(self, failures):
+        # 优先遵循服务端提示（不早于其要求，但最长不超过 HEARTBEAT_BACKOFF_MAX）；
+        # 否则失败时指数退避
+        if self.hb_retry_after is not None:
+            return min(self.hb_retry_after, HEARTBEAT_BACKOFF_MAX) * random.uniform(1, 1 + HEARTBEAT_JITTER)
+        delay = HEARTBEAT_INTERVAL
+        if failures:
+            delay = min(HEARTBEAT_INTERVAL * 2 ** (failures - 1), HEARTBEAT_BACKOFF_MAX)
+        return delay * random.uniform(1 - HEARTBEAT_JITTER, 1 + HEARTBEAT_JITTER)
+    
+    def pause(self, seconds):
+        deadline = now() + seconds
+        while self.running and now() < deadline:
+            time.sleep(min(1, deadline - now()))
     
     def get_public_ip(self):
         try:
@@ -368,122 +1679,546 @@ class CoinWallet:
         except:
             return '127.0.0.1'
     
+    def current_public_ip(self):
+        # 每 PUBLIC_IP_REFRESH 秒最多重新探测一次，而不是每次心跳都探测
+        if self.public_ip is None or now() - self.public_ip_at >= PUBLIC_IP_REFRESH:
+            self.public_ip = self.get_public_ip()
+            self.public_ip_at = now()
+            self.remember('public_ip', self.public_ip)
+        return self.public_ip
+    
+    def load_announce_keys(self, path):
+        # 本机上的其他钱包（wallet_key.json 格式的密钥文件）随本钱包一起发送心跳
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+                    dat = json.load(f)
+                key = (dat['sk_hex'], dat['coin_addr'], bytes.fromhex(dat['pubkey_hex']))
+            except (OSError, ValueError, KeyError) as e:
+                log.warning("忽略密钥文件 %s: %s", name, e)
+                continue
+            if key[1] != self.coin_addr:
+                self.announce_keys.append(key)
+        log.info("每次心跳额外宣告 %d 个地址", len(self.announce_keys))
+    
     def register(self):
+        ip = self.current_public_ip()
+        real_address = f"{ip}:0"
+        if not self.announce_keys:
+            return self.register_one(real_address, self.coin_addr, self.pk_bytes)
+        keys = [(self.sk_hex, self.coin_addr, self.pk_bytes)] + self.announce_keys
+        if self.hb_batch or now() - self.hb_batch_checked >= HEARTBEAT_BATCH_REPROBE:
+            ok = self.register_batch(real_address, keys)
+            if ok is not None:
+                return ok
+        # 主节点没有 /heartbeat/batch：每个地址一个请求，本钱包地址优先
+        ok = self.register_one(real_address, self.coin_addr, self.pk_bytes)
+        retry_after = self.hb_retry_after
+        for _, coin_addr, pk_bytes in self.announce_keys:
+            self.register_one(real_address, coin_addr, pk_bytes)
+        self.hb_retry_after = retry_after
+        return ok
+    
+    def register_batch(self, real_address, keys):
+        # 主节点没有批量接口时返回 None，由调用方回退
+        timestamp = int(now())
+        ok = True
         try:
-            ip = self.get_public_ip()
-            real_address = f"{ip}:0"
-            
-            resp = requests.post(
+            for i in range(0, len(keys), HEARTBEAT_BATCH_SIZE):
+                heartbeats = [{
+                    "coin_addr": coin_addr,
+                    "pubkey_hex": pk_bytes.hex(),
+                    "signature": sign(sk_hex, heartbeat_payload(real_address, coin_addr, timestamp))
+                } for sk_hex, coin_addr, pk_bytes in keys[i:i + HEARTBEAT_BATCH_SIZE]]
+                resp = self.http.post(
+                    f"http://{MAIN_NODE}/heartbeat/batch",
+                    json={"real_address": real_address, "timestamp": timestamp, "heartbeats": heartbeats},
+                    headers={"Content-Type": "application/json"},
+                    timeout=30
+                )
+                if resp.status_code in (404, 405, 501):
+                    if self.hb_batch:
+                        log.info("主节点不支持批量心跳，回退为每个地址一个请求")
+                    self.hb_batch = False
+                    self.hb_batch_checked = now()
+                    return None
+                self.hb_batch = True
+                self.hb_retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                if resp.status_code == 429:
+                    if self.hb_retry_after is None:
+                        self.hb_retry_after = HEARTBEAT_INTERVAL * 2
+                    return ok
+                if resp.status_code != 200:
+                    log.warning("批量心跳被拒绝: HTTP %s", resp.status_code)
+                    return False
+                data = resp.json()
+                interval = data.get('heartbeat_interval')
+                if self.hb_retry_after is None and isinstance(interval, (int, float)) and interval > 0:
+                    self.hb_retry_after = min(interval, HEARTBEAT_BACKOFF_MAX)
+                rejected = data.get('rejected') or {}
+                if rejected:
+                    log.warning("批量心跳：%d/%d 个地址被拒绝，例如 %s", len(rejected), len(heartbeats), next(iter(rejected.items())))
+                if self.coin_addr in rejected:
+                    ok = False
+            return ok
+        except Exception as e:
+            log.warning("批量心跳请求失败: %s", e)
+            self.hb_retry_after = None
+            return False
+    
+    def register_one(self, real_address, coin_addr, pk_bytes):
+        try:
+            resp = self.http.post(
                 f"http://{MAIN_NODE}/heartbeat",
                 json={
                     "real_address": real_address,
-                    "coin_addr": self.coin_addr,
-                    "pubkey_hex": self.pk_bytes.hex()
+                    "coin_addr": coin_addr,
+                    "pubkey_hex": pk_bytes.hex()
                 },
                 headers={"Content-Type": "application/json"},
                 timeout=10
             )
             
+            self.hb_retry_after = parse_retry_after(resp.headers.get('Retry-After'))
             if resp.status_code == 200:
                 data = resp.json()
+                interval = data.get('heartbeat_interval')
+                if self.hb_retry_after is None and isinstance(interval, (int, float)) and interval > 0:
+                    self.hb_retry_after = min(interval, HEARTBEAT_BACKOFF_MAX)
                 server_addr = data.get('coin_addr')
-                if server_addr != self.coin_addr:
-                    print(f"❌ 地址不一致！本地：{self.coin_addr}，服务端：{server_addr}")
+                if server_addr != coin_addr:
+                    log.error("地址不一致！本地：%s，服务端：%s", coin_addr, server_addr)
                     return False
                 return True
             elif resp.status_code == 429:
+                # 被限流：仍处于注册状态，但按主节点要求的时间等待
+                if self.hb_retry_after is None:
+                    self.hb_retry_after = HEARTBEAT_INTERVAL * 2
                 return True
             else:
+                log.warning("心跳被拒绝: HTTP %s", resp.status_code)
                 return False
-        except:
+        except Exception as e:
+            log.warning("心跳请求失败: %s", e)
+            self.hb_retry_after = None
             return False
     
-    def get_balance(self):
+    def fetch_balance(self, addr):
+        status, data = self.node_get(f"/balance/{addr}")
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}")
+        return data.get('balance', 0)
+    
+    def get_balance(self, addr=None):
         try:
-            resp = requests.get(f"http://{MAIN_NODE}/balance/{self.coin_addr}", timeout=10)
-            if resp.status_code == 200:
-                return resp.json().get('balance', 0)
-            return 0
-        except:
+            balance = self.fetch_balance(addr or self.coin_addr)
+        except Exception as e:
+            log.warning("余额查询失败: %s", e)
             return 0
+        if addr in (None, self.coin_addr):
+            self.remember('balance', balance)
+        return balance
+    
+    def load_watch_list(self):
+        if os.path.exists(WATCH_FILE):
+            with open(WATCH_FILE, 'r', encoding='utf-8') as f:
+                self.watch_addrs = json.load(f).get('addresses', [])
     
-    def get_history(self):
+    def save_watch_list(self):
+        with open(WATCH_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'addresses': self.watch_addrs}, f, indent=2)
+    
+    def add_watch(self, addr):
+        if not (isinstance(addr, str) and addr.startswith('coin') and len(addr) == 20):
+            return False
+        if addr != self.coin_addr and addr not in self.watch_addrs:
+            self.watch_addrs.append(addr)
+            self.save_watch_list()
+            self.portfolio = None
+        return True
+    
+    def remove_watch(self, addr):
+        if addr not in self.watch_addrs:
+            return False
+        self.watch_addrs.remove(addr)
+        self.save_watch_list()
+        self.portfolio = None
+        return True
+    
+    def portfolio_entry(self, addr, previous):
+        entry = {"address": addr, "watch_only": addr != self.coin_addr}
         try:
-            resp = requests.get(f"http://{MAIN_NODE}/address/transactions?addr={self.coin_addr}&size=50", timeout=10)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get('code') == 200:
-                    return data.get('data', {})
+            entry["balance"] = self.fetch_balance(addr)
+        except Exception as e:
+            # 保留上次已知余额，避免单个慢地址把总额清零
+            entry["balance"] = previous.get(addr, 0)
+            entry["stale"] = True
+            entry["error"] = str(e)
+        return entry
+    
+    def get_portfolio(self, max_age=PORTFOLIO_CACHE_TTL):
+        # 并行查询所有余额；并发调用方等待并共享同一次刷新
+        with self.portfolio_lock:
+            if self.portfolio and now() - self.portfolio['updated_at'] < max_age:
+                return self.portfolio
+            previous = {e['address']: e['balance'] for e in (self.portfolio or {}).get('addresses', [])}
+            addrs = [self.coin_addr] + list(self.watch_addrs)
+            entries = list(self.portfolio_pool.map(lambda a: self.portfolio_entry(a, previous), addrs))
+            self.portfolio = {
+                "addresses": entries,
+                "total": round(sum(e['balance'] for e in entries), 6),
+                "watch_only_total": round(sum(e['balance'] for e in entries if e['watch_only']), 6),
+                "errors": sum(1 for e in entries if e.get('stale')),
+                "updated_at": now()
+            }
+            return self.portfolio
+    
+    def get_history(self, size=50, page=1):
+        try:
+            status, data = self.node_get(f"/address/transactions?addr={self.coin_addr}&size={size}&page={page}", array_key='transactions')
+            if status == 200 and data.get('code') == 200:
+                if size == 50 and page == 1:
+                    self.remember('history', data.get('data', {}))
+                return data.get('data', {})
+            log.warning("历史查询失败: HTTP %s", status)
             return {'transactions': [], 'total': 0}
-        except:
+        except Exception as e:
+            log.warning("历史查询失败: %s", e)
             return {'transactions': [], 'total': 0}
     
-    def send(self, recipient, amount, fee=None):
+    def fetch_history_page(self, page, size=HISTORY_PAGE_SIZE):
+        # 直接请求主节点：node_get 会把每一页都留在重验证缓存里
+        path = f"/address/transactions?addr={self.coin_addr}&size={size}&page={page}"
         try:
-            amount = round(float(amount), 6)
-            tx_fee = round(float(fee), 6) if fee is not None else self.tx_fee
-            
-            balance = self.get_balance()
-            if balance < amount + tx_fee:
-                return {"error": f"余额不足（当前：{balance}，需要：{round(amount + tx_fee, 6)}）"}
-            
-            self.last_nonce += 1
-            nonce = self.last_nonce
-            
+            with timed('node'):
+                with self.http.get(f"http://{MAIN_NODE}{path}", timeout=10, stream=True) as resp:
+                    data = read_json(resp, 'transactions')
+        except (requests.RequestException, ValueError) as e:
+            raise NodeUnavailable(str(e))
+        if resp.status_code != 200 or data.get('code') != 200:
+            raise NodeUnavailable(f"HTTP {resp.status_code}")
+        return data.get('data', {}).get('transactions', [])
+    
+    def history_since(self, since):
+        # 从最新开始逐页返回历史，遇到早于 `since` 的第一页后停止
+        cutoff = since - PENDING_CLOCK_SKEW
+        page = 1
+        while True:
+            txs = self.fetch_history_page(page)
+            yield txs
+            if len(txs) < HISTORY_PAGE_SIZE or min((tx.get('timestamp') or 0) for tx in txs) < cutoff:
+                return
+            page += 1
+    
+    def get_tx_statuses(self, txids, since):
+        # 向前翻页，直到找到所有 txid，或该页早于 `since`（最早的
+        # 提交时间）。无法读取主节点时返回 None。
+        statuses = {}
+        try:
+            for txs in self.history_since(since):
+                for tx in txs:
+                    if tx.get('txid') in txids:
+                        statuses[tx['txid']] = tx.get('status')
+                if len(statuses) == len(txids):
+                    break
+        except NodeUnavailable as e:
+            log.warning("待确认交易状态检查失败: %s", e)
+            return None
+        return statuses
+    
+    def find_sent_nonce(self, nonce, since):
+        # 主节点历史中带有该 `nonce` 的本钱包转出记录（若有）
+        for txs in self.history_since(since):
+            for tx in txs:
+                if tx.get('type') == 'outgoing' and tx.get('nonce') == nonce:
+                    return tx
+        return None
+    
+    def sign_tx(self, recipient, amount, nonce, tx_fee):
+        with timed('payload'):
             payload = tx_payload(self.coin_addr, recipient, amount, nonce, tx_fee)
+        with timed('sign'):
             signature = sign(self.sk_hex, payload)
-            
-            tx_data = {
-                "sender": self.coin_addr,
-                "recipient": recipient,
-                "amount": amount,
-                "nonce": nonce,
-                "signature": signature
-            }
-            
-            resp = requests.post(
+        return {
+            "sender": self.coin_addr,
+            "recipient": recipient,
+            "amount": amount,
+            "nonce": nonce,
+            "signature": signature
+        }
+    
+    def post_transaction(self, tx_data):
+        with timed('post'):
+            resp = self.http.post(
                 f"http://{MAIN_NODE}/transactions/new",
                 json=tx_data,
                 headers={"Content-Type": "application/json"},
                 timeout=10
             )
+            return resp.status_code, resp.json()
+    
+    def send(self, recipient, amount, fee=None):
+        if self.outbox is not None:
+            return self.queue_send(recipient, amount, fee)
+        with self.send_lock:
+            try:
+                amount = round(float(amount), 6)
+                tx_fee = round(float(fee), 6) if fee is not None else self.tx_fee
             
-            result = resp.json()
+                with timed('balance'):
+                    balance = self.get_balance()
+                if balance < amount + tx_fee:
+                    return {"error": f"余额不足（当前：{balance}，需要：{round(amount + tx_fee, 6)}）"}
             
-            if resp.status_code == 201:
+                self.last_nonce += 1
+                nonce = self.last_nonce
+            
+                tx_data = self.sign_tx(recipient, amount, nonce, tx_fee)
+                status, result = self.post_transaction(tx_data)
+            
+                if status == 201:
+                    with timed('save_key'):
+                        self.save_key()
+                    sent = {"success": True, "txid": result.get('txid'), "pending_block": result.get('pending_block'), "nonce": nonce, "fee": tx_fee, "amount": amount}
+                    self.tracker.add(sent, recipient)
+                    return sent
+                else:
+                    self.last_nonce -= 1
+                    return {"error": result.get('error', '发送失败')}
+            except Exception as e:
+                self.last_nonce -= 1
+                return {"error": str(e)}
+    
+    def queue_send(self, recipient, amount, fee=None):
+        # 发件箱模式：签名、落盘、立即确认；主节点恢复后由后台提交
+        with self.send_lock:
+            try:
+                amount = round(float(amount), 6)
+                tx_fee = round(float(fee), 6) if fee is not None else self.tx_fee
+                self.last_nonce += 1
+                nonce = self.last_nonce
+                tx_data = self.sign_tx(recipient, amount, nonce, tx_fee)
                 self.save_key()
-                return {"success": True, "txid": result.get('txid'), "pending_block": result.get('pending_block'), "nonce": nonce, "fee": tx_fee, "amount": amount}
-            else:
+                entry = self.outbox.enqueue(tx_data, tx_fee)
+                return {"success": True, "queued": True, "outbox_id": entry['id'], "nonce": nonce, "fee": tx_fee, "amount": amount}
+            except Exception as e:
                 self.last_nonce -= 1
-                return {"error": result.get('error', '发送失败')}
-        except Exception as e:
-            self.last_nonce -= 1
-            return {"error": str(e)}
+                return {"error": str(e)}
 
 # ---------------- Flask API ----------------
 app = Flask(__name__)
 wallet = None
 local_port = 8080
 
+class AdmissionPool:
+    # 最多同时运行 `limit` 个请求，最多 `queue_limit` 个排队等待；
+    # 超出部分立即拒绝，而不是再挂起一个线程。
+    def __init__(self, name, limit, queue_limit, wait=ADMISSION_WAIT):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(limit)
+        self.queue_limit = queue_limit
+        self.wait = wait
+        self.waiting = 0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        if self.slots.acquire(blocking=False):
+            return True
+        with self.lock:
+            if self.waiting >= self.queue_limit:
+                return False
+            self.waiting += 1
+        try:
+            return self.slots.acquire(timeout=self.wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+    
+    def release(self):
+        self.slots.release()
+
+read_pool = AdmissionPool('read', READ_CONCURRENCY, READ_QUEUE_LIMIT)
+send_pool = AdmissionPool('send', SEND_CONCURRENCY, SEND_QUEUE_LIMIT)
+export_pool = AdmissionPool('export', EXPORT_CONCURRENCY, EXPORT_QUEUE_LIMIT)
+# 遍历完整历史可能要请求上千页；单独限流，避免占满 read_pool
+walk_pool = AdmissionPool('walk', WALK_CONCURRENCY, WALK_QUEUE_LIMIT)
+
+def shed(pool):
+    log.warning("拒绝 %s：%s 池已满", request.path, pool.name)
+    resp = jsonify({"code": 503, "error": "钱包服务繁忙，请稍后重试"})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+    return resp
+
+def admitted(pool):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not pool.acquire():
+                return shed(pool)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                pool.release()
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_context():
+    _log_context.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+
+@app.after_request
+def add_request_id(resp):
+    resp.headers['X-Request-ID'] = getattr(_log_context, 'request_id', None) or ''
+    return resp
+
+@app.teardown_request
+def clear_request_context(exc):
+    _log_context.request_id = None
+
+@app.before_request
+def start_server_timing():
+    if server_timing:
+        _timing.phases = {}
+        _timing.start = time.perf_counter()
+
+@app.after_request
+def add_server_timing(resp):
+    phases = getattr(_timing, 'phases', None)
+    if phases is not None:
+        _timing.phases = None
+        entries = [f"{name};dur={dur:.1f}" for name, dur in phases.items()]
+        entries.append(f"total;dur={(time.perf_counter() - _timing.start) * 1000:.1f}")
+        resp.headers['Server-Timing'] = ', '.join(entries)
+    return resp
+
+def conditional_json(payload):
+    with timed('encode'):
+        body = jsonify(payload).get_data()
+    return conditional_body(body)
+
+def conditional_body(body):
+    # 基于 JSON 内容的弱 ETag：未变化的轮询返回无内容的 304，大响应体使用 gzip
+    with timed('encode'):
+        resp = Response(body, mimetype='application/json')
+        resp.set_etag(hashlib.sha1(resp.get_data()).hexdigest(), weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.make_conditional(request)
+        if resp.status_code == 200:
+            resp.vary.add('Accept-Encoding')
+            body = resp.get_data()
+            if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings:
+                resp.set_data(gzip.compress(body, compresslevel=5))
+                resp.headers['Content-Encoding'] = 'gzip'
+        return resp
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE, main_node=MAIN_NODE, port=local_port)
 
 @app.route('/api/status', methods=['GET'])
 def api_status():
-    return jsonify({"code": 200, "coin_addr": wallet.coin_addr, "status": "active", "main_node": MAIN_NODE, "tx_fee": wallet.tx_fee})
+    return jsonify({"code": 200, "coin_addr": wallet.coin_addr, "status": "active", "main_node": MAIN_NODE, "tx_fee": wallet.tx_fee, "stale": sorted(wallet.stale)})
 
 @app.route('/api/balance', methods=['GET'])
+@admitted(read_pool)
 def api_balance():
+    balance = wallet.warm_value('balance')
+    if balance is not None:
+        return conditional_json({"code": 200, "balance": balance, "coin_addr": wallet.coin_addr, "stale": True})
     balance = wallet.get_balance()
-    return jsonify({"code": 200, "balance": balance, "coin_addr": wallet.coin_addr})
+    return conditional_json({"code": 200, "balance": balance, "coin_addr": wallet.coin_addr})
 
 @app.route('/api/history', methods=['GET'])
+@admitted(read_pool)
 def api_history():
-    data = wallet.get_history()
-    return jsonify({"code": 200, "transactions": data.get('transactions', []), "total_transactions": data.get('total', 0)})
+    page = max(request.args.get('page', 1, type=int), 1)
+    size = min(max(request.args.get('size', 50, type=int), 1), 200)
+    data = wallet.warm_value('history') if (page, size) == (1, 50) else None
+    if data is not None:
+        return conditional_json({"code": 200, "transactions": data.get('transactions', []), "total_transactions": data.get('total', 0), "stale": True})
+    data = wallet.get_history(size=size, page=page)
+    return conditional_json({"code": 200, "transactions": data.get('transactions', []), "total_transactions": data.get('total', 0)})
+
+@app.route('/api/history/summary', methods=['GET'])
+@admitted(walk_pool)
+def api_history_summary():
+    by = request.args.get('by', 'counterparty')
+    if by not in ('counterparty', 'day'):
+        return jsonify({"code": 400, "error": "by 必须是 counterparty 或 day"}), 400
+    stale = False
+    try:
+        wallet.history_columns.sync(0 if request.args.get('refresh') else HISTORY_SYNC_TTL)
+    except NodeUnavailable as e:
+        log.warning("历史同步失败: %s", e)
+        if not wallet.history_columns.complete:
+            return jsonify({"code": 503, "error": f"历史尚未同步: {e}"}), 503
+        stale = True
+    summary = wallet.history_columns.summary(
+        by,
+        since=request.args.get('since', type=int),
+        until=request.args.get('until', type=int),
+        include_pending=bool(request.args.get('include_pending')),
+        limit=min(max(request.args.get('limit', 100, type=int), 1), 10000)
+    )
+    return conditional_json({"code": 200, **summary, "stale": stale})
+
+@app.route('/api/history/export', methods=['GET'])
+def api_history_export():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({"code": 400, "error": "format 必须是 ndjson 或 csv"}), 400
+    # 不用 @admitted：名额须保持到流式输出结束，而不是视图返回时
+    if not export_pool.acquire():
+        return shed(export_pool)
+    try:
+        start = max(request.args.get('page', 1, type=int), 1)
+        pages = iter_history_pages(wallet, start, request.args.get('after'))
+        # 先取第一页再响应，主节点不可达时可以干净地返回 503
+        first = next(pages)
+    except NodeUnavailable as e:
+        pages.close()
+        export_pool.release()
+        return jsonify({"code": 503, "error": f"主节点不可用: {e}"}), 503
+    except Exception:
+        export_pool.release()
+        raise
+    
+    def generate():
+        if start == 1:
+            yield export_header(fmt)
+        yield export_rows(first[1], fmt)
+        try:
+            for _, txs in pages:
+                yield export_rows(txs, fmt)
+        except NodeUnavailable as e:
+            log.warning("历史导出提前中断: %s", e)
+    
+    headers = {'Content-Disposition': f'attachment; filename="history-{wallet.coin_addr}.{fmt}"', 'Vary': 'Accept-Encoding'}
+    body = generate()
+    if 'gzip' in request.accept_encodings:
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    resp = Response(body, mimetype=EXPORT_MIMETYPES[fmt], headers=headers)
+    # 服务器发完响应体或客户端断开后执行
+    resp.call_on_close(export_pool.release)
+    return resp
+
+@app.route('/api/audit', methods=['POST'])
+@admitted(walk_pool)
+def api_audit():
+    try:
+        report = wallet.audit.run(full=bool(request.args.get('full')))
+    except NodeUnavailable as e:
+        return jsonify({"code": 503, "error": f"主节点不可用: {e}"}), 503
+    if report is None:
+        return jsonify({"code": 409, "error": "已有审计正在进行"}), 409
+    return jsonify({"code": 200, **report})
 
 @app.route('/api/send', methods=['POST'])
+@admitted(send_pool)
 def api_send():
     data = request.json or {}
     recipient = data.get('recipient')
@@ -506,6 +2241,17 @@ def api_send():
     if "error" in result:
         return jsonify({"code": 400, "error": result["error"]}), 400
     
+    if result.get("queued"):
+        return jsonify({
+            "code": 202,
+            "success": True,
+            "queued": True,
+            "outbox_id": result["outbox_id"],
+            "nonce": result["nonce"],
+            "fee": result["fee"],
+            "amount": result["amount"]
+        }), 202
+    
     return jsonify({
         "code": 201, 
         "success": True, 
@@ -516,28 +2262,558 @@ def api_send():
         "amount": result["amount"]
     }), 201
 
+@app.route('/api/portfolio', methods=['GET'])
+@admitted(read_pool)
+def api_portfolio():
+    max_age = 0 if request.args.get('refresh') else PORTFOLIO_CACHE_TTL
+    return conditional_json({"code": 200, **wallet.get_portfolio(max_age)})
+
+@app.route('/api/watch', methods=['GET'])
+def api_watch_list():
+    return jsonify({"code": 200, "addresses": wallet.watch_addrs})
+
+@app.route('/api/watch', methods=['POST'])
+def api_watch_add():
+    addr = (request.json or {}).get('address')
+    if not wallet.add_watch(addr):
+        return jsonify({"code": 400, "error": "地址格式错误"}), 400
+    return jsonify({"code": 200, "addresses": wallet.watch_addrs})
+
+@app.route('/api/watch/<addr>', methods=['DELETE'])
+def api_watch_remove(addr):
+    if not wallet.remove_watch(addr):
+        return jsonify({"code": 404, "error": "该地址不在观察列表中"}), 404
+    return jsonify({"code": 200, "addresses": wallet.watch_addrs})
+
+@app.route('/api/pending', methods=['GET'])
+def api_pending():
+    return jsonify({"code": 200, **wallet.tracker.status()})
+
+@app.route('/api/outbox', methods=['GET'])
+def api_outbox():
+    if wallet.outbox is None:
+        return jsonify({"code": 404, "error": "未启用发件箱模式"}), 404
+    return jsonify({"code": 200, **wallet.outbox.status()})
+
+@app.route('/api/outbox/<entry_id>', methods=['GET'])
+def api_outbox_entry(entry_id):
+    entry = wallet.outbox.get(entry_id) if wallet.outbox is not None else None
+    if entry is None:
+        return jsonify({"code": 404, "error": "发件箱记录不存在"}), 404
+    return jsonify({"code": 200, "entry": entry})
+
+@app.route('/api/admin/profile', methods=['POST'])
+def api_admin_profile():
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({"code": 403, "error": "管理接口仅限本机访问"}), 403
+    seconds = request.args.get('seconds', 30, type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"code": 400, "error": f"seconds 必须在 0 到 {PROFILE_MAX_SECONDS} 之间"}), 400
+    profiler = SamplingProfiler(seconds)
+    if not profiler.start():
+        return jsonify({"code": 409, "error": "已有性能分析正在运行"}), 409
+    return jsonify({"code": 202, "file": profiler.path, "seconds": seconds}), 202
+
 @app.route('/api/chain/stats', methods=['GET'])
+@admitted(read_pool)
 def api_chain_stats():
+    data = wallet.warm_value('chain_stats')
+    if data is not None:
+        return conditional_json({**data, "stale": True})
     try:
-        resp = requests.get(f"http://{MAIN_NODE}/chain/stats", timeout=10)
-        return jsonify(resp.json())
+        status, body = wallet.node_get_raw("/chain/stats")
+        if status != 200:
+            return conditional_json(json.loads(body))
+        # 按收到的原样转发；只有主节点发来新内容时才解析（用于快照）
+        if body != wallet.chain_stats_body:
+            data = json.loads(body)
+            if data.get('code') == 200:
+                wallet.remember('chain_stats', data)
+            wallet.chain_stats_body = body
+        return conditional_body(body)
     except Exception as e:
         return jsonify({"code": 500, "error": str(e)}), 500
 
+# ---------------- JSON-RPC（Unix 套接字）----------------
+# 按行分隔的 JSON-RPC 2.0：每行一个请求（或批量数组），每行一个响应。
+# 客户端可在同一连接上流水线发送请求，响应按请求顺序返回。
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+def rpc_params(params, names):
+    if isinstance(params, list):
+        return dict(zip(names, params))
+    if isinstance(params, dict):
+        return params
+    if params is None:
+        return {}
+    raise RpcError(-32602, "Invalid params")
+
+def rpc_send_args(params):
+    args = rpc_params(params, ['recipient', 'amount', 'fee'])
+    recipient = args.get('recipient')
+    amount = args.get('amount')
+    fee = args.get('fee')
+    if not recipient or amount is None:
+        raise RpcError(-32602, "缺少参数")
+    try:
+        amount = float(amount)
+        fee = float(fee) if fee is not None else None
+    except (TypeError, ValueError):
+        raise RpcError(-32602, "金额格式错误")
+    if amount <= 0:
+        raise RpcError(-32602, "金额必须大于0")
+    return recipient, amount, fee
+
+def rpc_status(params):
+    return {"coin_addr": wallet.coin_addr, "status": "active", "main_node": MAIN_NODE, "tx_fee": wallet.tx_fee}
+
+def rpc_get_balance(params):
+    return {"balance": wallet.get_balance(), "coin_addr": wallet.coin_addr}
+
+def rpc_history(params):
+    data = wallet.get_history()
+    return {"transactions": data.get('transactions', []), "total_transactions": data.get('total', 0)}
+
+def rpc_history_summary(params):
+    p = rpc_params(params, ['by', 'since', 'until', 'include_pending', 'limit'])
+    by = p.get('by') or 'counterparty'
+    if by not in ('counterparty', 'day'):
+        raise RpcError(-32602, "by 必须是 counterparty 或 day")
+    try:
+        since = int(p['since']) if p.get('since') is not None else None
+        until = int(p['until']) if p.get('until') is not None else None
+        limit = min(max(int(p.get('limit') or 100), 1), 10000)
+    except (TypeError, ValueError):
+        raise RpcError(-32602, "Invalid params")
+    try:
+        wallet.history_columns.sync()
+    except NodeUnavailable as e:
+        raise RpcError(-32000, f"历史同步失败: {e}")
+    return wallet.history_columns.summary(by, since, until, bool(p.get('include_pending')), limit)
+
+def rpc_audit(params):
+    try:
+        report = wallet.audit.run(full=bool(rpc_params(params, ['full']).get('full')))
+    except NodeUnavailable as e:
+        raise RpcError(-32000, f"主节点不可用: {e}")
+    if report is None:
+        raise RpcError(-32000, "已有审计正在进行")
+    return report
+
+def rpc_portfolio(params):
+    refresh = rpc_params(params, ['refresh']).get('refresh')
+    return wallet.get_portfolio(0 if refresh else PORTFOLIO_CACHE_TTL)
+
+def rpc_pending(params):
+    return wallet.tracker.status()
+
+def rpc_outbox_status(params):
+    if wallet.outbox is None:
+        raise RpcError(-32000, "未启用发件箱模式")
+    entry_id = rpc_params(params, ['id']).get('id')
+    if entry_id is None:
+        return wallet.outbox.status()
+    entry = wallet.outbox.get(entry_id)
+    if entry is None:
+        raise RpcError(-32000, "发件箱记录不存在")
+    return entry
+
+def rpc_send(params):
+    result = wallet.send(*rpc_send_args(params))
+    if "error" in result:
+        raise RpcError(-32000, result["error"])
+    return result
+
+def rpc_send_batch(params):
+    if isinstance(params, dict):
+        params = params.get('transactions')
+    if not isinstance(params, list):
+        raise RpcError(-32602, "Invalid params")
+    results = []
+    for item in params:
+        try:
+            results.append(wallet.send(*rpc_send_args(item)))
+        except RpcError as e:
+            results.append({"error": e.message})
+    return results
+
+RPC_METHODS = {
+    'getBalance': rpc_get_balance,
+    'send': rpc_send,
+    'sendBatch': rpc_send_batch,
+    'history': rpc_history,
+    'historySummary': rpc_history_summary,
+    'audit': rpc_audit,
+    'status': rpc_status,
+    'pending': rpc_pending,
+    'outboxStatus': rpc_outbox_status,
+    'portfolio': rpc_portfolio,
+}
+
+def rpc_call(req):
+    req_id = req.get('id') if isinstance(req, dict) else None
+    # 通知（格式正确但没有 id 的调用）永远不回复，出错也不回复
+    notification = isinstance(req, dict) and isinstance(req.get('method'), str) and 'id' not in req
+    _log_context.request_id = uuid.uuid4().hex[:16]
+    try:
+        if not isinstance(req, dict) or not isinstance(req.get('method'), str):
+            raise RpcError(-32600, "Invalid Request")
+        method = RPC_METHODS.get(req['method'])
+        if method is None:
+            raise RpcError(-32601, "Method not found")
+        result = method(req.get('params'))
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "result": result, "id": req_id}
+    except RpcError as e:
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "error": {"code": e.code, "message": e.message}, "id": req_id}
+    except Exception as e:
+        log.exception("RPC 调用失败")
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "error": {"code": -32603, "message": str(e)}, "id": req_id}
+    finally:
+        _log_context.request_id = None
+
+def rpc_handle_line(line):
+    try:
+        req = json.loads(line)
+    except ValueError:
+        return {"jsonrpc": "2.0", "error": {"code": -32700, "message": "Parse error"}, "id": None}
+    if isinstance(req, list):
+        if not req:
+            return {"jsonrpc": "2.0", "error": {"code": -32600, "message": "Invalid Request"}, "id": None}
+        replies = [r for r in (rpc_call(item) for item in req) if r is not None]
+        return replies or None
+    return rpc_call(req)
+
+class RpcHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = rpc_handle_line(line)
+            if reply is not None:
+                self.wfile.write(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+
+def start_rpc_server(path):
+    if not hasattr(socket, 'AF_UNIX'):
+        log.warning("当前平台不支持 Unix 套接字，JSON-RPC 已禁用")
+        return None
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+    # 套接字仅限属主访问：RPC 通道可以动用资金
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, RpcHandler)
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ---------------- 录制 / 回放 ----------------
+# 经 CoinWallet.http 发往主节点的每次请求/响应都可录制为 gzip 压缩的
+# JSON 行文件，之后由替身节点回放，用于离线性能测试。
+RECORD_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Retry-After')
+
+class NodeRecorder:
+    def __init__(self, path):
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.started = now()
+        atexit.register(self.close)
+    
+    def on_response(self, resp, *args, **kwargs):
+        url = urlsplit(resp.request.url)
+        body = resp.request.body
+        rec = {
+            "t": round(now() - self.started, 3),
+            "method": resp.request.method,
+            "path": url.path + ('?' + url.query if url.query else ''),
+            "request": body.decode('utf-8', 'replace') if isinstance(body, bytes) else body,
+            "status": resp.status_code,
+            "latency_ms": round(resp.elapsed.total_seconds() * 1000, 2),
+            "headers": {k: resp.headers[k] for k in RECORD_HEADERS if k in resp.headers},
+            "body": resp.text
+        }
+        line = json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+    
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class ReplayStore:
+    # 按 (method, path) 依录制顺序返回响应，用完后从头循环，
+    # 因此相同的请求序列总是得到相同的响应。
+    def __init__(self, path, speed=1.0):
+        self.speed = speed
+        self.exchanges = defaultdict(list)
+        self.cursor = defaultdict(int)
+        self.lock = threading.Lock()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.exchanges[(rec['method'], rec['path'])].append(rec)
+            except EOFError:
+                log.warning("录制文件 %s 不完整，仅回放已读取的部分", path)
+    
+    def next(self, method, path, revalidating):
+        recs = self.exchanges.get((method, path))
+        if not recs:
+            return None
+        if not revalidating:
+            # 只有持有缓存副本的客户端才能处理 304
+            recs = [r for r in recs if r['status'] != 304] or recs
+        with self.lock:
+            i = self.cursor[(method, path, revalidating)]
+            self.cursor[(method, path, revalidating)] = i + 1
+        return recs[i % len(recs)]
+
+replay_app = Flask('replay')
+replay_store = None
+
+@replay_app.route('/', defaults={'path': ''}, methods=['GET', 'POST'])
+@replay_app.route('/<path:path>', methods=['GET', 'POST'])
+def replay(path):
+    full_path = request.full_path.rstrip('?')
+    revalidating = bool(request.headers.get('If-None-Match') or request.headers.get('If-Modified-Since'))
+    rec = replay_store.next(request.method, full_path, revalidating)
+    if rec is None:
+        return jsonify({"code": 404, "error": f"没有 {request.method} {full_path} 的录制响应"}), 404
+    if replay_store.speed > 0:
+        time.sleep(rec['latency_ms'] / 1000 / replay_store.speed)
+    return Response(rec['body'], status=rec['status'], headers=rec['headers'])
+
+def run_replay(path, port, speed):
+    global replay_store
+    replay_store = ReplayStore(path, speed)
+    total = sum(len(v) for v in replay_store.exchanges.values())
+    log.info("正在回放 %d 条录制记录（%s），地址 127.0.0.1:%d（速度 x%s）", total, path, port, speed)
+    replay_app.run(host='127.0.0.1', port=port, debug=False, threaded=True, use_reloader=False)
+
+# ---------------- 替身节点 ----------------
+# 最小的本地主节点：支持心跳（单个与批量），链状态、余额和历史返回空值，
+# 足以让钱包连上运行，并测量心跳吞吐量。
+class StandInNode:
+    def __init__(self):
+        self.online = {}  # coin_addr -> (real_address, 最后一次心跳时间)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_in = 0
+        self.verified = 0
+    
+    def count(self):
+        with self.lock:
+            self.requests += 1
+            self.bytes_in += len(str(request.headers)) + (request.content_length or 0)
+    
+    def check(self, real_address, coin_addr, pubkey_hex, timestamp=None, signature=None):
+        # 返回拒绝原因；地址被标记为在线时返回 None
+        try:
+            pk_bytes = bytes.fromhex(pubkey_hex)
+        except (TypeError, ValueError):
+            return "公钥无效"
+        if address_of(pk_bytes) != coin_addr:
+            return "地址与公钥不匹配"
+        if signature is not None:
+            if not verify(pk_bytes, signature, heartbeat_payload(real_address, coin_addr, timestamp)):
+                return "签名无效"
+            with self.lock:
+                self.verified += 1
+        with self.lock:
+            self.online[coin_addr] = (real_address, now())
+        return None
+    
+    def online_count(self):
+        cutoff = now() - HEARTBEAT_INTERVAL * 3
+        with self.lock:
+            return sum(1 for _, seen in self.online.values() if seen >= cutoff)
+
+standin_app = Flask('standin')
+standin = StandInNode()
+
+@standin_app.route('/heartbeat', methods=['POST'])
+def standin_heartbeat():
+    standin.count()
+    data = request.get_json(silent=True) or {}
+    error = standin.check(data.get('real_address'), data.get('coin_addr'), data.get('pubkey_hex'))
+    if error:
+        return jsonify({"code": 400, "error": error}), 400
+    return jsonify({"code": 200, "coin_addr": data['coin_addr'], "heartbeat_interval": HEARTBEAT_INTERVAL})
+
+@standin_app.route('/heartbeat/batch', methods=['POST'])
+def standin_heartbeat_batch():
+    standin.count()
+    data = request.get_json(silent=True) or {}
+    timestamp = data.get('timestamp')
+    heartbeats = data.get('heartbeats')
+    if not isinstance(timestamp, int) or not isinstance(heartbeats, list) or len(heartbeats) > HEARTBEAT_BATCH_SIZE:
+        return jsonify({"code": 400, "error": "批量请求格式错误"}), 400
+    if abs(now() - timestamp) > HEARTBEAT_MAX_SKEW:
+        return jsonify({"code": 400, "error": "时间戳已过期"}), 400
+    rejected = {}
+    for hb in heartbeats:
+        if not isinstance(hb, dict):
+            return jsonify({"code": 400, "error": "批量请求格式错误"}), 400
+        error = standin.check(data.get('real_address'), hb.get('coin_addr'), hb.get('pubkey_hex'), timestamp, hb.get('signature'))
+        if error:
+            rejected[hb.get('coin_addr')] = error
+    return jsonify({"code": 200, "accepted": len(heartbeats) - len(rejected), "rejected": rejected, "heartbeat_interval": HEARTBEAT_INTERVAL})
+
+@standin_app.route('/chain/stats', methods=['GET'])
+def standin_chain_stats():
+    standin.count()
+    return jsonify({"code": 200, "stats": {"total_online_nodes": standin.online_count(), "latest_block_height": 0, "tx_fee": 2.0}})
+
+@standin_app.route('/balance/<addr>', methods=['GET'])
+def standin_balance(addr):
+    standin.count()
+    return jsonify({"code": 200, "coin_addr": addr, "balance": 0})
+
+@standin_app.route('/address/transactions', methods=['GET'])
+def standin_history():
+    standin.count()
+    return jsonify({"code": 200, "data": {"transactions": [], "total": 0}})
+
+def run_standin(port):
+    log.info("替身主节点运行于 127.0.0.1:%d", port)
+    standin_app.run(host='127.0.0.1', port=port, debug=False, threaded=True, use_reloader=False)
+
+def bench_heartbeat(count):
+    # 针对进程内替身节点，按每种协议为 `count` 个地址各发一轮心跳
+    global MAIN_NODE
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # 不为每个请求输出访问日志
+    server = make_server('127.0.0.1', 0, standin_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    MAIN_NODE = f"127.0.0.1:{server.server_port}"
+    keys = [gen_keypair() for _ in range(count)]
+    bench = CoinWallet()
+    bench.public_ip, bench.public_ip_at = '127.0.0.1', now()
+    bench.announce_keys = keys
+    print(f"{count + 1} 个地址，加密后端 {crypto.name}")
+    print(f"{'protocol':<10} {'requests':>9} {'KiB sent':>10} {'seconds':>9} {'addr/s':>9}")
+    for protocol in ('single', 'batch'):
+        bench.hb_batch = protocol == 'batch'
+        bench.hb_batch_checked = now()
+        before = (standin.requests, standin.bytes_in)
+        start = time.perf_counter()
+        ok = bench.register()
+        elapsed = time.perf_counter() - start
+        requests_sent = standin.requests - before[0]
+        sent = (standin.bytes_in - before[1]) / 1024
+        print(f"{protocol:<10} {requests_sent:>9} {sent:>10.1f} {elapsed:>9.2f} {(count + 1) / elapsed:>9.0f}{'' if ok else '  FAILED'}")
+    server.shutdown()
+
 # ---------------- 主函数 ----------------
 def main():
-    global wallet, local_port
+    global wallet, local_port, server_timing, MAIN_NODE, crypto
     
     parser = argparse.ArgumentParser(description='Coin Wallet - XODE Wallet Client')
     parser.add_argument('-p', '--port', default=8080, type=int, help='本地Web端口 (默认8080)')
+    parser.add_argument('--rpc-socket', default=RPC_SOCKET, help=f'JSON-RPC Unix 套接字路径 (默认{RPC_SOCKET})')
+    parser.add_argument('--no-rpc', action='store_true', help='禁用 JSON-RPC Unix 套接字')
+    parser.add_argument('--webhook', help='交易确认时 POST 通知的 URL')
+    parser.add_argument('--profile', type=float, metavar='SECONDS', help=f'启动后对所有线程采样 SECONDS 秒，并将折叠栈结果写入 {PROFILE_DIR}/')
+    parser.add_argument('--server-timing', action='store_true', help='在 API 响应中添加分阶段的 Server-Timing 头')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='日志级别 (默认INFO)')
+    parser.add_argument('--watch', action='append', default=[], metavar='ADDR', help=f'添加仅观察地址（保存到 {WATCH_FILE}，可重复指定）')
+    parser.add_argument('--node', default=MAIN_NODE, help=f'主节点地址 (默认{MAIN_NODE})')
+    parser.add_argument('--record', metavar='FILE', help='将所有主节点请求和响应录制到 FILE（gzip JSON 行）')
+    parser.add_argument('--replay', metavar='FILE', help='不启动钱包，而是作为替身主节点回放录制文件')
+    parser.add_argument('--replay-port', default=9753, type=int, help='--replay 和 --stand-in 使用的端口（默认 9753）')
+    parser.add_argument('--stand-in', action='store_true', help='不启动钱包，而是运行一个最小的本地主节点（支持批量心跳）')
+    parser.add_argument('--announce-keys', metavar='DIR', help='同时为 DIR 中的每个密钥文件发送心跳，主节点支持时合并为一个签名请求')
+    parser.add_argument('--bench-heartbeat', type=int, metavar='ADDRS', help='针对替身节点测量 ADDRS 个地址的单个与批量心跳后退出')
+    parser.add_argument('--speed', default=1.0, type=float, help='回放延迟倍率：2 = 两倍速，0 = 无延迟 (默认1)')
+    parser.add_argument('--crypto', default=CRYPTO_BACKEND, choices=['auto', 'ecdsa', 'coincurve'], help=f'ECDSA 后端 (默认 {CRYPTO_BACKEND})')
+    parser.add_argument('--bench-crypto', type=int, metavar='ROUNDS', help='测试各 ECDSA 后端性能后退出')
+    parser.add_argument('--audit', nargs='?', const='new', choices=['new', 'full'], help='在本地验证历史签名后退出：仅新记录（默认）或完整历史')
+    parser.add_argument('--export', metavar='FILE', help='将完整历史导出到 FILE 后退出（中断后可续传）')
+    parser.add_argument('--format', choices=['ndjson', 'csv'], help='--export 的格式（默认按文件扩展名，否则为 ndjson）')
+    parser.add_argument('--outbox', action='store_true', help=f'将已签名交易存入 {OUTBOX_FILE} 并在后台提交')
     args = parser.parse_args()
     local_port = args.port
+    server_timing = args.server_timing
+    setup_logging(args.log_level)
+    MAIN_NODE = args.node
+    try:
+        crypto = load_crypto_backend(args.crypto)
+    except ImportError:
+        parser.error("--crypto coincurve 需要安装 coincurve 包 (pip install coincurve)")
+    
+    if args.bench_crypto:
+        bench_crypto(args.bench_crypto)
+        return
+    
+    if args.replay:
+        run_replay(args.replay, args.replay_port, args.speed)
+        return
+    
+    if args.stand_in:
+        run_standin(args.replay_port)
+        return
+    
+    if args.bench_heartbeat:
+        bench_heartbeat(args.bench_heartbeat)
+        return
     
     wallet = CoinWallet()
+    if args.audit:
+        try:
+            report = wallet.audit.run(full=args.audit == 'full')
+        except NodeUnavailable as e:
+            log.error("审计失败，主节点不可用: %s", e)
+            sys.exit(2)
+        sys.exit(1 if report['mismatches'] else 0)
+    if args.export:
+        fmt = args.format or ('csv' if args.export.lower().endswith('.csv') else 'ndjson')
+        try:
+            export_history(wallet, args.export, fmt)
+        except NodeUnavailable as e:
+            log.error("导出中断，重新运行即可续传: %s", e)
+            sys.exit(2)
+        except ValueError as e:
+            log.error("导出失败: %s", e)
+            sys.exit(2)
+        return
+    if args.record:
+        wallet.http.hooks['response'].append(NodeRecorder(args.record).on_response)
+    wallet.tracker.webhook = args.webhook
+    if args.announce_keys:
+        wallet.load_announce_keys(args.announce_keys)
+    for addr in args.watch:
+        if not wallet.add_watch(addr):
+            log.warning("忽略无效的观察地址: %s", addr)
+    if args.outbox:
+        wallet.outbox = Outbox(wallet)
     
     # 启动心跳线程
     hb_thread = threading.Thread(target=wallet.heartbeat_loop, daemon=True)
     hb_thread.start()
+    threading.Thread(target=wallet.tracker.loop, daemon=True).start()
+    threading.Thread(target=wallet.snapshot_loop, daemon=True).start()
+    atexit.register(wallet.save_snapshot)
+    if wallet.outbox is not None:
+        threading.Thread(target=wallet.outbox.loop, daemon=True).start()
+    
+    rpc_server = None if args.no_rpc else start_rpc_server(args.rpc_socket)
+    if args.profile:
+        SamplingProfiler(args.profile).start()
     
     print(f"""
 ╔════════════════════════════════════════════════╗
@@ -556,10 +2832,13 @@ def main():
     try:
         import webbrowser
         webbrowser.open(f'http://127.0.0.1:{local_port}')
-        print("🌐 已自动打开浏览器")
+        log.info("已自动打开浏览器")
     except:
         pass
     
+    if rpc_server:
+        log.info("JSON-RPC 套接字: %s", args.rpc_socket)
+    
     app.run(host='0.0.0.0', port=local_port, debug=False, threaded=True, use_reloader=False)
 
 if __name__ == '__main__':
@@ -1,20 +1,93 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import gzip
 import hashlib
+import io
 import json
 import requests
 import argparse
+import atexit
+import codecs
+import csv
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+import queue
 import threading
 import time
 import os
+import random
+import re
+import socket
+import socketserver
+import stat
+import sys
+import uuid
+import zlib
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
 from time import time as now
-from flask import Flask, request, jsonify, render_template_string
-from ecdsa import SigningKey, SECP256k1
+from urllib.parse import urlsplit
+from flask import Flask, Response, request, jsonify, render_template_string
+from ecdsa import BadSignatureError, SigningKey, VerifyingKey, SECP256k1
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # ---------------- 配置 ----------------
 MAIN_NODE = "62.234.183.74:9753"  # Master Node Address
 HEARTBEAT_INTERVAL = 75           # Heartbeat Interval (seconds)
+HEARTBEAT_JITTER = 0.1            # Random +/- fraction applied to every heartbeat delay
+HEARTBEAT_BACKOFF_MAX = 600       # Heartbeat retry delay ceiling after consecutive failures (seconds)
+HEARTBEAT_BATCH_SIZE = 1000       # Addresses announced per batched heartbeat request
+HEARTBEAT_BATCH_REPROBE = 3600    # Retry the batch endpoint this long after the node lacked it (seconds)
+HEARTBEAT_MAX_SKEW = 300          # Stand-in node: oldest accepted batch heartbeat timestamp (seconds)
+FEE_REFRESH_INTERVAL = 300        # Network fee refresh interval (seconds)
 KEY_FILE = "wallet_key.json"      # Local Key File
+CRYPTO_BACKEND = "auto"           # ECDSA backend: auto (native if installed), ecdsa, coincurve
+RPC_SOCKET = "wallet.sock"        # Local JSON-RPC Unix socket
+PENDING_POLL_MIN = 5              # Pending-tx poll interval while blocks advance (seconds)
+PENDING_POLL_MAX = 120            # Pending-tx poll interval ceiling when the chain is idle (seconds)
+PENDING_EXPIRE = 3600             # A sent tx missing from history this long after submission is marked expired (seconds)
+PENDING_CLOCK_SKEW = 300          # Allowance for node/local clock difference when paging history back (seconds)
+OUTBOX_FILE = "wallet_outbox.jsonl"  # Durable queue of signed, unsubmitted transactions
+OUTBOX_RETRY_MAX = 60             # Max flush retry delay while the master node is down (seconds)
+OUTBOX_KEEP_DONE = 500            # Finished outbox entries kept across restarts
+GZIP_MIN_SIZE = 1024              # API responses at least this large are gzip'd for clients that accept it
+PROFILE_DIR = "profiles"          # Output directory for sampling profiles
+PROFILE_SAMPLE_INTERVAL = 0.005   # Seconds between stack samples while profiling
+PROFILE_MAX_SECONDS = 300         # Longest profile the admin endpoint will run
+LOG_RATE_WINDOW = 60              # Identical warnings/errors are logged at most once per window (seconds)
+READ_CONCURRENCY = 16             # Concurrent /api read requests allowed to call the master node
+READ_QUEUE_LIMIT = 64             # Read requests allowed to wait for a slot before shedding
+SEND_CONCURRENCY = 2              # Concurrent /api/send requests
+SEND_QUEUE_LIMIT = 8              # Send requests allowed to wait for a slot before shedding
+EXPORT_CONCURRENCY = 2            # Concurrent /api/history/export streams
+EXPORT_QUEUE_LIMIT = 2            # Export requests allowed to wait for a slot before shedding
+WALK_CONCURRENCY = 2              # Concurrent requests that may walk the full history (summaries, audits)
+WALK_QUEUE_LIMIT = 2              # Full-history requests allowed to wait for a slot before shedding
+ADMISSION_WAIT = 5                # Longest a queued request waits for a slot (seconds)
+ADMISSION_RETRY_AFTER = 2         # Retry-After sent with 503 when shedding (seconds)
+WATCH_FILE = "wallet_watch.json"  # Watch-only addresses (no private keys)
+PORTFOLIO_CONCURRENCY = 16        # Concurrent balance queries during a portfolio refresh
+PORTFOLIO_CACHE_TTL = 30          # Portfolio results are reused for this long (seconds)
+SNAPSHOT_FILE = "wallet_snapshot.json"  # Last known balance/history/stats, served at startup
+SNAPSHOT_INTERVAL = 60            # Snapshot save interval (seconds)
+PUBLIC_IP_REFRESH = 600           # Public IP re-detection interval (seconds)
+NODE_CACHE_SIZE = 64              # Node responses kept for ETag revalidation, least recently used dropped first
+HISTORY_PAGE_SIZE = 200           # Page size when syncing the full history for summaries
+HISTORY_RECENT_ROWS = 1000        # Newest history rows whose status may still change on resync
+HISTORY_SYNC_TTL = 30             # History summaries resync with the node at most this often (seconds)
+AUDIT_CACHE_FILE = "wallet_audit.jsonl"  # Txids whose signatures were verified locally
+AUDIT_WORKERS = os.cpu_count() or 1  # Processes verifying signatures during an audit
+AUDIT_CHUNK = 256                 # Signatures per work item sent to an audit process
+EXPORT_PREFETCH = 4               # History pages requested ahead of the one being written during an export
+JSON_STREAM_MIN_BYTES = 65536     # Node bodies at least this large (or of unknown length) are parsed incrementally
 
 # ---------------- HTML Template (Coin Wallet Interface)----------------
 HTML_TEMPLATE = """
@@ -77,7 +150,10 @@ HTML_TEMPLATE = """
         }
         .btn-submit:hover { opacity: 0.95; transform: translateY(-2px); box-shadow: 0 10px 25px rgba(178,31,31,0.3); }
         .btn-submit:disabled { background: #ccc; cursor: not-allowed; opacity: 0.6; transform: none; }
-        .tx-list { max-height: 500px; overflow-y: auto; }
+        .tx-list { max-height: 500px; overflow-y: auto; position: relative; }
+        .tx-spacer { position: relative; }
+        .tx-row { position: absolute; top: 0; left: 0; right: 0; }
+        .tx-row .tx-item { height: calc(100% - 4px); }
         .tx-item { 
             padding: 14px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between; 
             align-items: center; transition: all 0.2s; border-radius: 8px; margin-bottom: 4px;
@@ -217,24 +293,96 @@ HTML_TEMPLATE = """
                     document.getElementById('blockHeight').textContent = chainRes.stats.latest_block_height;
                 }
                 if (historyRes.code === 200) {
-                    renderTxList(historyRes.transactions || []);
+                    renderTxList(historyRes.transactions || [], historyRes.total_transactions || 0);
                     document.getElementById('txCount').textContent = historyRes.total_transactions || 0;
                 }
                 updateStatus(true);
+                // Served from the startup snapshot: poll again soon for live values
+                if (balanceRes.stale || historyRes.stale || chainRes.stale) setTimeout(refreshData, 3000);
             } catch (e) { console.error('刷新失败:', e); updateStatus(false); }
         }
-        function renderTxList(transactions) {
+        // Transaction list: rows keyed by txid, only rows in the scroll window live in the DOM,
+        // and a row is re-rendered only when its status/amount changes. Older pages load on scroll.
+        const ROW_HEIGHT = 96, OVERSCAN = 6, PAGE_SIZE = 50;
+        const txById = new Map(), rowById = new Map();
+        const dateFormat = new Intl.DateTimeFormat(undefined, { dateStyle: 'short', timeStyle: 'medium' });
+        let txOrder = [], txTotal = 0, loadingMore = false, renderQueued = false;
+        function txKey(tx) { return tx.txid || `${tx.timestamp}:${tx.counterparty}:${tx.amount}`; }
+        function txVersion(tx) { return `${tx.status}|${tx.type}|${tx.amount}`; }
+        function mergeTransactions(transactions) {
+            let added = false, changed = false;
+            for (const tx of transactions) {
+                const key = txKey(tx), prev = txById.get(key);
+                if (!prev) added = true;
+                else if (txVersion(prev) === txVersion(tx)) continue;
+                txById.set(key, tx);
+                changed = true;
+            }
+            if (added) txOrder = [...txById.keys()].sort((a, b) => txById.get(b).timestamp - txById.get(a).timestamp);
+            return changed;
+        }
+        function renderTxList(transactions, total) {
+            mergeTransactions(transactions || []);
+            txTotal = Math.max(total || 0, txOrder.length);
             const list = document.getElementById('txList');
-            if (!transactions || transactions.length === 0) { list.innerHTML = '<div style="text-align: center; padding: 40px; color: #999;"><p>No transactions yet</p><p style="font-size: 0.9em; margin-top: 10px;">Transactions will appear here</p></div>'; return; }
-            list.innerHTML = transactions.map(tx => {
-                const isOut = tx.type === 'outgoing', isPending = tx.status === 'pending';
-                const typeClass = isPending ? 'tx-pending' : (isOut ? 'tx-out' : 'tx-in');
-                const typeText = isPending ? 'Pending' : (isOut ? 'Outgoing' : 'Incoming');
-                const amountClass = isOut ? 'out' : 'in';
-                const sign = isOut ? '-' : '+';
-                const counterparty = isOut ? '→ ' + tx.counterparty.substring(0, 14) + '...' : '← ' + tx.counterparty.substring(0, 14) + '...';
-                return `<div class="tx-item"><div><span class="tx-type ${typeClass}">${typeText}</span><div style="margin-top: 6px; font-size: 0.9em; color: #555; font-weight: 500;">${counterparty}</div><div style="font-size: 0.8em; color: #999; margin-top: 4px;">${new Date(tx.timestamp * 1000).toLocaleString()}</div></div><div class="tx-amount ${amountClass}">${sign}${parseFloat(tx.amount).toFixed(2)}</div></div>`;
-            }).join('');
+            if (txOrder.length === 0) { list.innerHTML = '<div style="text-align: center; padding: 40px; color: #999;"><p>No transactions yet</p><p style="font-size: 0.9em; margin-top: 10px;">Transactions will appear here</p></div>'; return; }
+            if (!document.getElementById('txSpacer')) {
+                list.innerHTML = '<div id="txSpacer" class="tx-spacer"></div>';
+                rowById.clear();
+                list.onscroll = scheduleRender;
+            }
+            scheduleRender();
+        }
+        function scheduleRender() {
+            if (!renderQueued) { renderQueued = true; requestAnimationFrame(renderWindow); }
+        }
+        function renderWindow() {
+            renderQueued = false;
+            const list = document.getElementById('txList'), spacer = document.getElementById('txSpacer');
+            if (!spacer) return;
+            spacer.style.height = (txOrder.length * ROW_HEIGHT) + 'px';
+            const first = Math.max(0, Math.floor(list.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const last = Math.min(txOrder.length, Math.ceil((list.scrollTop + list.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+            const visible = new Set(txOrder.slice(first, last));
+            for (const [key, row] of rowById) {
+                if (!visible.has(key)) { row.el.remove(); rowById.delete(key); }
+            }
+            for (let i = first; i < last; i++) {
+                const key = txOrder[i], tx = txById.get(key), version = txVersion(tx);
+                let row = rowById.get(key);
+                if (!row) {
+                    row = { el: document.createElement('div'), version: null };
+                    row.el.className = 'tx-row';
+                    row.el.style.height = ROW_HEIGHT + 'px';
+                    spacer.appendChild(row.el);
+                    rowById.set(key, row);
+                }
+                if (row.version !== version) { row.el.innerHTML = txRowHtml(tx); row.version = version; }
+                row.el.style.transform = `translateY(${i * ROW_HEIGHT}px)`;
+            }
+            if (last >= txOrder.length - OVERSCAN && txOrder.length < txTotal) loadMoreTransactions();
+        }
+        async function loadMoreTransactions() {
+            if (loadingMore) return;
+            loadingMore = true;
+            try {
+                const page = Math.floor(txOrder.length / PAGE_SIZE) + 1;
+                const res = await fetch(`/api/history?page=${page}&size=${PAGE_SIZE}`).then(r => r.json());
+                // A page that adds nothing means the node has no more history to give
+                if (res.code === 200 && mergeTransactions(res.transactions || [])) txTotal = Math.max(res.total_transactions || 0, txOrder.length);
+                else txTotal = txOrder.length;
+                scheduleRender();
+            } catch (e) { console.error('Load more failed:', e); }
+            finally { loadingMore = false; }
+        }
+        function txRowHtml(tx) {
+            const isOut = tx.type === 'outgoing', isPending = tx.status === 'pending';
+            const typeClass = isPending ? 'tx-pending' : (isOut ? 'tx-out' : 'tx-in');
+            const typeText = isPending ? 'Pending' : (isOut ? 'Outgoing' : 'Incoming');
+            const amountClass = isOut ? 'out' : 'in';
+            const sign = isOut ? '-' : '+';
+            const counterparty = isOut ? '→ ' + tx.counterparty.substring(0, 14) + '...' : '← ' + tx.counterparty.substring(0, 14) + '...';
+            return `<div class="tx-item"><div><span class="tx-type ${typeClass}">${typeText}</span><div style="margin-top: 6px; font-size: 0.9em; color: #555; font-weight: 500;">${counterparty}</div><div style="font-size: 0.8em; color: #999; margin-top: 4px;">${dateFormat.format(new Date(tx.timestamp * 1000))}</div></div><div class="tx-amount ${amountClass}">${sign}${parseFloat(tx.amount).toFixed(2)}</div></div>`;
         }
         async function sendTransaction(e) {
             e.preventDefault();
@@ -246,7 +394,7 @@ HTML_TEMPLATE = """
             btn.disabled = true; btn.innerHTML = '<div class="loading" style="width: 18px; height: 18px; border-width: 2px; margin-right: 8px;"></div> Processing...';
             try {
                 const res = await fetch('/api/send', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({recipient, amount, fee}) }).then(r => r.json());
-                if (res.code === 201) { showToast('Transfer Successful!', `交易ID: ${res.txid.substring(0, 16)}...`, 'success'); document.getElementById('sendForm').reset(); setTimeout(refreshData, 1500); }
+                if (res.code === 201 || res.code === 202) { showToast(res.queued ? 'Transfer Queued' : 'Transfer Successful!', `交易ID: ${(res.txid || res.outbox_id).substring(0, 16)}...`, 'success'); document.getElementById('sendForm').reset(); setTimeout(refreshData, 1500); }
                 else { showToast('Transfer Failed', res.error || 'Please check balance or network', 'error'); }
             } catch (e) { showToast('Network Error', 'Unable to connect to wallet service', 'error'); }
             finally { btn.disabled = false; btn.innerHTML = originalText; }
@@ -263,16 +411,134 @@ HTML_TEMPLATE = """
 """
 
 # ---------------- Crypto/Utility Functions ----------------
-def gen_keypair():
-    sk = SigningKey.generate(curve=SECP256k1)
-    pk_bytes = sk.get_verifying_key().to_string()
+# Wire format shared by all backends (the `ecdsa` package defaults the node expects):
+# 32-byte secret, 64-byte x||y public key, SHA-1 message digest, 64-byte r||s signature.
+class EcdsaBackend:
+    name = 'ecdsa'
+    
+    @functools.lru_cache(maxsize=64)
+    def signing_key(self, sk_bytes):
+        # Parsing a key derives its public point, which costs as much as a signature
+        return SigningKey.from_string(sk_bytes, curve=SECP256k1)
+    
+    def generate(self):
+        sk = SigningKey.generate(curve=SECP256k1)
+        return sk.to_string(), sk.get_verifying_key().to_string()
+    
+    def public_key(self, sk_bytes):
+        return self.signing_key(sk_bytes).get_verifying_key().to_string()
+    
+    def sign(self, sk_bytes, payload):
+        return self.signing_key(sk_bytes).sign(payload)
+    
+    def verify(self, pk_bytes, signature, payload):
+        try:
+            return VerifyingKey.from_string(pk_bytes, curve=SECP256k1).verify(signature, payload)
+        except (BadSignatureError, ValueError, AssertionError):
+            return False
+
+class CoincurveBackend:
+    # libsecp256k1 through the optional `coincurve` package
+    name = 'coincurve'
+    
+    def __init__(self):
+        import coincurve
+        self.lib = coincurve
+    
+    @staticmethod
+    def digest(payload):
+        # ecdsa hashes with SHA-1 and reads the 20-byte digest as an integer; left-padding
+        # to the 32 bytes libsecp256k1 wants keeps that integer (and the signature) identical
+        return hashlib.sha1(payload).digest().rjust(32, b'\0')
+    
+    def generate(self):
+        sk = self.lib.PrivateKey()
+        return sk.secret, sk.public_key.format(compressed=False)[1:]
+    
+    def public_key(self, sk_bytes):
+        return self.lib.PrivateKey(sk_bytes).public_key.format(compressed=False)[1:]
+    
+    def sign(self, sk_bytes, payload):
+        return self.lib.PrivateKey(sk_bytes).sign_recoverable(payload, hasher=self.digest)[:64]
+    
+    def verify(self, pk_bytes, signature, payload):
+        if len(signature) != 64 or len(pk_bytes) != 64:
+            return False
+        r = int.from_bytes(signature[:32], 'big')
+        s = int.from_bytes(signature[32:], 'big')
+        # libsecp256k1 only accepts low-S; (r, n - s) is the same signature mirrored
+        n = SECP256k1.order
+        if s > n // 2:
+            s = n - s
+        try:
+            pk = self.lib.PublicKey(b'\x04' + pk_bytes)
+            return pk.verify(der_signature(r, s), payload, hasher=self.digest)
+        except ValueError:
+            return False
+
+def der_signature(r, s):
+    def der_int(x):
+        b = x.to_bytes((x.bit_length() + 8) // 8 or 1, 'big')
+        return b'\x02' + bytes([len(b)]) + b
+    body = der_int(r) + der_int(s)
+    return b'\x30' + bytes([len(body)]) + body
+
+def load_crypto_backend(name=CRYPTO_BACKEND):
+    if name in ('auto', 'coincurve'):
+        try:
+            return CoincurveBackend()
+        except ImportError:
+            if name == 'coincurve':
+                raise
+    return EcdsaBackend()
+
+crypto = load_crypto_backend()
+
+def address_of(pk_bytes: bytes) -> str:
     pk_hash = hashlib.sha256(pk_bytes).hexdigest()[:16]
-    addr = f'coin{pk_hash}'
-    return sk.to_string().hex(), addr, pk_bytes
+    return f'coin{pk_hash}'
+
+def gen_keypair():
+    sk_bytes, pk_bytes = crypto.generate()
+    return sk_bytes.hex(), address_of(pk_bytes), pk_bytes
 
 def sign(sk_hex: str, payload: bytes) -> str:
-    sk = SigningKey.from_string(bytes.fromhex(sk_hex), curve=SECP256k1)
-    return sk.sign(payload).hex()
+    return crypto.sign(bytes.fromhex(sk_hex), payload).hex()
+
+def verify(pk_bytes: bytes, sig_hex: str, payload: bytes) -> bool:
+    try:
+        return crypto.verify(pk_bytes, bytes.fromhex(sig_hex), payload)
+    except ValueError:
+        return False
+
+def bench_crypto(rounds=200):
+    # Times keygen/sign/verify per backend and cross-checks that they interoperate
+    backends = [EcdsaBackend()]
+    try:
+        backends.append(CoincurveBackend())
+    except ImportError:
+        print("coincurve not installed: only the ecdsa backend is benchmarked (pip install coincurve)")
+    payload = tx_payload('coin0000000000000000', 'coin1111111111111111', 1.5, 7, 2.0)
+    print(f"{'backend':<10} {'keygen/s':>10} {'sign/s':>10} {'verify/s':>10}")
+    for b in backends:
+        start = time.perf_counter()
+        keys = [b.generate() for _ in range(rounds)]
+        keygen = rounds / (time.perf_counter() - start)
+        start = time.perf_counter()
+        sigs = [b.sign(sk, payload) for sk, _ in keys]
+        signing = rounds / (time.perf_counter() - start)
+        start = time.perf_counter()
+        ok = all(b.verify(pk, sig, payload) for (_, pk), sig in zip(keys, sigs))
+        verifying = rounds / (time.perf_counter() - start)
+        print(f"{b.name:<10} {keygen:>10.0f} {signing:>10.0f} {verifying:>10.0f}{'' if ok else '  VERIFY FAILED'}")
+    for a in backends:
+        for b in backends:
+            if a is b:
+                continue
+            sk, pk = a.generate()
+            same_key = b.public_key(sk) == pk
+            cross = b.verify(pk, a.sign(sk, payload), payload)
+            print(f"{a.name} -> {b.name}: public key {'match' if same_key else 'MISMATCH'}, signature {'accepted' if cross else 'REJECTED'}")
 
 def tx_payload(sender: str, recipient: str, amount: float, nonce: int, fee: float) -> bytes:
     core_data = dict(sender=sender, recipient=recipient, amount=amount, nonce=nonce, fee=fee)
@@ -281,6 +547,894 @@ def tx_payload(sender: str, recipient: str, amount: float, nonce: int, fee: floa
     sign_data = dict(core_txid=core_txid, **core_data)
     return json.dumps(sign_data, sort_keys=True, separators=(',', ':')).encode()
 
+def heartbeat_payload(real_address: str, coin_addr: str, timestamp: int) -> bytes:
+    data = dict(real_address=real_address, coin_addr=coin_addr, timestamp=timestamp)
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+
+def read_json(resp, array_key):
+    # Small bodies decode about twice as fast in one resp.json() call; the incremental
+    # parser only pays off once the body is big enough for its memory to matter
+    length = resp.headers.get('Content-Length')
+    if length is not None and length.isdigit() and int(length) < JSON_STREAM_MIN_BYTES:
+        return resp.json()
+    return parse_json_stream(resp, array_key)
+
+def parse_json_stream(resp, array_key):
+    # Parses a JSON body straight off the socket (the request must be made with stream=True).
+    # Elements of the first `array_key` array are decoded one at a time as their bytes arrive,
+    # so the body is never held whole; resp.json() keeps the bytes, their text and the objects.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    scanner = json.JSONDecoder()
+    key = re.compile(r'"%s"\s*:\s*\[' % re.escape(array_key))
+    head, tail, items, keys = [], [], [], {}
+    buf, state = '', 'head'
+    for chunk in resp.iter_content(chunk_size=65536):
+        buf += decoder.decode(chunk)
+        if state == 'head':
+            m = key.search(buf)
+            if not m:
+                # Keep enough of the end to catch a key split across chunks
+                keep = len(array_key) + 64
+                head.append(buf[:-keep])
+                buf = buf[-keep:]
+                continue
+            head.append(buf[:m.end() - 1])
+            buf, state = buf[m.end():], 'items'
+        if state == 'items':
+            pos = 0
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buf) and buf[pos] == ']':
+                    buf, state = buf[pos + 1:], 'tail'
+                    break
+                try:
+                    item, end = scanner.raw_decode(buf, pos)
+                except ValueError:
+                    break  # element not complete yet
+                if end == len(buf) or buf[end] not in ' \t\r\n,]':
+                    break  # a number could still continue in the next chunk
+                if isinstance(item, dict):
+                    # Separate decodes don't share key strings the way one json.loads does
+                    item = {keys.setdefault(k, k): v for k, v in item.items()}
+                items.append(item)
+                pos = end
+            if state == 'items':
+                buf = buf[pos:]
+        if state == 'tail':
+            tail.append(buf)
+            buf = ''
+    buf += decoder.decode(b'', final=True)
+    if state == 'head':
+        return json.loads(''.join(head) + buf)
+    if state != 'tail':
+        raise ValueError(f"Truncated JSON: unterminated {array_key} array")
+    # A one-off string marks the exact spot the streamed array came from, however many
+    # other `array_key` keys the envelope has
+    placeholder = uuid.uuid4().hex
+    envelope = json.loads(''.join(head) + json.dumps(placeholder) + ''.join(tail) + buf)
+    fill_placeholder(envelope, placeholder, items)
+    return envelope
+
+def fill_placeholder(obj, placeholder, value):
+    if isinstance(obj, dict):
+        entries = obj.items()
+    elif isinstance(obj, list):
+        entries = enumerate(obj)
+    else:
+        return False
+    for k, v in entries:
+        if isinstance(v, str) and v == placeholder:
+            obj[k] = value
+            return True
+        if fill_placeholder(v, placeholder, value):
+            return True
+    return False
+
+def parse_retry_after(value):
+    # Retry-After is either delta-seconds or an HTTP-date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - now(), 0)
+    except (TypeError, ValueError):
+        return None
+
+# ---------------- Logging ----------------
+# JSON lines via a QueueHandler: callers only serialize and enqueue, a listener thread does the I/O.
+log = logging.getLogger('coinwallet')
+_log_context = threading.local()
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = getattr(_log_context, 'request_id', None)
+        return True
+
+class RateLimitFilter(logging.Filter):
+    # Keyed on the message template, so the same failure with different details still collapses;
+    # the next record let through carries how many were dropped in between.
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self.seen = {}
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        with self.lock:
+            last, suppressed = self.seen.get(key, (0, 0))
+            if record.created - last < self.window:
+                self.seen[key] = (last, suppressed + 1)
+                return False
+            self.seen[key] = (record.created, 0)
+        record.suppressed = suppressed
+        return True
+
+def setup_logging(level='INFO', stream=None):
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(ContextFilter())
+    handler.addFilter(RateLimitFilter(LOG_RATE_WINDOW))
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(records, output)
+    for logger in (log, logging.getLogger('werkzeug')):
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+# ---------------- Profiling ----------------
+_timing = threading.local()
+server_timing = False
+
+@contextmanager
+def timed(phase):
+    # Adds the block's duration to the current API request's Server-Timing header; no-op elsewhere
+    phases = getattr(_timing, 'phases', None)
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0) + (time.perf_counter() - start) * 1000
+
+class SamplingProfiler:
+    # Samples every thread's stack via sys._current_frames() and writes folded stacks
+    # ("outer;inner;leaf count" per line), the input format of flamegraph.pl and speedscope.
+    lock = threading.Lock()
+    
+    def __init__(self, seconds, interval=PROFILE_SAMPLE_INTERVAL):
+        self.seconds = seconds
+        self.interval = interval
+        self.path = os.path.join(PROFILE_DIR, time.strftime('profile-%Y%m%d-%H%M%S.folded'))
+    
+    def start(self):
+        if not SamplingProfiler.lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self.run, daemon=True).start()
+        return True
+    
+    def run(self):
+        try:
+            me = threading.get_ident()
+            stacks = Counter()
+            deadline = now() + self.seconds
+            while now() < deadline:
+                for tid, frame in sys._current_frames().items():
+                    if tid == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stacks[';'.join(reversed(stack))] += 1
+                time.sleep(self.interval)
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            log.info("Profile written: %s (%d samples)", self.path, sum(stacks.values()))
+        except Exception:
+            log.exception("Profiling error")
+        finally:
+            SamplingProfiler.lock.release()
+
+# ---------------- Pending Transaction Tracker ----------------
+class PendingTracker:
+    # Confirmations can only change when a new block lands, so the poller keys off
+    # latest_block_height and checks every due txid against history pages fetched back to its submission.
+    def __init__(self, wallet, webhook=None):
+        self.wallet = wallet
+        self.webhook = webhook
+        self.pending = {}
+        self.confirmed = deque(maxlen=100)
+        self.expired = deque(maxlen=100)
+        self.callbacks = []
+        self.last_height = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+    
+    def add(self, result, recipient):
+        if not result.get('txid'):
+            return
+        with self.lock:
+            self.pending[result['txid']] = {
+                "txid": result['txid'],
+                "recipient": recipient,
+                "amount": result.get('amount'),
+                "fee": result.get('fee'),
+                "nonce": result.get('nonce'),
+                "pending_block": result.get('pending_block'),
+                "submitted_at": now(),
+                "status": "pending"
+            }
+        self.wake.set()
+    
+    def on_confirm(self, callback):
+        self.callbacks.append(callback)
+    
+    def status(self):
+        with self.lock:
+            return {"pending": list(self.pending.values()), "confirmed": list(self.confirmed), "expired": list(self.expired), "block_height": self.last_height}
+    
+    def poll(self):
+        stats = self.wallet.get_chain_stats()
+        if not stats or stats.get('latest_block_height') is None:
+            return False
+        height = stats['latest_block_height']
+        if height == self.last_height:
+            return False
+        with self.lock:
+            due = [tx for tx in self.pending.values()
+                   if not isinstance(tx['pending_block'], int) or tx['pending_block'] <= height]
+        if not due:
+            self.last_height = height
+            return True
+        statuses = self.wallet.get_tx_statuses({tx['txid'] for tx in due}, min(tx['submitted_at'] for tx in due))
+        if statuses is None:
+            return False  # retried on the next poll, not only once another block lands
+        self.last_height = height
+        for tx in due:
+            status = statuses.get(tx['txid'])
+            if status is None and now() - tx['submitted_at'] >= PENDING_EXPIRE:
+                # Never showed up in history: the node dropped it
+                with self.lock:
+                    self.pending.pop(tx['txid'], None)
+                    tx['status'] = 'expired'
+                    self.expired.appendleft(tx)
+                log.warning("Transaction %s not in history %ds after submission, marked expired", tx['txid'], PENDING_EXPIRE)
+            elif status and status != 'pending':
+                with self.lock:
+                    self.pending.pop(tx['txid'], None)
+                    tx['status'] = status
+                    tx['confirmed_at'] = now()
+                    tx['confirmed_height'] = height
+                    self.confirmed.appendleft(tx)
+                self.notify(tx)
+        return True
+    
+    def notify(self, tx):
+        log.info("Transaction confirmed: %s (block %s)", tx['txid'], tx['confirmed_height'])
+        for callback in self.callbacks:
+            try:
+                callback(tx)
+            except Exception:
+                log.exception("Confirmation callback error")
+        if self.webhook:
+            threading.Thread(target=self.post_webhook, args=(tx,), daemon=True).start()
+    
+    def post_webhook(self, tx):
+        try:
+            requests.post(self.webhook, json={"event": "tx_confirmed", "transaction": tx}, timeout=10)
+        except Exception as e:
+            log.warning("Webhook delivery failed: %s", e)
+    
+    def loop(self):
+        delay = PENDING_POLL_MIN
+        while self.wallet.running:
+            self.wake.wait(delay)
+            self.wake.clear()
+            if not self.pending:
+                delay = PENDING_POLL_MAX
+                continue
+            try:
+                advanced = self.poll()
+            except Exception:
+                log.exception("Pending tracker error")
+                advanced = False
+            # Back off while the chain height stands still, snap back once it moves
+            delay = PENDING_POLL_MIN if advanced else min(delay * 2, PENDING_POLL_MAX)
+
+# ---------------- Offline Outbox ----------------
+class NodeUnavailable(Exception):
+    pass
+
+class Outbox:
+    # Append-only journal: a "queue" line per signed transaction followed by "status" lines.
+    # Every write is fsync'd before the caller is acknowledged.
+    def __init__(self, wallet, path=OUTBOX_FILE):
+        self.wallet = wallet
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.load()
+    
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash mid-write
+                    if rec.get('op') == 'queue':
+                        self.entries[rec['entry']['id']] = rec['entry']
+                    elif rec.get('op') == 'status' and rec.get('id') in self.entries:
+                        self.entries[rec['id']].update(rec['fields'])
+        self.compact()
+    
+    def compact(self):
+        done = [e for e in self.entries.values() if e['status'] != 'queued']
+        done.sort(key=lambda e: e.get('updated_at', 0))
+        for e in done[:-OUTBOX_KEEP_DONE]:
+            del self.entries[e['id']]
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for e in sorted(self.entries.values(), key=lambda e: e['nonce']):
+                f.write(json.dumps({"op": "queue", "entry": e}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+    
+    def append(self, rec):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(rec, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def enqueue(self, tx_data, fee):
+        entry = {
+            "id": hashlib.sha256(tx_data['signature'].encode()).hexdigest()[:16],
+            "nonce": tx_data['nonce'],
+            "fee": fee,
+            "tx": tx_data,
+            "status": "queued",
+            "queued_at": now(),
+            "updated_at": now()
+        }
+        with self.lock:
+            self.append({"op": "queue", "entry": entry})
+            self.entries[entry['id']] = entry
+        self.wake.set()
+        return entry
+    
+    def mark(self, entry_id, **fields):
+        fields['updated_at'] = now()
+        with self.lock:
+            self.append({"op": "status", "id": entry_id, "fields": fields})
+            self.entries[entry_id].update(fields)
+    
+    def get(self, entry_id):
+        with self.lock:
+            entry = self.entries.get(entry_id)
+            return dict(entry) if entry else None
+    
+    def status(self):
+        with self.lock:
+            entries = sorted((dict(e) for e in self.entries.values()), key=lambda e: e['nonce'])
+        counts = {}
+        for e in entries:
+            counts[e['status']] = counts.get(e['status'], 0) + 1
+        return {"counts": counts, "entries": entries}
+    
+    def accepted(self, entry, result):
+        self.mark(entry['id'], status="submitted", txid=result.get('txid'), pending_block=result.get('pending_block'))
+        self.wallet.tracker.add({**result, "nonce": entry['nonce'], "fee": entry['fee'], "amount": entry['tx']['amount']}, entry['tx']['recipient'])
+    
+    def submit(self, entry):
+        # True once the node holds the tx, False on a final rejection; NodeUnavailable leaves it queued
+        try:
+            status, result = self.wallet.post_transaction(entry['tx'])
+        except (requests.RequestException, ValueError) as e:
+            raise NodeUnavailable(str(e))
+        if status == 201:
+            self.accepted(entry, result)
+            return True
+        error = result.get('error', f'HTTP {status}')
+        if status == 429 or status >= 500:
+            raise NodeUnavailable(error)
+        if status in (400, 409) and 'nonce' in error.lower():
+            with self.lock:
+                lower = any(e['status'] == 'queued' and e['nonce'] < entry['nonce'] for e in self.entries.values())
+            if lower:
+                raise NodeUnavailable(f"nonce {entry['nonce']} waits for lower queued nonces: {error}")
+        # A submit that timed out may have gone through; the resubmit is then rejected as a duplicate
+        row = self.wallet.find_sent_nonce(entry['nonce'], entry['queued_at'])
+        if row is not None:
+            tx = entry['tx']
+            if row.get('signature') == tx['signature'] or (not row.get('signature') and row.get('recipient', row.get('counterparty')) == tx['recipient']):
+                self.accepted(entry, {"txid": row.get('txid')})
+                return True
+        self.mark(entry['id'], status="failed", error=error)
+        if row is None:
+            self.close_gap(entry['nonce'])
+        return False
+    
+    def close_gap(self, nonce):
+        # The node never consumed this nonce, so every later one would be rejected as ahead:
+        # re-sign the queued entries above it one lower and hand the top nonce back
+        wallet = self.wallet
+        with wallet.send_lock:
+            with self.lock:
+                later = sorted((e for e in self.entries.values() if e['status'] == 'queued' and e['nonce'] > nonce), key=lambda e: e['nonce'])
+            for e in later:
+                tx = wallet.sign_tx(e['tx']['recipient'], e['tx']['amount'], e['nonce'] - 1, e['fee'])
+                self.mark(e['id'], nonce=e['nonce'] - 1, tx=tx)
+            if wallet.last_nonce >= nonce:
+                wallet.last_nonce -= 1
+                wallet.save_key()
+    
+    def flush(self):
+        with self.lock:
+            queued = sorted((e for e in self.entries.values() if e['status'] == 'queued'), key=lambda e: e['nonce'])
+        # One at a time in nonce order: a tx the node hasn't accepted must not be overtaken
+        for entry in queued:
+            if not self.submit(entry):
+                self.wake.set()  # later entries may have been renumbered; start over from the lowest
+                return
+    
+    def loop(self):
+        delay = 1
+        while self.wallet.running:
+            self.wake.wait(delay)
+            self.wake.clear()
+            try:
+                self.flush()
+                delay = OUTBOX_RETRY_MAX
+            except NodeUnavailable as e:
+                delay = min(max(delay, 1) * 2, OUTBOX_RETRY_MAX)
+                log.warning("Master node unavailable, outbox retry in %ss: %s", delay, e)
+            except Exception:
+                delay = OUTBOX_RETRY_MAX
+                log.exception("Outbox flush error")
+
+# ---------------- Columnar History ----------------
+class HistoryColumns:
+    # Full address history as one typed array per field (~30 bytes a row instead of a dict);
+    # counterparties are interned to small ints so grouping is integer work.
+    STATE = ('ts', 'amount', 'fee', 'outgoing', 'pending', 'cp', 'cp_ids', 'cp_names', 'recent', 'recent_order')
+    
+    def __init__(self, wallet):
+        self.wallet = wallet
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.synced_at = 0
+        self.complete = False
+        self.clear()
+    
+    def clear(self):
+        self.ts = array('q')
+        self.amount = array('d')
+        self.fee = array('d')
+        self.outgoing = array('b')
+        self.pending = array('b')
+        self.cp = array('I')
+        self.cp_ids = {}
+        self.cp_names = []
+        self.recent = {}  # row_key -> row, only for the newest HISTORY_RECENT_ROWS rows
+        self.recent_order = deque()  # oldest on the left
+    
+    def __len__(self):
+        return len(self.ts)
+    
+    @staticmethod
+    def row_key(tx):
+        # Rows the node sends without a txid are told apart by their content instead
+        return tx.get('txid') or (tx.get('timestamp'), tx.get('counterparty'), tx.get('amount'), tx.get('type'))
+    
+    def ingest(self, tx, newest=True):
+        # `newest` rows are newer than everything held; backfill rows are older than everything held
+        key = self.row_key(tx)
+        pending = 1 if tx.get('status') == 'pending' else 0
+        row = self.recent.get(key)
+        if row is not None:
+            self.pending[row] = pending
+            return
+        counterparty = tx.get('counterparty') or ''
+        cp_id = self.cp_ids.get(counterparty)
+        if cp_id is None:
+            cp_id = self.cp_ids[counterparty] = len(self.cp_names)
+            self.cp_names.append(counterparty)
+        outgoing = tx.get('type') == 'outgoing'
+        self.ts.append(int(tx.get('timestamp') or 0))
+        self.amount.append(float(tx.get('amount') or 0))
+        self.fee.append(float(tx.get('fee') or 0) if outgoing else 0.0)
+        self.outgoing.append(1 if outgoing else 0)
+        self.pending.append(pending)
+        self.cp.append(cp_id)
+        if newest:
+            self.recent[key] = len(self.ts) - 1
+            self.recent_order.append(key)
+            if len(self.recent_order) > HISTORY_RECENT_ROWS:
+                del self.recent[self.recent_order.popleft()]
+        elif len(self.recent_order) < HISTORY_RECENT_ROWS:
+            self.recent[key] = len(self.ts) - 1
+            self.recent_order.appendleft(key)
+    
+    def sync(self, max_age=HISTORY_SYNC_TTL):
+        with self.sync_lock:
+            if now() - self.synced_at < max_age:
+                return
+            if self.complete:
+                self.sync_head()
+            else:
+                self.backfill()
+            self.synced_at = now()
+    
+    def sync_head(self):
+        # Pages come newest first: read until one reaches rows we already hold, then apply oldest first
+        txs = []
+        page = 1
+        while True:
+            batch = self.wallet.fetch_history_page(page)
+            txs.extend(batch)
+            if len(batch) < HISTORY_PAGE_SIZE or any(self.row_key(tx) in self.recent for tx in batch):
+                break
+            if len(txs) >= HISTORY_RECENT_ROWS:
+                # More new rows than the dedup window covers; rebuild rather than risk duplicates
+                return self.backfill()
+            page += 1
+        # From the first row already held down, rows are old: only their pending flag may change
+        cut = next((i for i, tx in enumerate(txs) if self.row_key(tx) in self.recent), len(txs))
+        with self.lock:
+            for tx in reversed(txs[cut:]):
+                if self.row_key(tx) in self.recent:
+                    self.ingest(tx)
+            for tx in reversed(txs[:cut]):
+                self.ingest(tx)
+    
+    def backfill(self):
+        # Built aside and swapped in whole, so a failure halfway keeps serving the previous totals
+        fresh = HistoryColumns(self.wallet)
+        page = 1
+        after = None
+        while True:
+            txs = self.wallet.fetch_history_page(page)
+            last = len(txs) < HISTORY_PAGE_SIZE
+            # New transactions arriving mid-walk push rows onto the next page; drop rows up to the last one taken
+            if after is not None:
+                keys = [self.row_key(tx) for tx in txs]
+                if after in keys:
+                    txs = txs[keys.index(after) + 1:]
+            for tx in txs:
+                fresh.ingest(tx, newest=False)
+            if txs:
+                after = self.row_key(txs[-1])
+            if last:
+                break
+            page += 1
+        with self.lock:
+            for name in self.STATE:
+                setattr(self, name, getattr(fresh, name))
+        self.complete = True
+        log.info("History synced: %s transactions, %s counterparties", len(self), len(self.cp_names))
+    
+    def summary(self, by='counterparty', since=None, until=None, include_pending=False, limit=100):
+        with self.lock:
+            if np is not None:
+                groups = self.aggregate_numpy(by, since, until, include_pending)
+            else:
+                groups = self.aggregate_python(by, since, until, include_pending)
+            rows = len(self)
+        totals = {k: sum(g[k] for g in groups) for k in ('inflow', 'outflow', 'fees', 'count')}
+        totals['net'] = totals['inflow'] - totals['outflow'] - totals['fees']
+        if by == 'counterparty':
+            groups.sort(key=lambda g: g['inflow'] + g['outflow'], reverse=True)
+            groups = groups[:limit]
+        else:
+            groups.sort(key=lambda g: g['key'])
+        return {"by": by, "groups": groups, "totals": totals, "rows": rows, "synced_at": self.synced_at}
+    
+    def group_key(self, by, key):
+        if by == 'counterparty':
+            return self.cp_names[key]
+        return time.strftime('%Y-%m-%d', time.gmtime(key * 86400))
+    
+    def group_row(self, by, key, inflow, outflow, fees, count):
+        return {"key": self.group_key(by, key), "inflow": inflow, "outflow": outflow, "fees": fees,
+                "net": inflow - outflow - fees, "count": count}
+    
+    def aggregate_numpy(self, by, since, until, include_pending):
+        # Zero-copy views over the arrays; they must be gone before the arrays grow again,
+        # which is why this runs as its own call under the lock.
+        ts = np.frombuffer(self.ts, dtype=np.int64)
+        if not len(ts):
+            return []
+        keep = np.ones(len(ts), dtype=bool)
+        if since is not None:
+            keep &= ts >= since
+        if until is not None:
+            keep &= ts < until
+        if not include_pending:
+            keep &= np.frombuffer(self.pending, dtype=np.int8) == 0
+        # Group ids are dense small ints (interned counterparty, or day offset), so bincount does
+        # the grouping; filtered-out rows get zero weight instead of being copied out
+        if by == 'counterparty':
+            index = np.frombuffer(self.cp, dtype=np.uint32).astype(np.intp)
+            base = 0
+        else:
+            days = ts // 86400
+            base = int(days.min())
+            index = days - base
+        outgoing = np.frombuffer(self.outgoing, dtype=np.int8).view(bool)
+        amount = np.frombuffer(self.amount, dtype=np.float64)
+        fee = np.frombuffer(self.fee, dtype=np.float64)
+        inflow = np.bincount(index, weights=np.where(keep & ~outgoing, amount, 0.0))
+        outflow = np.bincount(index, weights=np.where(keep & outgoing, amount, 0.0))
+        fees = np.bincount(index, weights=np.where(keep, fee, 0.0))
+        counts = np.bincount(index, weights=keep)
+        return [self.group_row(by, base + int(k), float(inflow[k]), float(outflow[k]), float(fees[k]), int(counts[k]))
+                for k in np.flatnonzero(counts)]
+    
+    def aggregate_python(self, by, since, until, include_pending):
+        lo = since if since is not None else -2**63
+        hi = until if until is not None else 2**63
+        keys = self.cp if by == 'counterparty' else (ts // 86400 for ts in self.ts)
+        acc = {}
+        for key, ts, amount, fee, outgoing, pending in zip(keys, self.ts, self.amount, self.fee, self.outgoing, self.pending):
+            if lo <= ts < hi and not (pending and not include_pending):
+                g = acc.get(key)
+                if g is None:
+                    g = acc[key] = [0.0, 0.0, 0.0, 0]
+                g[outgoing] += amount
+                g[2] += fee
+                g[3] += 1
+        return [self.group_row(by, k, *g) for k, g in acc.items()]
+
+# ---------------- History Audit ----------------
+def audit_init(backend):
+    # Audit processes start fresh (spawn), so they pick the parent's backend explicitly
+    global crypto
+    crypto = load_crypto_backend(backend)
+
+def audit_verify_chunk(items):
+    return [(txid, any(verify(bytes.fromhex(pk_hex), sig_hex, payload) for payload in payloads))
+            for txid, pk_hex, sig_hex, payloads in items]
+
+class HistoryAudit:
+    # Re-verifies history signatures against tx_payload locally. Verified txids are kept in an
+    # append-only file with a fingerprint of what was verified, so each entry is checked once
+    # and checked again only if the node starts returning something different for it.
+    def __init__(self, wallet, path=AUDIT_CACHE_FILE):
+        self.wallet = wallet
+        self.path = path
+        self.verified = {}
+        self.running = threading.Lock()
+        self.load()
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    self.verified[rec['txid']] = rec['fp']
+                except (ValueError, KeyError):
+                    continue  # torn final line from a crash mid-write
+    
+    def save(self, recs):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for txid, fp in recs:
+                f.write(json.dumps({"txid": txid, "fp": fp}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def prepare(self, tx):
+        # Returns (work item, None), (None, mismatch reason), or (None, None) when unverifiable
+        sender, sig_hex = tx.get('sender'), tx.get('signature')
+        pk_hex = tx.get('pubkey_hex') or tx.get('public_key')
+        if not pk_hex and sender == self.wallet.coin_addr:
+            pk_hex = self.wallet.pk_bytes.hex()
+        if not (tx.get('txid') and sender and sig_hex and pk_hex):
+            return None, None
+        # The signed payload needs every field; rows the node sends without one can't be checked
+        if any(tx.get(f) is None for f in ('recipient', 'amount', 'nonce', 'fee')):
+            return None, None
+        try:
+            if address_of(bytes.fromhex(pk_hex)) != sender:
+                return None, "public key does not match sender"
+        except ValueError:
+            return None, "invalid public key"
+        args = (sender, tx.get('recipient'), tx.get('amount'), tx.get('nonce'), tx.get('fee'))
+        payloads = [tx_payload(*args)]
+        try:
+            # The wallet signs float amounts/fees; the node may echo them back as ints
+            floats = tx_payload(*args[:2], float(args[2]), args[3], float(args[4]))
+        except (TypeError, ValueError):
+            floats = payloads[0]
+        if floats != payloads[0]:
+            payloads.append(floats)
+        return (tx['txid'], pk_hex, sig_hex, payloads), None
+    
+    @staticmethod
+    def fingerprint(item):
+        txid, pk_hex, sig_hex, payloads = item
+        return hashlib.sha256(pk_hex.encode() + sig_hex.encode() + payloads[0]).hexdigest()[:16]
+    
+    def verify_all(self, items):
+        if len(items) < AUDIT_CHUNK or AUDIT_WORKERS < 2:
+            return audit_verify_chunk(items)
+        chunks = [items[i:i + AUDIT_CHUNK] for i in range(0, len(items), AUDIT_CHUNK)]
+        # spawn, not fork: forking a process that is serving requests on other threads is unsafe
+        with ProcessPoolExecutor(max_workers=min(AUDIT_WORKERS, len(chunks)), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=audit_init, initargs=(crypto.name,)) as pool:
+            return [r for chunk in pool.map(audit_verify_chunk, chunks) for r in chunk]
+    
+    def run(self, full=False):
+        # Incremental by default: stops at the first history page with nothing new to verify
+        if not self.running.acquire(blocking=False):
+            return None
+        try:
+            start = time.perf_counter()
+            report = {"pages": 0, "verified": 0, "cached": 0, "unverifiable": 0, "mismatches": []}
+            items = []
+            page = 1
+            while True:
+                txs = self.wallet.fetch_history_page(page)
+                report['pages'] = page
+                fresh = 0
+                for tx in txs:
+                    item, reason = self.prepare(tx)
+                    if reason:
+                        report['mismatches'].append({"txid": tx.get('txid'), "reason": reason})
+                        fresh += 1
+                    elif item is None:
+                        report['unverifiable'] += 1
+                    elif self.verified.get(item[0]) == self.fingerprint(item):
+                        report['cached'] += 1
+                    else:
+                        items.append(item)
+                        fresh += 1
+                if len(txs) < HISTORY_PAGE_SIZE or not (fresh or full):
+                    break
+                page += 1
+            fps = {item[0]: self.fingerprint(item) for item in items}
+            good = []
+            for txid, ok in self.verify_all(items):
+                if ok:
+                    good.append((txid, fps[txid]))
+                else:
+                    report['mismatches'].append({"txid": txid, "reason": "bad signature"})
+            if good:
+                self.save(good)
+                self.verified.update(good)
+            report['verified'] = len(good)
+            report['seconds'] = round(time.perf_counter() - start, 3)
+            for m in report['mismatches']:
+                log.warning("Audit mismatch: %s (%s)", m['txid'], m['reason'])
+            log.info("Audit done: %d verified, %d cached, %d unverifiable, %d mismatches in %.2fs",
+                     report['verified'], report['cached'], report['unverifiable'], len(report['mismatches']), report['seconds'])
+            return report
+        finally:
+            self.running.release()
+
+# ---------------- History Export ----------------
+EXPORT_FIELDS = ('txid', 'timestamp', 'type', 'status', 'counterparty', 'sender', 'recipient', 'amount', 'fee', 'nonce')
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def iter_history_pages(wallet, page=1, after=None, prefetch=EXPORT_PREFETCH):
+    # Yields (page, transactions) with `prefetch` page requests in flight ahead of the consumer,
+    # so memory stays at a few pages whatever the history size. New transactions arriving
+    # mid-walk push rows onto the next page; rows up to the last one yielded (`after`) are dropped.
+    pool = ThreadPoolExecutor(max_workers=prefetch)
+    ahead = deque()
+    next_page = page
+    try:
+        while True:
+            while len(ahead) < prefetch:
+                ahead.append((next_page, pool.submit(wallet.fetch_history_page, next_page)))
+                next_page += 1
+            page, future = ahead.popleft()
+            txs = future.result()
+            last = len(txs) < HISTORY_PAGE_SIZE
+            if after is not None:
+                ids = [tx.get('txid') for tx in txs]
+                if after in ids:
+                    txs = txs[ids.index(after) + 1:]
+            if txs:
+                after = txs[-1].get('txid')
+            yield page, txs
+            if last:
+                return
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def export_header(fmt):
+    if fmt != 'csv':
+        return ''
+    buf = io.StringIO()
+    csv.writer(buf).writerow(EXPORT_FIELDS)
+    return buf.getvalue()
+
+def export_rows(txs, fmt):
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(tx, ensure_ascii=False, separators=(',', ':')) + '\n' for tx in txs)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for tx in txs:
+        writer.writerow([tx.get(f, '') for f in EXPORT_FIELDS])
+    return buf.getvalue()
+
+def gzip_stream(chunks):
+    z = zlib.compressobj(5, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = z.compress(chunk.encode())
+        if data:
+            yield data
+    yield z.flush()
+
+def export_history(wallet, path, fmt):
+    # After every page the file is fsync'd and its length checkpointed, so an interrupted export
+    # rerun with the same arguments truncates the partial page and carries on from the next one
+    ckpt_path = path + '.ckpt'
+    ckpt = {"format": fmt, "page": 0, "bytes": 0, "after": None}
+    if os.path.exists(ckpt_path) and os.path.exists(path):
+        with open(ckpt_path, 'r', encoding='utf-8') as f:
+            ckpt = json.load(f)
+        if ckpt.get('format') != fmt:
+            raise ValueError(f"{path} is a partial {ckpt.get('format')} export; delete {ckpt_path} to start over")
+        log.info("Resuming export to %s after page %d", path, ckpt['page'])
+    rows = 0
+    with open(path, 'r+b' if ckpt['page'] else 'wb') as f:
+        f.truncate(ckpt['bytes'])
+        f.seek(ckpt['bytes'])
+        if not ckpt['page']:
+            f.write(export_header(fmt).encode())
+        for page, txs in iter_history_pages(wallet, ckpt['page'] + 1, ckpt['after']):
+            f.write(export_rows(txs, fmt).encode())
+            f.flush()
+            os.fsync(f.fileno())
+            rows += len(txs)
+            ckpt.update(page=page, bytes=f.tell(), after=txs[-1].get('txid') if txs else ckpt['after'])
+            with open(ckpt_path + '.tmp', 'w', encoding='utf-8') as c:
+                json.dump(ckpt, c)
+            os.replace(ckpt_path + '.tmp', ckpt_path)
+    os.remove(ckpt_path)
+    log.info("Exported %d transactions to %s", rows, path)
+    return rows
+
 # ---------------- Coin Wallet Core Class ----------------
 class CoinWallet:
     def __init__(self):
@@ -289,7 +1443,33 @@ class CoinWallet:
         self.pk_bytes = None
         self.last_nonce = -1
         self.tx_fee = 2.0
+        self.send_lock = threading.Lock()
+        self.tracker = PendingTracker(self)
+        self.outbox = None
+        self.http = requests.Session()
+        self.http.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=max(PORTFOLIO_CONCURRENCY, READ_CONCURRENCY)))
+        self.node_cache = OrderedDict()
+        self.node_cache_lock = threading.Lock()
+        self.chain_stats_body = None
+        self.hb_retry_after = None
+        self.hb_batch = True
+        self.hb_batch_checked = 0
+        self.announce_keys = []
+        self.watch_addrs = []
+        self.portfolio = None
+        self.portfolio_lock = threading.Lock()
+        self.portfolio_pool = ThreadPoolExecutor(max_workers=PORTFOLIO_CONCURRENCY)
+        self.history_columns = HistoryColumns(self)
+        self.audit = HistoryAudit(self)
+        self.public_ip = None
+        self.public_ip_at = 0
+        self.snapshot = {}
+        self.stale = set()
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_dirty = False
         self.load_or_create_key()
+        self.load_watch_list()
+        self.load_snapshot()
         self.running = True
         
     def load_or_create_key(self):
@@ -300,11 +1480,11 @@ class CoinWallet:
             self.coin_addr = dat['coin_addr']
             self.pk_bytes = bytes.fromhex(dat['pubkey_hex'])
             self.last_nonce = dat.get('last_nonce', -1)
-            print(f"✅ Coin Wallet loaded | Address: {self.coin_addr}")
+            log.info("Coin Wallet loaded | Address: %s", self.coin_addr)
         else:
             self.sk_hex, self.coin_addr, self.pk_bytes = gen_keypair()
             self.save_key()
-            print(f"🆕 Coin Wallet created | Address: {self.coin_addr}")
+            log.info("Coin Wallet created | Address: %s", self.coin_addr)
     
     def save_key(self):
         with open(KEY_FILE, 'w', encoding='utf-8') as f:
@@ -315,36 +1495,167 @@ class CoinWallet:
                 'last_nonce': self.last_nonce
             }, f, indent=2)
     
-    def get_network_fee(self):
+    def load_snapshot(self):
+        if not os.path.exists(SNAPSHOT_FILE):
+            return
         try:
-            resp = requests.get(f"http://{MAIN_NODE}/chain/stats", timeout=10)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get('code') == 200:
-                    return data.get('stats', {}).get('tx_fee', 2.0)
-        except:
-            pass
+            with open(SNAPSHOT_FILE, 'r', encoding='utf-8') as f:
+                dat = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable snapshot: %s", e)
+            return
+        if dat.get('coin_addr') != self.coin_addr:
+            return
+        self.snapshot = dat.get('values', {})
+        # Everything from disk is stale until a live request replaces it
+        self.stale = set(self.snapshot)
+        self.tx_fee = self.snapshot.get('tx_fee', self.tx_fee)
+        self.public_ip = self.snapshot.get('public_ip')
+        # Counts as detected when saved, so it is reused until PUBLIC_IP_REFRESH runs out
+        self.public_ip_at = dat.get('saved_at', 0) if self.public_ip else 0
+        log.info("Warm start from snapshot saved at %s", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(dat.get('saved_at', 0))))
+    
+    def remember(self, key, value):
+        with self.snapshot_lock:
+            self.snapshot[key] = value
+            self.stale.discard(key)
+            self.snapshot_dirty = True
+    
+    def warm_value(self, key):
+        # Snapshot value for `key` while it has not yet been refreshed since launch, else None
+        with self.snapshot_lock:
+            return self.snapshot.get(key) if key in self.stale else None
+    
+    def save_snapshot(self):
+        with self.snapshot_lock:
+            if not self.snapshot_dirty:
+                return
+            dat = {'coin_addr': self.coin_addr, 'saved_at': now(), 'values': dict(self.snapshot)}
+            self.snapshot_dirty = False
+        tmp = SNAPSHOT_FILE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(dat, f, ensure_ascii=False)
+        os.replace(tmp, SNAPSHOT_FILE)
+    
+    def snapshot_loop(self):
+        # Bring stale values up to date in the background, then persist periodically
+        while self.running:
+            try:
+                if 'balance' in self.stale:
+                    self.get_balance()
+                if 'history' in self.stale:
+                    self.get_history()
+                if 'chain_stats' in self.stale:
+                    self.get_chain_stats()
+                self.save_snapshot()
+            except Exception:
+                log.exception("Snapshot refresh error")
+            self.pause(5 if self.stale - {'tx_fee', 'public_ip'} else SNAPSHOT_INTERVAL)
+    
+    def node_get(self, path, timeout=10, array_key=None):
+        # `array_key` names a large array in the body to parse incrementally off the socket
+        status, entry = self.node_fetch(path, timeout, array_key=array_key)
+        if entry['data'] is None:
+            entry['data'] = json.loads(entry['raw'])
+        return status, entry['data']
+    
+    def node_get_raw(self, path, timeout=10):
+        # The body bytes as the node sent them, for passthrough without a decode/encode round trip
+        status, entry = self.node_fetch(path, timeout, raw=True)
+        if entry['raw'] is None:
+            entry['raw'] = json.dumps(entry['data'], separators=(',', ':')).encode()
+        return status, entry['raw']
+    
+    def node_fetch(self, path, timeout=10, array_key=None, raw=False):
+        # Revalidate against the last response for this path; a 304 reuses the cached body.
+        # Entries hold the raw bytes, the parsed data, or both once each has been asked for.
+        with self.node_cache_lock:
+            cached = self.node_cache.get(path)
+            if cached:
+                self.node_cache.move_to_end(path)
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        with timed('node'):
+            with self.http.get(f"http://{MAIN_NODE}{path}", headers=headers, timeout=timeout, stream=True) as resp:
+                if resp.status_code == 304 and cached:
+                    return 200, cached
+                etag, last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+                entry = {'etag': etag, 'last_modified': last_modified, 'raw': None, 'data': None}
+                if raw:
+                    entry['raw'] = resp.content
+                elif array_key:
+                    entry['data'] = read_json(resp, array_key)
+                else:
+                    entry['data'] = resp.json()
+        if resp.status_code == 200 and (etag or last_modified):
+            # Bounded: every history page the UI scrolls to has its own path
+            with self.node_cache_lock:
+                self.node_cache[path] = entry
+                self.node_cache.move_to_end(path)
+                if len(self.node_cache) > NODE_CACHE_SIZE:
+                    self.node_cache.popitem(last=False)
+        return resp.status_code, entry
+    
+    def get_chain_stats(self):
+        try:
+            status, data = self.node_get("/chain/stats")
+            if status == 200 and data.get('code') == 200:
+                self.remember('chain_stats', data)
+                return data.get('stats', {})
+            log.warning("Chain stats request failed: HTTP %s", status)
+        except Exception as e:
+            log.warning("Chain stats request failed: %s", e)
+        return None
+    
+    def get_network_fee(self):
+        stats = self.get_chain_stats()
+        if stats:
+            return stats.get('tx_fee', 2.0)
         return 2.0
     
     def heartbeat_loop(self):
         self.tx_fee = self.get_network_fee()
-        print(f"💰 Current network fee: {self.tx_fee} XODE")
+        self.remember('tx_fee', self.tx_fee)
+        log.info("Current network fee: %s XODE", self.tx_fee)
+        last_fee_check = now()
+        failures = 0
         
+        # Random phase so wallets started (or restarted) together don't beat in lockstep
+        self.pause(random.uniform(0, HEARTBEAT_INTERVAL))
         while self.running:
+            ok = False
             try:
-                self.register()
-                if int(now()) % 300 == 0:
+                ok = self.register()
+                if now() - last_fee_check >= FEE_REFRESH_INTERVAL:
+                    last_fee_check = now()
                     new_fee = self.get_network_fee()
                     if new_fee != self.tx_fee:
-                        print(f"💰 Fee updated: {self.tx_fee} → {new_fee}")
+                        log.info("Fee updated: %s → %s", self.tx_fee, new_fee)
                         self.tx_fee = new_fee
-                for _ in range(HEARTBEAT_INTERVAL):
-                    if not self.running:
-                        break
-                    time.sleep(1)
-            except Exception as e:
-                print(f"⚠️ Heartbeat error: {e}")
-                time.sleep(10)
+                        self.remember('tx_fee', new_fee)
+            except Exception:
+                log.exception("Heartbeat error")
+            failures = 0 if ok else failures + 1
+            self.pause(self.next_heartbeat_delay(failures))
+    
+    def next_heartbeat_delay(self, failures):
+        # Server hints win (never beat earlier than asked, but never wait past HEARTBEAT_BACKOFF_MAX);
+        # otherwise back off exponentially on failure
+        if self.hb_retry_after is not None:
+            return min(self.hb_retry_after, HEARTBEAT_BACKOFF_MAX) * random.uniform(1, 1 + HEARTBEAT_JITTER)
+        delay = HEARTBEAT_INTERVAL
+        if failures:
+            delay = min(HEARTBEAT_INTERVAL * 2 ** (failures - 1), HEARTBEAT_BACKOFF_MAX)
+        return delay * random.uniform(1 - HEARTBEAT_JITTER, 1 + HEARTBEAT_JITTER)
+    
+    def pause(self, seconds):
+        deadline = now() + seconds
+        while self.running and now() < deadline:
+            time.sleep(min(1, deadline - now()))
     
     def get_public_ip(self):
         try:
@@ -360,122 +1671,546 @@ class CoinWallet:
         except:
             return '127.0.0.1'
     
+    def current_public_ip(self):
+        # Re-detect at most every PUBLIC_IP_REFRESH seconds instead of on every heartbeat
+        if self.public_ip is None or now() - self.public_ip_at >= PUBLIC_IP_REFRESH:
+            self.public_ip = self.get_public_ip()
+            self.public_ip_at = now()
+            self.remember('public_ip', self.public_ip)
+        return self.public_ip
+    
+    def load_announce_keys(self, path):
+        # Other wallets on this host (key files in the wallet_key.json format) beat alongside ours
+        for name in sorted(os.listdir(path)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(path, name), 'r', encoding='utf-8') as f:
+                    dat = json.load(f)
+                key = (dat['sk_hex'], dat['coin_addr'], bytes.fromhex(dat['pubkey_hex']))
+            except (OSError, ValueError, KeyError) as e:
+                log.warning("Ignoring key file %s: %s", name, e)
+                continue
+            if key[1] != self.coin_addr:
+                self.announce_keys.append(key)
+        log.info("Announcing %d extra addresses with each heartbeat", len(self.announce_keys))
+    
     def register(self):
+        ip = self.current_public_ip()
+        real_address = f"{ip}:0"
+        if not self.announce_keys:
+            return self.register_one(real_address, self.coin_addr, self.pk_bytes)
+        keys = [(self.sk_hex, self.coin_addr, self.pk_bytes)] + self.announce_keys
+        if self.hb_batch or now() - self.hb_batch_checked >= HEARTBEAT_BATCH_REPROBE:
+            ok = self.register_batch(real_address, keys)
+            if ok is not None:
+                return ok
+        # Node without /heartbeat/batch: one request per address, ours first
+        ok = self.register_one(real_address, self.coin_addr, self.pk_bytes)
+        retry_after = self.hb_retry_after
+        for _, coin_addr, pk_bytes in self.announce_keys:
+            self.register_one(real_address, coin_addr, pk_bytes)
+        self.hb_retry_after = retry_after
+        return ok
+    
+    def register_batch(self, real_address, keys):
+        # Returns None when the node has no batch endpoint, so the caller falls back
+        timestamp = int(now())
+        ok = True
         try:
-            ip = self.get_public_ip()
-            real_address = f"{ip}:0"
-            
-            resp = requests.post(
+            for i in range(0, len(keys), HEARTBEAT_BATCH_SIZE):
+                heartbeats = [{
+                    "coin_addr": coin_addr,
+                    "pubkey_hex": pk_bytes.hex(),
+                    "signature": sign(sk_hex, heartbeat_payload(real_address, coin_addr, timestamp))
+                } for sk_hex, coin_addr, pk_bytes in keys[i:i + HEARTBEAT_BATCH_SIZE]]
+                resp = self.http.post(
+                    f"http://{MAIN_NODE}/heartbeat/batch",
+                    json={"real_address": real_address, "timestamp": timestamp, "heartbeats": heartbeats},
+                    headers={"Content-Type": "application/json"},
+                    timeout=30
+                )
+                if resp.status_code in (404, 405, 501):
+                    if self.hb_batch:
+                        log.info("Master node has no batched heartbeat, falling back to one request per address")
+                    self.hb_batch = False
+                    self.hb_batch_checked = now()
+                    return None
+                self.hb_batch = True
+                self.hb_retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                if resp.status_code == 429:
+                    if self.hb_retry_after is None:
+                        self.hb_retry_after = HEARTBEAT_INTERVAL * 2
+                    return ok
+                if resp.status_code != 200:
+                    log.warning("Batched heartbeat rejected: HTTP %s", resp.status_code)
+                    return False
+                data = resp.json()
+                interval = data.get('heartbeat_interval')
+                if self.hb_retry_after is None and isinstance(interval, (int, float)) and interval > 0:
+                    self.hb_retry_after = min(interval, HEARTBEAT_BACKOFF_MAX)
+                rejected = data.get('rejected') or {}
+                if rejected:
+                    log.warning("Batched heartbeat: %d of %d addresses rejected, e.g. %s", len(rejected), len(heartbeats), next(iter(rejected.items())))
+                if self.coin_addr in rejected:
+                    ok = False
+            return ok
+        except Exception as e:
+            log.warning("Batched heartbeat request failed: %s", e)
+            self.hb_retry_after = None
+            return False
+    
+    def register_one(self, real_address, coin_addr, pk_bytes):
+        try:
+            resp = self.http.post(
                 f"http://{MAIN_NODE}/heartbeat",
                 json={
                     "real_address": real_address,
-                    "coin_addr": self.coin_addr,
-                    "pubkey_hex": self.pk_bytes.hex()
+                    "coin_addr": coin_addr,
+                    "pubkey_hex": pk_bytes.hex()
                 },
                 headers={"Content-Type": "application/json"},
                 timeout=10
             )
             
+            self.hb_retry_after = parse_retry_after(resp.headers.get('Retry-After'))
             if resp.status_code == 200:
                 data = resp.json()
+                interval = data.get('heartbeat_interval')
+                if self.hb_retry_after is None and isinstance(interval, (int, float)) and interval > 0:
+                    self.hb_retry_after = min(interval, HEARTBEAT_BACKOFF_MAX)
                 server_addr = data.get('coin_addr')
-                if server_addr != self.coin_addr:
-                    print(f"❌ Address mismatch! Local:{self.coin_addr}, Server:{server_addr}")
+                if server_addr != coin_addr:
+                    log.error("Address mismatch! Local:%s, Server:%s", coin_addr, server_addr)
                     return False
                 return True
             elif resp.status_code == 429:
+                # Throttled: still registered, but wait as long as the node asks
+                if self.hb_retry_after is None:
+                    self.hb_retry_after = HEARTBEAT_INTERVAL * 2
                 return True
             else:
+                log.warning("Heartbeat rejected: HTTP %s", resp.status_code)
                 return False
-        except:
+        except Exception as e:
+            log.warning("Heartbeat request failed: %s", e)
+            self.hb_retry_after = None
             return False
     
-    def get_balance(self):
+    def fetch_balance(self, addr):
+        status, data = self.node_get(f"/balance/{addr}")
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}")
+        return data.get('balance', 0)
+    
+    def get_balance(self, addr=None):
         try:
-            resp = requests.get(f"http://{MAIN_NODE}/balance/{self.coin_addr}", timeout=10)
-            if resp.status_code == 200:
-                return resp.json().get('balance', 0)
-            return 0
-        except:
+            balance = self.fetch_balance(addr or self.coin_addr)
+        except Exception as e:
+            log.warning("Balance request failed: %s", e)
             return 0
+        if addr in (None, self.coin_addr):
+            self.remember('balance', balance)
+        return balance
+    
+    def load_watch_list(self):
+        if os.path.exists(WATCH_FILE):
+            with open(WATCH_FILE, 'r', encoding='utf-8') as f:
+                self.watch_addrs = json.load(f).get('addresses', [])
     
-    def get_history(self):
+    def save_watch_list(self):
+        with open(WATCH_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'addresses': self.watch_addrs}, f, indent=2)
+    
+    def add_watch(self, addr):
+        if not (isinstance(addr, str) and addr.startswith('coin') and len(addr) == 20):
+            return False
+        if addr != self.coin_addr and addr not in self.watch_addrs:
+            self.watch_addrs.append(addr)
+            self.save_watch_list()
+            self.portfolio = None
+        return True
+    
+    def remove_watch(self, addr):
+        if addr not in self.watch_addrs:
+            return False
+        self.watch_addrs.remove(addr)
+        self.save_watch_list()
+        self.portfolio = None
+        return True
+    
+    def portfolio_entry(self, addr, previous):
+        entry = {"address": addr, "watch_only": addr != self.coin_addr}
         try:
-            resp = requests.get(f"http://{MAIN_NODE}/address/transactions?addr={self.coin_addr}&size=50", timeout=10)
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get('code') == 200:
-                    return data.get('data', {})
+            entry["balance"] = self.fetch_balance(addr)
+        except Exception as e:
+            # Keep the last known value so one slow address doesn't zero the total
+            entry["balance"] = previous.get(addr, 0)
+            entry["stale"] = True
+            entry["error"] = str(e)
+        return entry
+    
+    def get_portfolio(self, max_age=PORTFOLIO_CACHE_TTL):
+        # All balances are fetched in parallel; concurrent callers wait for and share one refresh
+        with self.portfolio_lock:
+            if self.portfolio and now() - self.portfolio['updated_at'] < max_age:
+                return self.portfolio
+            previous = {e['address']: e['balance'] for e in (self.portfolio or {}).get('addresses', [])}
+            addrs = [self.coin_addr] + list(self.watch_addrs)
+            entries = list(self.portfolio_pool.map(lambda a: self.portfolio_entry(a, previous), addrs))
+            self.portfolio = {
+                "addresses": entries,
+                "total": round(sum(e['balance'] for e in entries), 6),
+                "watch_only_total": round(sum(e['balance'] for e in entries if e['watch_only']), 6),
+                "errors": sum(1 for e in entries if e.get('stale')),
+                "updated_at": now()
+            }
+            return self.portfolio
+    
+    def get_history(self, size=50, page=1):
+        try:
+            status, data = self.node_get(f"/address/transactions?addr={self.coin_addr}&size={size}&page={page}", array_key='transactions')
+            if status == 200 and data.get('code') == 200:
+                if size == 50 and page == 1:
+                    self.remember('history', data.get('data', {}))
+                return data.get('data', {})
+            log.warning("History request failed: HTTP %s", status)
             return {'transactions': [], 'total': 0}
-        except:
+        except Exception as e:
+            log.warning("History request failed: %s", e)
             return {'transactions': [], 'total': 0}
     
-    def send(self, recipient, amount, fee=None):
+    def fetch_history_page(self, page, size=HISTORY_PAGE_SIZE):
+        # Straight to the node: node_get would keep every page alive in its revalidation cache
+        path = f"/address/transactions?addr={self.coin_addr}&size={size}&page={page}"
         try:
-            amount = round(float(amount), 6)
-            tx_fee = round(float(fee), 6) if fee is not None else self.tx_fee
-            
-            balance = self.get_balance()
-            if balance < amount + tx_fee:
-                return {"error": f"Insufficient balance (current:{balance}, required:{round(amount + tx_fee, 6)}）"}
-            
-            self.last_nonce += 1
-            nonce = self.last_nonce
-            
+            with timed('node'):
+                with self.http.get(f"http://{MAIN_NODE}{path}", timeout=10, stream=True) as resp:
+                    data = read_json(resp, 'transactions')
+        except (requests.RequestException, ValueError) as e:
+            raise NodeUnavailable(str(e))
+        if resp.status_code != 200 or data.get('code') != 200:
+            raise NodeUnavailable(f"HTTP {resp.status_code}")
+        return data.get('data', {}).get('transactions', [])
+    
+    def history_since(self, since):
+        # History pages newest first, stopping after the first page that predates `since`
+        cutoff = since - PENDING_CLOCK_SKEW
+        page = 1
+        while True:
+            txs = self.fetch_history_page(page)
+            yield txs
+            if len(txs) < HISTORY_PAGE_SIZE or min((tx.get('timestamp') or 0) for tx in txs) < cutoff:
+                return
+            page += 1
+    
+    def get_tx_statuses(self, txids, since):
+        # Pages back until every txid is found or the page predates `since` (the oldest
+        # submission). None when the node can't be read.
+        statuses = {}
+        try:
+            for txs in self.history_since(since):
+                for tx in txs:
+                    if tx.get('txid') in txids:
+                        statuses[tx['txid']] = tx.get('status')
+                if len(statuses) == len(txids):
+                    break
+        except NodeUnavailable as e:
+            log.warning("Pending status check failed: %s", e)
+            return None
+        return statuses
+    
+    def find_sent_nonce(self, nonce, since):
+        # Our outgoing history row carrying `nonce`, if the node has one
+        for txs in self.history_since(since):
+            for tx in txs:
+                if tx.get('type') == 'outgoing' and tx.get('nonce') == nonce:
+                    return tx
+        return None
+    
+    def sign_tx(self, recipient, amount, nonce, tx_fee):
+        with timed('payload'):
             payload = tx_payload(self.coin_addr, recipient, amount, nonce, tx_fee)
+        with timed('sign'):
             signature = sign(self.sk_hex, payload)
-            
-            tx_data = {
-                "sender": self.coin_addr,
-                "recipient": recipient,
-                "amount": amount,
-                "nonce": nonce,
-                "signature": signature
-            }
-            
-            resp = requests.post(
+        return {
+            "sender": self.coin_addr,
+            "recipient": recipient,
+            "amount": amount,
+            "nonce": nonce,
+            "signature": signature
+        }
+    
+    def post_transaction(self, tx_data):
+        with timed('post'):
+            resp = self.http.post(
                 f"http://{MAIN_NODE}/transactions/new",
                 json=tx_data,
                 headers={"Content-Type": "application/json"},
                 timeout=10
             )
+            return resp.status_code, resp.json()
+    
+    def send(self, recipient, amount, fee=None):
+        if self.outbox is not None:
+            return self.queue_send(recipient, amount, fee)
+        with self.send_lock:
+            try:
+                amount = round(float(amount), 6)
+                tx_fee = round(float(fee), 6) if fee is not None else self.tx_fee
             
-            result = resp.json()
+                with timed('balance'):
+                    balance = self.get_balance()
+                if balance < amount + tx_fee:
+                    return {"error": f"Insufficient balance (current:{balance}, required:{round(amount + tx_fee, 6)}）"}
             
-            if resp.status_code == 201:
+                self.last_nonce += 1
+                nonce = self.last_nonce
+            
+                tx_data = self.sign_tx(recipient, amount, nonce, tx_fee)
+                status, result = self.post_transaction(tx_data)
+            
+                if status == 201:
+                    with timed('save_key'):
+                        self.save_key()
+                    sent = {"success": True, "txid": result.get('txid'), "pending_block": result.get('pending_block'), "nonce": nonce, "fee": tx_fee, "amount": amount}
+                    self.tracker.add(sent, recipient)
+                    return sent
+                else:
+                    self.last_nonce -= 1
+                    return {"error": result.get('error', 'Send failed')}
+            except Exception as e:
+                self.last_nonce -= 1
+                return {"error": str(e)}
+    
+    def queue_send(self, recipient, amount, fee=None):
+        # Outbox mode: sign, persist, acknowledge; the flusher submits once the node is reachable
+        with self.send_lock:
+            try:
+                amount = round(float(amount), 6)
+                tx_fee = round(float(fee), 6) if fee is not None else self.tx_fee
+                self.last_nonce += 1
+                nonce = self.last_nonce
+                tx_data = self.sign_tx(recipient, amount, nonce, tx_fee)
                 self.save_key()
-                return {"success": True, "txid": result.get('txid'), "pending_block": result.get('pending_block'), "nonce": nonce, "fee": tx_fee, "amount": amount}
-            else:
+                entry = self.outbox.enqueue(tx_data, tx_fee)
+                return {"success": True, "queued": True, "outbox_id": entry['id'], "nonce": nonce, "fee": tx_fee, "amount": amount}
+            except Exception as e:
                 self.last_nonce -= 1
-                return {"error": result.get('error', 'Send failed')}
-        except Exception as e:
-            self.last_nonce -= 1
-            return {"error": str(e)}
+                return {"error": str(e)}
 
 # ---------------- Flask API ----------------
 app = Flask(__name__)
 wallet = None
 local_port = 8080
 
+class AdmissionPool:
+    # At most `limit` requests run at once and at most `queue_limit` wait for a slot;
+    # anything beyond that is rejected immediately instead of parking another thread.
+    def __init__(self, name, limit, queue_limit, wait=ADMISSION_WAIT):
+        self.name = name
+        self.slots = threading.BoundedSemaphore(limit)
+        self.queue_limit = queue_limit
+        self.wait = wait
+        self.waiting = 0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        if self.slots.acquire(blocking=False):
+            return True
+        with self.lock:
+            if self.waiting >= self.queue_limit:
+                return False
+            self.waiting += 1
+        try:
+            return self.slots.acquire(timeout=self.wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+    
+    def release(self):
+        self.slots.release()
+
+read_pool = AdmissionPool('read', READ_CONCURRENCY, READ_QUEUE_LIMIT)
+send_pool = AdmissionPool('send', SEND_CONCURRENCY, SEND_QUEUE_LIMIT)
+export_pool = AdmissionPool('export', EXPORT_CONCURRENCY, EXPORT_QUEUE_LIMIT)
+# Full-history walks can take thousands of page fetches; kept apart so they never starve read_pool
+walk_pool = AdmissionPool('walk', WALK_CONCURRENCY, WALK_QUEUE_LIMIT)
+
+def shed(pool):
+    log.warning("Shedding %s: %s pool saturated", request.path, pool.name)
+    resp = jsonify({"code": 503, "error": "Wallet service busy, retry later"})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+    return resp
+
+def admitted(pool):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not pool.acquire():
+                return shed(pool)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                pool.release()
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_context():
+    _log_context.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+
+@app.after_request
+def add_request_id(resp):
+    resp.headers['X-Request-ID'] = getattr(_log_context, 'request_id', None) or ''
+    return resp
+
+@app.teardown_request
+def clear_request_context(exc):
+    _log_context.request_id = None
+
+@app.before_request
+def start_server_timing():
+    if server_timing:
+        _timing.phases = {}
+        _timing.start = time.perf_counter()
+
+@app.after_request
+def add_server_timing(resp):
+    phases = getattr(_timing, 'phases', None)
+    if phases is not None:
+        _timing.phases = None
+        entries = [f"{name};dur={dur:.1f}" for name, dur in phases.items()]
+        entries.append(f"total;dur={(time.perf_counter() - _timing.start) * 1000:.1f}")
+        resp.headers['Server-Timing'] = ', '.join(entries)
+    return resp
+
+def conditional_json(payload):
+    with timed('encode'):
+        body = jsonify(payload).get_data()
+    return conditional_body(body)
+
+def conditional_body(body):
+    # Weak ETag over the JSON body: unchanged polls get a bodyless 304, large bodies go out gzip'd
+    with timed('encode'):
+        resp = Response(body, mimetype='application/json')
+        resp.set_etag(hashlib.sha1(resp.get_data()).hexdigest(), weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.make_conditional(request)
+        if resp.status_code == 200:
+            resp.vary.add('Accept-Encoding')
+            body = resp.get_data()
+            if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings:
+                resp.set_data(gzip.compress(body, compresslevel=5))
+                resp.headers['Content-Encoding'] = 'gzip'
+        return resp
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE, main_node=MAIN_NODE, port=local_port)
 
 @app.route('/api/status', methods=['GET'])
 def api_status():
-    return jsonify({"code": 200, "coin_addr": wallet.coin_addr, "status": "active", "main_node": MAIN_NODE, "tx_fee": wallet.tx_fee})
+    return jsonify({"code": 200, "coin_addr": wallet.coin_addr, "status": "active", "main_node": MAIN_NODE, "tx_fee": wallet.tx_fee, "stale": sorted(wallet.stale)})
 
 @app.route('/api/balance', methods=['GET'])
+@admitted(read_pool)
 def api_balance():
+    balance = wallet.warm_value('balance')
+    if balance is not None:
+        return conditional_json({"code": 200, "balance": balance, "coin_addr": wallet.coin_addr, "stale": True})
     balance = wallet.get_balance()
-    return jsonify({"code": 200, "balance": balance, "coin_addr": wallet.coin_addr})
+    return conditional_json({"code": 200, "balance": balance, "coin_addr": wallet.coin_addr})
 
 @app.route('/api/history', methods=['GET'])
+@admitted(read_pool)
 def api_history():
-    data = wallet.get_history()
-    return jsonify({"code": 200, "transactions": data.get('transactions', []), "total_transactions": data.get('total', 0)})
+    page = max(request.args.get('page', 1, type=int), 1)
+    size = min(max(request.args.get('size', 50, type=int), 1), 200)
+    data = wallet.warm_value('history') if (page, size) == (1, 50) else None
+    if data is not None:
+        return conditional_json({"code": 200, "transactions": data.get('transactions', []), "total_transactions": data.get('total', 0), "stale": True})
+    data = wallet.get_history(size=size, page=page)
+    return conditional_json({"code": 200, "transactions": data.get('transactions', []), "total_transactions": data.get('total', 0)})
+
+@app.route('/api/history/summary', methods=['GET'])
+@admitted(walk_pool)
+def api_history_summary():
+    by = request.args.get('by', 'counterparty')
+    if by not in ('counterparty', 'day'):
+        return jsonify({"code": 400, "error": "by must be counterparty or day"}), 400
+    stale = False
+    try:
+        wallet.history_columns.sync(0 if request.args.get('refresh') else HISTORY_SYNC_TTL)
+    except NodeUnavailable as e:
+        log.warning("History sync failed: %s", e)
+        if not wallet.history_columns.complete:
+            return jsonify({"code": 503, "error": f"History not synced yet: {e}"}), 503
+        stale = True
+    summary = wallet.history_columns.summary(
+        by,
+        since=request.args.get('since', type=int),
+        until=request.args.get('until', type=int),
+        include_pending=bool(request.args.get('include_pending')),
+        limit=min(max(request.args.get('limit', 100, type=int), 1), 10000)
+    )
+    return conditional_json({"code": 200, **summary, "stale": stale})
+
+@app.route('/api/history/export', methods=['GET'])
+def api_history_export():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({"code": 400, "error": "format must be ndjson or csv"}), 400
+    # Not @admitted: the slot must be held until the stream is done, not until the view returns
+    if not export_pool.acquire():
+        return shed(export_pool)
+    try:
+        start = max(request.args.get('page', 1, type=int), 1)
+        pages = iter_history_pages(wallet, start, request.args.get('after'))
+        # The first page is fetched before answering so an unreachable node is a clean 503
+        first = next(pages)
+    except NodeUnavailable as e:
+        pages.close()
+        export_pool.release()
+        return jsonify({"code": 503, "error": f"Master node unavailable: {e}"}), 503
+    except Exception:
+        export_pool.release()
+        raise
+    
+    def generate():
+        if start == 1:
+            yield export_header(fmt)
+        yield export_rows(first[1], fmt)
+        try:
+            for _, txs in pages:
+                yield export_rows(txs, fmt)
+        except NodeUnavailable as e:
+            log.warning("History export cut short: %s", e)
+    
+    headers = {'Content-Disposition': f'attachment; filename="history-{wallet.coin_addr}.{fmt}"', 'Vary': 'Accept-Encoding'}
+    body = generate()
+    if 'gzip' in request.accept_encodings:
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    resp = Response(body, mimetype=EXPORT_MIMETYPES[fmt], headers=headers)
+    # Runs once the server has sent the body or the client went away
+    resp.call_on_close(export_pool.release)
+    return resp
+
+@app.route('/api/audit', methods=['POST'])
+@admitted(walk_pool)
+def api_audit():
+    try:
+        report = wallet.audit.run(full=bool(request.args.get('full')))
+    except NodeUnavailable as e:
+        return jsonify({"code": 503, "error": f"Master node unavailable: {e}"}), 503
+    if report is None:
+        return jsonify({"code": 409, "error": "An audit is already running"}), 409
+    return jsonify({"code": 200, **report})
 
 @app.route('/api/send', methods=['POST'])
+@admitted(send_pool)
 def api_send():
     data = request.json or {}
     recipient = data.get('recipient')
@@ -498,6 +2233,17 @@ def api_send():
     if "error" in result:
         return jsonify({"code": 400, "error": result["error"]}), 400
     
+    if result.get("queued"):
+        return jsonify({
+            "code": 202,
+            "success": True,
+            "queued": True,
+            "outbox_id": result["outbox_id"],
+            "nonce": result["nonce"],
+            "fee": result["fee"],
+            "amount": result["amount"]
+        }), 202
+    
     return jsonify({
         "code": 201, 
         "success": True, 
@@ -508,28 +2254,558 @@ def api_send():
         "amount": result["amount"]
     }), 201
 
+@app.route('/api/portfolio', methods=['GET'])
+@admitted(read_pool)
+def api_portfolio():
+    max_age = 0 if request.args.get('refresh') else PORTFOLIO_CACHE_TTL
+    return conditional_json({"code": 200, **wallet.get_portfolio(max_age)})
+
+@app.route('/api/watch', methods=['GET'])
+def api_watch_list():
+    return jsonify({"code": 200, "addresses": wallet.watch_addrs})
+
+@app.route('/api/watch', methods=['POST'])
+def api_watch_add():
+    addr = (request.json or {}).get('address')
+    if not wallet.add_watch(addr):
+        return jsonify({"code": 400, "error": "Invalid address format"}), 400
+    return jsonify({"code": 200, "addresses": wallet.watch_addrs})
+
+@app.route('/api/watch/<addr>', methods=['DELETE'])
+def api_watch_remove(addr):
+    if not wallet.remove_watch(addr):
+        return jsonify({"code": 404, "error": "Address is not being watched"}), 404
+    return jsonify({"code": 200, "addresses": wallet.watch_addrs})
+
+@app.route('/api/pending', methods=['GET'])
+def api_pending():
+    return jsonify({"code": 200, **wallet.tracker.status()})
+
+@app.route('/api/outbox', methods=['GET'])
+def api_outbox():
+    if wallet.outbox is None:
+        return jsonify({"code": 404, "error": "Outbox mode is not enabled"}), 404
+    return jsonify({"code": 200, **wallet.outbox.status()})
+
+@app.route('/api/outbox/<entry_id>', methods=['GET'])
+def api_outbox_entry(entry_id):
+    entry = wallet.outbox.get(entry_id) if wallet.outbox is not None else None
+    if entry is None:
+        return jsonify({"code": 404, "error": "Outbox entry not found"}), 404
+    return jsonify({"code": 200, "entry": entry})
+
+@app.route('/api/admin/profile', methods=['POST'])
+def api_admin_profile():
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({"code": 403, "error": "Admin endpoints are local-only"}), 403
+    seconds = request.args.get('seconds', 30, type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({"code": 400, "error": f"seconds must be between 0 and {PROFILE_MAX_SECONDS}"}), 400
+    profiler = SamplingProfiler(seconds)
+    if not profiler.start():
+        return jsonify({"code": 409, "error": "A profile is already running"}), 409
+    return jsonify({"code": 202, "file": profiler.path, "seconds": seconds}), 202
+
 @app.route('/api/chain/stats', methods=['GET'])
+@admitted(read_pool)
 def api_chain_stats():
+    data = wallet.warm_value('chain_stats')
+    if data is not None:
+        return conditional_json({**data, "stale": True})
     try:
-        resp = requests.get(f"http://{MAIN_NODE}/chain/stats", timeout=10)
-        return jsonify(resp.json())
+        status, body = wallet.node_get_raw("/chain/stats")
+        if status != 200:
+            return conditional_json(json.loads(body))
+        # Forwarded as received; it is only parsed (for the snapshot) when the node sends a new body
+        if body != wallet.chain_stats_body:
+            data = json.loads(body)
+            if data.get('code') == 200:
+                wallet.remember('chain_stats', data)
+            wallet.chain_stats_body = body
+        return conditional_body(body)
     except Exception as e:
         return jsonify({"code": 500, "error": str(e)}), 500
 
+# ---------------- JSON-RPC (Unix Socket) ----------------
+# Newline-delimited JSON-RPC 2.0: one request (or batch array) per line, one reply per line.
+# Clients may pipeline requests on a single connection; replies come back in request order.
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+def rpc_params(params, names):
+    if isinstance(params, list):
+        return dict(zip(names, params))
+    if isinstance(params, dict):
+        return params
+    if params is None:
+        return {}
+    raise RpcError(-32602, "Invalid params")
+
+def rpc_send_args(params):
+    args = rpc_params(params, ['recipient', 'amount', 'fee'])
+    recipient = args.get('recipient')
+    amount = args.get('amount')
+    fee = args.get('fee')
+    if not recipient or amount is None:
+        raise RpcError(-32602, "Missing parameters")
+    try:
+        amount = float(amount)
+        fee = float(fee) if fee is not None else None
+    except (TypeError, ValueError):
+        raise RpcError(-32602, "Invalid amount format")
+    if amount <= 0:
+        raise RpcError(-32602, "Amount must be greater than 0")
+    return recipient, amount, fee
+
+def rpc_status(params):
+    return {"coin_addr": wallet.coin_addr, "status": "active", "main_node": MAIN_NODE, "tx_fee": wallet.tx_fee}
+
+def rpc_get_balance(params):
+    return {"balance": wallet.get_balance(), "coin_addr": wallet.coin_addr}
+
+def rpc_history(params):
+    data = wallet.get_history()
+    return {"transactions": data.get('transactions', []), "total_transactions": data.get('total', 0)}
+
+def rpc_history_summary(params):
+    p = rpc_params(params, ['by', 'since', 'until', 'include_pending', 'limit'])
+    by = p.get('by') or 'counterparty'
+    if by not in ('counterparty', 'day'):
+        raise RpcError(-32602, "by must be counterparty or day")
+    try:
+        since = int(p['since']) if p.get('since') is not None else None
+        until = int(p['until']) if p.get('until') is not None else None
+        limit = min(max(int(p.get('limit') or 100), 1), 10000)
+    except (TypeError, ValueError):
+        raise RpcError(-32602, "Invalid params")
+    try:
+        wallet.history_columns.sync()
+    except NodeUnavailable as e:
+        raise RpcError(-32000, f"History sync failed: {e}")
+    return wallet.history_columns.summary(by, since, until, bool(p.get('include_pending')), limit)
+
+def rpc_audit(params):
+    try:
+        report = wallet.audit.run(full=bool(rpc_params(params, ['full']).get('full')))
+    except NodeUnavailable as e:
+        raise RpcError(-32000, f"Master node unavailable: {e}")
+    if report is None:
+        raise RpcError(-32000, "An audit is already running")
+    return report
+
+def rpc_portfolio(params):
+    refresh = rpc_params(params, ['refresh']).get('refresh')
+    return wallet.get_portfolio(0 if refresh else PORTFOLIO_CACHE_TTL)
+
+def rpc_pending(params):
+    return wallet.tracker.status()
+
+def rpc_outbox_status(params):
+    if wallet.outbox is None:
+        raise RpcError(-32000, "Outbox mode is not enabled")
+    entry_id = rpc_params(params, ['id']).get('id')
+    if entry_id is None:
+        return wallet.outbox.status()
+    entry = wallet.outbox.get(entry_id)
+    if entry is None:
+        raise RpcError(-32000, "Outbox entry not found")
+    return entry
+
+def rpc_send(params):
+    result = wallet.send(*rpc_send_args(params))
+    if "error" in result:
+        raise RpcError(-32000, result["error"])
+    return result
+
+def rpc_send_batch(params):
+    if isinstance(params, dict):
+        params = params.get('transactions')
+    if not isinstance(params, list):
+        raise RpcError(-32602, "Invalid params")
+    results = []
+    for item in params:
+        try:
+            results.append(wallet.send(*rpc_send_args(item)))
+        except RpcError as e:
+            results.append({"error": e.message})
+    return results
+
+RPC_METHODS = {
+    'getBalance': rpc_get_balance,
+    'send': rpc_send,
+    'sendBatch': rpc_send_batch,
+    'history': rpc_history,
+    'historySummary': rpc_history_summary,
+    'audit': rpc_audit,
+    'status': rpc_status,
+    'pending': rpc_pending,
+    'outboxStatus': rpc_outbox_status,
+    'portfolio': rpc_portfolio,
+}
+
+def rpc_call(req):
+    req_id = req.get('id') if isinstance(req, dict) else None
+    # A notification (well-formed call without an id) never gets a reply, not even an error
+    notification = isinstance(req, dict) and isinstance(req.get('method'), str) and 'id' not in req
+    _log_context.request_id = uuid.uuid4().hex[:16]
+    try:
+        if not isinstance(req, dict) or not isinstance(req.get('method'), str):
+            raise RpcError(-32600, "Invalid Request")
+        method = RPC_METHODS.get(req['method'])
+        if method is None:
+            raise RpcError(-32601, "Method not found")
+        result = method(req.get('params'))
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "result": result, "id": req_id}
+    except RpcError as e:
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "error": {"code": e.code, "message": e.message}, "id": req_id}
+    except Exception as e:
+        log.exception("RPC call failed")
+        if notification:
+            return None
+        return {"jsonrpc": "2.0", "error": {"code": -32603, "message": str(e)}, "id": req_id}
+    finally:
+        _log_context.request_id = None
+
+def rpc_handle_line(line):
+    try:
+        req = json.loads(line)
+    except ValueError:
+        return {"jsonrpc": "2.0", "error": {"code": -32700, "message": "Parse error"}, "id": None}
+    if isinstance(req, list):
+        if not req:
+            return {"jsonrpc": "2.0", "error": {"code": -32600, "message": "Invalid Request"}, "id": None}
+        replies = [r for r in (rpc_call(item) for item in req) if r is not None]
+        return replies or None
+    return rpc_call(req)
+
+class RpcHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            reply = rpc_handle_line(line)
+            if reply is not None:
+                self.wfile.write(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+
+def start_rpc_server(path):
+    if not hasattr(socket, 'AF_UNIX'):
+        log.warning("Unix sockets not supported on this platform, JSON-RPC disabled")
+        return None
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+    # Socket is created owner-only: the RPC channel can move funds
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, RpcHandler)
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ---------------- Record / Replay ----------------
+# Every master-node exchange made through CoinWallet.http can be recorded to a gzip'd
+# JSON-lines file and served back later by a stand-in node, for offline benchmarking.
+RECORD_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Retry-After')
+
+class NodeRecorder:
+    def __init__(self, path):
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.started = now()
+        atexit.register(self.close)
+    
+    def on_response(self, resp, *args, **kwargs):
+        url = urlsplit(resp.request.url)
+        body = resp.request.body
+        rec = {
+            "t": round(now() - self.started, 3),
+            "method": resp.request.method,
+            "path": url.path + ('?' + url.query if url.query else ''),
+            "request": body.decode('utf-8', 'replace') if isinstance(body, bytes) else body,
+            "status": resp.status_code,
+            "latency_ms": round(resp.elapsed.total_seconds() * 1000, 2),
+            "headers": {k: resp.headers[k] for k in RECORD_HEADERS if k in resp.headers},
+            "body": resp.text
+        }
+        line = json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+    
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class ReplayStore:
+    # Responses are served per (method, path) in recorded order, wrapping around at the end,
+    # so the same request sequence always gets the same answers.
+    def __init__(self, path, speed=1.0):
+        self.speed = speed
+        self.exchanges = defaultdict(list)
+        self.cursor = defaultdict(int)
+        self.lock = threading.Lock()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.exchanges[(rec['method'], rec['path'])].append(rec)
+            except EOFError:
+                log.warning("Recording %s is truncated, replaying what was read", path)
+    
+    def next(self, method, path, revalidating):
+        recs = self.exchanges.get((method, path))
+        if not recs:
+            return None
+        if not revalidating:
+            # A 304 only makes sense to a client holding a cached copy
+            recs = [r for r in recs if r['status'] != 304] or recs
+        with self.lock:
+            i = self.cursor[(method, path, revalidating)]
+            self.cursor[(method, path, revalidating)] = i + 1
+        return recs[i % len(recs)]
+
+replay_app = Flask('replay')
+replay_store = None
+
+@replay_app.route('/', defaults={'path': ''}, methods=['GET', 'POST'])
+@replay_app.route('/<path:path>', methods=['GET', 'POST'])
+def replay(path):
+    full_path = request.full_path.rstrip('?')
+    revalidating = bool(request.headers.get('If-None-Match') or request.headers.get('If-Modified-Since'))
+    rec = replay_store.next(request.method, full_path, revalidating)
+    if rec is None:
+        return jsonify({"code": 404, "error": f"No recorded response for {request.method} {full_path}"}), 404
+    if replay_store.speed > 0:
+        time.sleep(rec['latency_ms'] / 1000 / replay_store.speed)
+    return Response(rec['body'], status=rec['status'], headers=rec['headers'])
+
+def run_replay(path, port, speed):
+    global replay_store
+    replay_store = ReplayStore(path, speed)
+    total = sum(len(v) for v in replay_store.exchanges.values())
+    log.info("Replaying %d recorded exchanges from %s on 127.0.0.1:%d (speed x%s)", total, path, port, speed)
+    replay_app.run(host='127.0.0.1', port=port, debug=False, threaded=True, use_reloader=False)
+
+# ---------------- Stand-in Node ----------------
+# A minimal local master node: heartbeats (single and batched) plus empty chain, balance and
+# history answers, enough to run a wallet against and to measure heartbeat throughput.
+class StandInNode:
+    def __init__(self):
+        self.online = {}  # coin_addr -> (real_address, last seen)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_in = 0
+        self.verified = 0
+    
+    def count(self):
+        with self.lock:
+            self.requests += 1
+            self.bytes_in += len(str(request.headers)) + (request.content_length or 0)
+    
+    def check(self, real_address, coin_addr, pubkey_hex, timestamp=None, signature=None):
+        # Returns the rejection reason, or None once the address is marked online
+        try:
+            pk_bytes = bytes.fromhex(pubkey_hex)
+        except (TypeError, ValueError):
+            return "invalid pubkey"
+        if address_of(pk_bytes) != coin_addr:
+            return "address does not match pubkey"
+        if signature is not None:
+            if not verify(pk_bytes, signature, heartbeat_payload(real_address, coin_addr, timestamp)):
+                return "bad signature"
+            with self.lock:
+                self.verified += 1
+        with self.lock:
+            self.online[coin_addr] = (real_address, now())
+        return None
+    
+    def online_count(self):
+        cutoff = now() - HEARTBEAT_INTERVAL * 3
+        with self.lock:
+            return sum(1 for _, seen in self.online.values() if seen >= cutoff)
+
+standin_app = Flask('standin')
+standin = StandInNode()
+
+@standin_app.route('/heartbeat', methods=['POST'])
+def standin_heartbeat():
+    standin.count()
+    data = request.get_json(silent=True) or {}
+    error = standin.check(data.get('real_address'), data.get('coin_addr'), data.get('pubkey_hex'))
+    if error:
+        return jsonify({"code": 400, "error": error}), 400
+    return jsonify({"code": 200, "coin_addr": data['coin_addr'], "heartbeat_interval": HEARTBEAT_INTERVAL})
+
+@standin_app.route('/heartbeat/batch', methods=['POST'])
+def standin_heartbeat_batch():
+    standin.count()
+    data = request.get_json(silent=True) or {}
+    timestamp = data.get('timestamp')
+    heartbeats = data.get('heartbeats')
+    if not isinstance(timestamp, int) or not isinstance(heartbeats, list) or len(heartbeats) > HEARTBEAT_BATCH_SIZE:
+        return jsonify({"code": 400, "error": "Invalid batch"}), 400
+    if abs(now() - timestamp) > HEARTBEAT_MAX_SKEW:
+        return jsonify({"code": 400, "error": "Stale timestamp"}), 400
+    rejected = {}
+    for hb in heartbeats:
+        if not isinstance(hb, dict):
+            return jsonify({"code": 400, "error": "Invalid batch"}), 400
+        error = standin.check(data.get('real_address'), hb.get('coin_addr'), hb.get('pubkey_hex'), timestamp, hb.get('signature'))
+        if error:
+            rejected[hb.get('coin_addr')] = error
+    return jsonify({"code": 200, "accepted": len(heartbeats) - len(rejected), "rejected": rejected, "heartbeat_interval": HEARTBEAT_INTERVAL})
+
+@standin_app.route('/chain/stats', methods=['GET'])
+def standin_chain_stats():
+    standin.count()
+    return jsonify({"code": 200, "stats": {"total_online_nodes": standin.online_count(), "latest_block_height": 0, "tx_fee": 2.0}})
+
+@standin_app.route('/balance/<addr>', methods=['GET'])
+def standin_balance(addr):
+    standin.count()
+    return jsonify({"code": 200, "coin_addr": addr, "balance": 0})
+
+@standin_app.route('/address/transactions', methods=['GET'])
+def standin_history():
+    standin.count()
+    return jsonify({"code": 200, "data": {"transactions": [], "total": 0}})
+
+def run_standin(port):
+    log.info("Stand-in master node on 127.0.0.1:%d", port)
+    standin_app.run(host='127.0.0.1', port=port, debug=False, threaded=True, use_reloader=False)
+
+def bench_heartbeat(count):
+    # One heartbeat round for `count` addresses against an in-process stand-in node, per protocol
+    global MAIN_NODE
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access line per request
+    server = make_server('127.0.0.1', 0, standin_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    MAIN_NODE = f"127.0.0.1:{server.server_port}"
+    keys = [gen_keypair() for _ in range(count)]
+    bench = CoinWallet()
+    bench.public_ip, bench.public_ip_at = '127.0.0.1', now()
+    bench.announce_keys = keys
+    print(f"{count + 1} addresses, crypto backend {crypto.name}")
+    print(f"{'protocol':<10} {'requests':>9} {'KiB sent':>10} {'seconds':>9} {'addr/s':>9}")
+    for protocol in ('single', 'batch'):
+        bench.hb_batch = protocol == 'batch'
+        bench.hb_batch_checked = now()
+        before = (standin.requests, standin.bytes_in)
+        start = time.perf_counter()
+        ok = bench.register()
+        elapsed = time.perf_counter() - start
+        requests_sent = standin.requests - before[0]
+        sent = (standin.bytes_in - before[1]) / 1024
+        print(f"{protocol:<10} {requests_sent:>9} {sent:>10.1f} {elapsed:>9.2f} {(count + 1) / elapsed:>9.0f}{'' if ok else '  FAILED'}")
+    server.shutdown()
+
 # ---------------- Main Function ----------------
 def main():
-    global wallet, local_port
+    global wallet, local_port, server_timing, MAIN_NODE, crypto
     
     parser = argparse.ArgumentParser(description='Coin Wallet - XODE Wallet Client')
     parser.add_argument('-p', '--port', default=8080, type=int, help='Local Web port (default 8080)')
+    parser.add_argument('--rpc-socket', default=RPC_SOCKET, help=f'JSON-RPC Unix socket path (default {RPC_SOCKET})')
+    parser.add_argument('--no-rpc', action='store_true', help='Disable the JSON-RPC Unix socket')
+    parser.add_argument('--webhook', help='URL to POST to when a sent transaction confirms')
+    parser.add_argument('--profile', type=float, metavar='SECONDS', help=f'Sample all threads for SECONDS after startup and write a folded-stack profile to {PROFILE_DIR}/')
+    parser.add_argument('--server-timing', action='store_true', help='Add per-phase Server-Timing headers to API responses')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Log level (default INFO)')
+    parser.add_argument('--watch', action='append', default=[], metavar='ADDR', help=f'Add a watch-only address (saved to {WATCH_FILE}, repeatable)')
+    parser.add_argument('--node', default=MAIN_NODE, help=f'Master node address (default {MAIN_NODE})')
+    parser.add_argument('--record', metavar='FILE', help='Record all master-node requests and responses to FILE (gzip JSON lines)')
+    parser.add_argument('--replay', metavar='FILE', help='Serve a recording as a stand-in master node instead of running the wallet')
+    parser.add_argument('--replay-port', default=9753, type=int, help='Port for --replay and --stand-in (default 9753)')
+    parser.add_argument('--stand-in', action='store_true', help='Run a minimal local master node (supports batched heartbeats) instead of the wallet')
+    parser.add_argument('--announce-keys', metavar='DIR', help='Also heartbeat for every key file in DIR, batched into one signed request where the node supports it')
+    parser.add_argument('--bench-heartbeat', type=int, metavar='ADDRS', help='Measure single vs batched heartbeats for ADDRS addresses against a stand-in node and exit')
+    parser.add_argument('--speed', default=1.0, type=float, help='Replay latency scale: 2 = twice as fast, 0 = no delay (default 1)')
+    parser.add_argument('--crypto', default=CRYPTO_BACKEND, choices=['auto', 'ecdsa', 'coincurve'], help=f'ECDSA backend (default {CRYPTO_BACKEND})')
+    parser.add_argument('--bench-crypto', type=int, metavar='ROUNDS', help='Benchmark the ECDSA backends and exit')
+    parser.add_argument('--audit', nargs='?', const='new', choices=['new', 'full'], help='Verify history signatures locally and exit: new entries only (default) or the full history')
+    parser.add_argument('--export', metavar='FILE', help='Export the full history to FILE and exit (resumes if interrupted)')
+    parser.add_argument('--format', choices=['ndjson', 'csv'], help='--export format (default: from the file extension, else ndjson)')
+    parser.add_argument('--outbox', action='store_true', help=f'Queue signed transactions in {OUTBOX_FILE} and submit them in the background')
     args = parser.parse_args()
     local_port = args.port
+    server_timing = args.server_timing
+    setup_logging(args.log_level)
+    MAIN_NODE = args.node
+    try:
+        crypto = load_crypto_backend(args.crypto)
+    except ImportError:
+        parser.error("--crypto coincurve needs the coincurve package (pip install coincurve)")
+    
+    if args.bench_crypto:
+        bench_crypto(args.bench_crypto)
+        return
+    
+    if args.replay:
+        run_replay(args.replay, args.replay_port, args.speed)
+        return
+    
+    if args.stand_in:
+        run_standin(args.replay_port)
+        return
+    
+    if args.bench_heartbeat:
+        bench_heartbeat(args.bench_heartbeat)
+        return
     
     wallet = CoinWallet()
+    if args.audit:
+        try:
+            report = wallet.audit.run(full=args.audit == 'full')
+        except NodeUnavailable as e:
+            log.error("Audit failed, master node unavailable: %s", e)
+            sys.exit(2)
+        sys.exit(1 if report['mismatches'] else 0)
+    if args.export:
+        fmt = args.format or ('csv' if args.export.lower().endswith('.csv') else 'ndjson')
+        try:
+            export_history(wallet, args.export, fmt)
+        except NodeUnavailable as e:
+            log.error("Export interrupted, rerun to resume: %s", e)
+            sys.exit(2)
+        except ValueError as e:
+            log.error("Export failed: %s", e)
+            sys.exit(2)
+        return
+    if args.record:
+        wallet.http.hooks['response'].append(NodeRecorder(args.record).on_response)
+    wallet.tracker.webhook = args.webhook
+    if args.announce_keys:
+        wallet.load_announce_keys(args.announce_keys)
+    for addr in args.watch:
+        if not wallet.add_watch(addr):
+            log.warning("Ignoring invalid watch address: %s", addr)
+    if args.outbox:
+        wallet.outbox = Outbox(wallet)
     
     # 启动心跳线程
     hb_thread = threading.Thread(target=wallet.heartbeat_loop, daemon=True)
     hb_thread.start()
+    threading.Thread(target=wallet.tracker.loop, daemon=True).start()
+    threading.Thread(target=wallet.snapshot_loop, daemon=True).start()
+    atexit.register(wallet.save_snapshot)
+    if wallet.outbox is not None:
+        threading.Thread(target=wallet.outbox.loop, daemon=True).start()
+    
+    rpc_server = None if args.no_rpc else start_rpc_server(args.rpc_socket)
+    if args.profile:
+        SamplingProfiler(args.profile).start()
     
     print(f"""
 ╔════════════════════════════════════════════════╗
@@ -548,10 +2824,13 @@ def main():
     try:
         import webbrowser
         webbrowser.open(f'http://127.0.0.1:{local_port}')
-        print("🌐 Browser opened automatically")
+        log.info("Browser opened automatically")
     except:
         pass
     
+    if rpc_server:
+        log.info("JSON-RPC socket: %s", args.rpc_socket)
+    
     app.run(host='0.0.0.0', port=local_port, debug=False, threaded=True, use_reloader=False)
 
 if __name__ == '__main__':